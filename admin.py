@@ -0,0 +1,161 @@
+import hmac
+import threading
+import time
+import tracemalloc
+
+import streamlit as st
+
+from profiling import SamplingProfiler, live_sessions, process_rss, session_sizes
+from resources import get_job_runner, get_live_captures, get_memory_tracker, get_recording_store, get_write_behind
+
+# Operator page, shown instead of the test at ?admin when ADMIN_SECRET is set (app.py).
+# It profiles the script threads of every session for a few seconds, tracks memory with
+# tracemalloc snapshots and lists the live sessions by the size of their state. Profiles
+# and snapshots can be downloaded as folded stacks for a flame graph viewer, for example
+# https://www.speedscope.app or flamegraph.pl.
+
+def authorized(secret):
+    if st.session_state.get("admin_authorized"):
+        return True
+    password = st.text_input("Admin secret", type="password")
+    if password and hmac.compare_digest(password.encode(), secret.encode()):
+        st.session_state.admin_authorized = True
+        return True
+    if password:
+        st.error("Wrong secret")
+    return False
+
+def megabytes(n):
+    return f"{n / 2 ** 20:.1f} MB"
+
+def show_process():
+    store = get_recording_store().stats()
+    cols = st.columns(5)
+    cols[0].metric("RSS", megabytes(process_rss()))
+    cols[1].metric("Sessions", len(live_sessions()))
+    cols[2].metric("Threads", threading.active_count())
+    cols[3].metric("Recordings in memory", megabytes(store["memory_bytes"]))
+    cols[4].metric("Recordings spilled", megabytes(store["spilled_bytes"]))
+    st.caption(f"Jobs: {get_job_runner().stats()}")
+
+    try:
+        writes = get_write_behind().stats()
+    except Exception as e:
+        st.caption(f"Write-behind: not available ({e})")
+        return
+    st.caption(f"Write-behind: {writes['pending']} rows pending, {writes['dead']} dead, "
+               f"last error: {writes['last_error'] or 'none'}")
+    if writes['dead'] and st.button(f"Requeue {writes['dead']} dead rows"):
+        # For rows the database rejected, once the cause is fixed
+        get_write_behind().journal.requeue_dead()
+        st.rerun()
+
+def session_names():
+    # Script threads are labelled with the participant's name where there is one
+    names = {}
+    for session_id, state, _ in live_sessions():
+        label = state.get("user_name") or state.get("user_id")
+        names[session_id] = f"{session_id[:8]} {label}" if label else session_id[:8]
+    return names
+
+def show_profiler():
+    st.subheader("CPU profile")
+    col1, col2, col3 = st.columns(3)
+    seconds = col1.number_input("Seconds", min_value=1, max_value=300, value=10)
+    interval_ms = col2.number_input("Sample every (ms)", min_value=1, max_value=100, value=5)
+    scope = col3.radio("Threads", ["Script threads", "All threads"], horizontal=True)
+
+    if st.button("Run profile", type="primary"):
+        profiler = SamplingProfiler(interval_ms / 1000, scope == "Script threads", session_names())
+        with st.spinner(f"Sampling for {seconds} s"):
+            st.session_state.admin_profile = profiler.run(seconds)
+
+    profile = st.session_state.get("admin_profile")
+    if profile is None:
+        return
+    total = sum(profile.stacks.values())
+    st.caption(f"{profile.samples} samples in {profile.seconds:.1f} s, {total} thread stacks. Threads are sampled "
+               "whether they run or wait, so waits on the network or locks show up too.")
+    if not total:
+        st.info("No matching thread was running during the profile")
+        return
+    st.download_button("Download folded stacks", profile.folded(), file_name=f"profile-{int(time.time())}.folded")
+    st.markdown("**By session or thread**")
+    st.dataframe(
+        [{"Session or thread": root, "Samples": count, "Share": f"{count / total:.1%}"}
+         for root, count in profile.by_root()],
+        hide_index=True, use_container_width=True
+    )
+    st.markdown("**Functions**")
+    st.dataframe(
+        [{"Function": name, "Self": f"{own / total:.1%}", "Total": f"{count / total:.1%}"}
+         for name, own, count in profile.top_functions()],
+        hide_index=True, use_container_width=True
+    )
+
+def show_memory():
+    st.subheader("Memory snapshots")
+    tracker = get_memory_tracker()
+    col1, col2, col3 = st.columns(3)
+    if not tracker.tracing:
+        st.caption("tracemalloc is off. While it is on, every allocation is slower.")
+        if col1.button("Start tracing"):
+            tracker.start()
+            tracker.snapshot()
+            st.rerun()
+        return
+
+    if col1.button("Take snapshot", type="primary"):
+        tracker.snapshot()
+    if col2.button("Stop tracing"):
+        tracker.stop()
+        st.rerun()
+
+    current, peak = tracemalloc.get_traced_memory()
+    st.caption(f"{len(tracker.snapshots)} snapshots; traced {megabytes(current)} now, {megabytes(peak)} at peak")
+    folded = tracker.folded()
+    if folded:
+        col3.download_button("Download folded allocations", folded, file_name=f"memory-{int(time.time())}.folded")
+
+    against = st.radio("Compare with", ["previous", "first"], horizontal=True)
+    diff = tracker.diff(against)
+    if not diff:
+        st.info("Take another snapshot to see what changed")
+        return
+    st.dataframe(
+        [{
+            "Where": str(stat.traceback[0]) if stat.traceback else "?",
+            "Change": megabytes(stat.size_diff),
+            "Size": megabytes(stat.size),
+            "Blocks": stat.count_diff
+        } for stat in diff],
+        hide_index=True, use_container_width=True
+    )
+
+def show_sessions():
+    st.subheader("Sessions")
+    rows = session_sizes(get_recording_store().session_bytes(), get_live_captures().buffer_bytes())
+    if not rows:
+        st.info("No sessions")
+        return
+    st.dataframe(
+        [{
+            "Session": row["session"][:8],
+            "User": row["name"] or row["user_id"],
+            "Script runs": row["script_runs"],
+            "session_state": megabytes(row["state_bytes"]),
+            "Recordings": megabytes(row["recording_bytes"]),
+            "Live audio": megabytes(row["live_audio_bytes"]),
+            "Largest keys": ", ".join(f"{key} {megabytes(size)}" for key, size in list(row["keys"].items())[:3])
+        } for row in rows],
+        hide_index=True, use_container_width=True
+    )
+
+def admin_page(secret):
+    st.title("sayStroop admin")
+    if not authorized(secret):
+        return
+    show_process()
+    show_profiler()
+    show_memory()
+    show_sessions()
@@ -0,0 +1,369 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from persistence import TRIAL_TYPES
+
+# Cross-participant analysis of stroop_trials. Rows are loaded from Supabase (paged by
+# id), the local SQLite database, or a CSV, Parquet or JSON lines export into one NumPy
+# array per column. Users and conditions become integer codes, and every statistic is a
+# group-by over those codes with bincount, lexsort and reduceat, so hundreds of
+# thousands of trials are summarized in well under a second.
+#
+#   python analysis.py stroop_trials.csv
+#   python analysis.py supabase --version onset-v2 --output summary.csv
+
+CONDITIONS = tuple(TRIAL_TYPES[phase] for phase in sorted(TRIAL_TYPES))
+COLUMNS = (
+    'id', 'user_id', 'trial_type', 'trial_number', 'spoken_color', 'reaction_time', 'correct', 'result_version'
+)
+PAGE_SIZE = 1000
+
+# Trimming defaults: anticipations below MIN_RT and responses after MAX_RT are dropped,
+# then anything further than TRIM_SD standard deviations from its user and condition mean
+MIN_RT = 0.2
+MAX_RT = None
+TRIM_SD = 2.5
+
+class Trials:
+    def __init__(self, columns):
+        # columns maps column names to sequences: a dict of lists, a DataFrame, ...
+        user_id = np.asarray(columns['user_id'], dtype=object)
+        self.users, self.user_index = np.unique(user_id.astype(str), return_inverse=True)
+        trial_type = np.asarray(columns['trial_type'], dtype=object).astype(str)
+        self.condition = np.full(len(trial_type), -1, dtype=np.int8)
+        for code, name in enumerate(CONDITIONS):
+            self.condition[trial_type == name] = code
+        self.reaction_time = np.asarray(columns['reaction_time'], dtype=np.float64)
+        self.correct = _as_bool(columns['correct'])
+        self.responded = ~_missing(columns['spoken_color'])
+        self.trial_number = np.asarray(columns['trial_number'], dtype=np.float64)
+        if 'result_version' in columns:
+            self.result_version = np.asarray(columns['result_version'], dtype=object)
+        else:
+            self.result_version = np.full(len(user_id), None, dtype=object)
+
+    def __len__(self):
+        return len(self.user_index)
+
+    def select(self, mask):
+        subset = object.__new__(Trials)
+        for name, value in vars(self).items():
+            subset.__dict__[name] = value if name == 'users' else value[mask]
+        return subset
+
+    def version(self, result_version):
+        # None selects the rows written by the app itself
+        if result_version is None:
+            return self.select(_missing(self.result_version))
+        return self.select(self.result_version == result_version)
+
+def _missing(values):
+    # None, NaN (how pandas reads an empty cell) or an empty string
+    return np.isin(np.asarray(values, dtype=object).astype(str), ("None", "nan", ""))
+
+def _as_bool(values):
+    array = np.asarray(values)
+    if array.dtype == bool:
+        return array
+    if array.dtype.kind in "iuf":
+        return np.nan_to_num(array.astype(np.float64)) != 0
+    return np.isin(np.char.lower(array.astype(str)), ("true", "t", "1", "1.0", "yes"))
+
+# Loading
+
+def load_supabase(client, version=None, page_size=PAGE_SIZE):
+    # Keyset paging on id; an offset would make every page slower than the last
+    names = COLUMNS
+    columns = {name: [] for name in names}
+    last_id = None
+    while True:
+        query = client.table('stroop_trials').select(",".join(names)).order('id').limit(page_size)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        if version is not None:
+            query = query.eq('result_version', version)
+        try:
+            page = query.execute().data
+        except Exception:
+            # result_version only exists once a re-scoring run has added it; without it
+            # every row was written by the app
+            if version is not None or last_id is not None or 'result_version' not in names:
+                raise
+            names = tuple(name for name in COLUMNS if name != 'result_version')
+            columns = {name: [] for name in names}
+            continue
+        for name, values in columns.items():
+            values.extend(row.get(name) for row in page)
+        if len(page) < page_size:
+            break
+        last_id = page[-1]['id']
+    return Trials(columns)
+
+def load_local(path):
+    import sqlite3
+
+    with sqlite3.connect(str(path)) as db:
+        available = {row[1] for row in db.execute("PRAGMA table_info(stroop_trials)")}
+        names = [name for name in COLUMNS if name in available]
+        rows = db.execute(f"SELECT {', '.join(names)} FROM stroop_trials ORDER BY id").fetchall()
+    return Trials({name: [row[i] for row in rows] for i, name in enumerate(names)})
+
+def load_export(path):
+    # CSV and Parquet go through pandas, which Streamlit already depends on
+    import pandas as pd
+
+    suffix = os.path.splitext(str(path))[1].lower()
+    if suffix == ".parquet":
+        frame = pd.read_parquet(path)
+    elif suffix in (".jsonl", ".json"):
+        frame = pd.read_json(path, lines=True)
+        if 'table' in frame:
+            frame = frame[frame['table'] == 'stroop_trials']
+    else:
+        frame = pd.read_csv(path)
+    return Trials({name: frame[name].to_numpy() for name in frame.columns})
+
+# Group-by primitives. index holds a group number per row, n the number of groups.
+
+def group_count(index, n, mask=None):
+    return np.bincount(index if mask is None else index[mask], minlength=n)
+
+def group_mean(index, values, n):
+    counts = np.bincount(index, minlength=n)
+    sums = np.bincount(index, weights=values, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+def group_std(index, values, n):
+    # Sample standard deviation, NaN for groups of fewer than two
+    counts = np.bincount(index, minlength=n)
+    mean = group_mean(index, values, n)
+    squares = np.bincount(index, weights=(values - mean[index]) ** 2, minlength=n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+def group_quantile(index, values, n, q):
+    # Linear interpolation between order statistics, like np.quantile, for every group
+    # at once; q may be a scalar or an array of quantiles (one column each)
+    order = np.lexsort((values, index))
+    ordered = values[order]
+    counts = np.bincount(index, minlength=n)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    position = starts[:, None] + q[None, :] * np.maximum(counts - 1, 0)[:, None]
+    lo = np.floor(position).astype(np.int64)
+    hi = np.ceil(position).astype(np.int64)
+    valid = counts > 0
+    lo[~valid] = hi[~valid] = 0
+    if not len(ordered):
+        return np.full((n, len(q)), np.nan)
+    result = ordered[lo] + (ordered[hi] - ordered[lo]) * (position - lo)
+    result[~valid] = np.nan
+    return result
+
+def cell_index(trials):
+    # One group per user and condition
+    return trials.user_index * len(CONDITIONS) + trials.condition, len(trials.users) * len(CONDITIONS)
+
+# Statistics
+
+def rt_mask(trials, min_rt=MIN_RT, max_rt=MAX_RT, trim_sd=TRIM_SD):
+    # Trials whose reaction time counts: correct, answered, in range and not an outlier
+    # for its user and condition
+    mask = trials.correct & trials.responded & (trials.condition >= 0) & np.isfinite(trials.reaction_time)
+    if min_rt is not None:
+        mask &= trials.reaction_time >= min_rt
+    if max_rt is not None:
+        mask &= trials.reaction_time <= max_rt
+    if trim_sd:
+        cells, n = cell_index(trials)
+        kept = np.flatnonzero(mask)
+        rt = trials.reaction_time[kept]
+        mean = group_mean(cells[kept], rt, n)
+        std = group_std(cells[kept], rt, n)
+        distance = np.abs(rt - mean[cells[kept]])
+        outlier = np.nan_to_num(std[cells[kept]], nan=np.inf) * trim_sd < distance
+        mask[kept[outlier]] = False
+    return mask
+
+def summarize(trials, **trim):
+    # Per user and condition: trials, accuracy and the trimmed reaction time distribution
+    valid = trials.condition >= 0
+    cells, n = cell_index(trials)
+    n_trials = group_count(cells, n, valid)
+    n_correct = group_count(cells, n, valid & trials.correct)
+    mask = rt_mask(trials, **trim)
+    rt = trials.reaction_time[mask]
+    quantiles = group_quantile(cells[mask], rt, n, [0.5])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        accuracy = n_correct / n_trials
+    summary = {
+        'user_id': np.repeat(trials.users, len(CONDITIONS)),
+        'condition': np.tile(np.array(CONDITIONS, dtype=object), len(trials.users)),
+        'n_trials': n_trials,
+        'accuracy': accuracy,
+        'n_rt': group_count(cells[mask], n),
+        'mean_rt': group_mean(cells[mask], rt, n),
+        'median_rt': quantiles[:, 0],
+        'sd_rt': group_std(cells[mask], rt, n)
+    }
+    present = n_trials > 0
+    return {name: values[present] for name, values in summary.items()}
+
+def interference(trials, **trim):
+    # Per user: color naming minus word reading, for mean reaction time and accuracy.
+    # NaN where a user lacks one of the conditions.
+    cells, n = cell_index(trials)
+    valid = trials.condition >= 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        accuracy = (group_count(cells, n, valid & trials.correct) / group_count(cells, n, valid))
+    mask = rt_mask(trials, **trim)
+    mean_rt = group_mean(cells[mask], trials.reaction_time[mask], n)
+    mean_rt = mean_rt.reshape(-1, len(CONDITIONS))
+    accuracy = accuracy.reshape(-1, len(CONDITIONS))
+    color_naming, word_reading = CONDITIONS.index('color_naming'), CONDITIONS.index('word_reading')
+    return {
+        'user_id': trials.users,
+        'rt_interference': mean_rt[:, color_naming] - mean_rt[:, word_reading],
+        'accuracy_interference': accuracy[:, color_naming] - accuracy[:, word_reading]
+    }
+
+def rt_distribution(trials, bin_sec=0.05, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), **trim):
+    # Histogram and quantiles of trimmed reaction times for each condition
+    mask = rt_mask(trials, **trim)
+    rt = trials.reaction_time[mask]
+    condition = trials.condition[mask].astype(np.int64)
+    edges = np.arange(0, (rt.max() if len(rt) else 0) + bin_sec, bin_sec)
+    if len(edges) < 2:
+        edges = np.array([0.0, bin_sec])
+    bins = np.clip(np.searchsorted(edges, rt, side="right") - 1, 0, len(edges) - 2)
+    counts = np.bincount(condition * (len(edges) - 1) + bins, minlength=len(CONDITIONS) * (len(edges) - 1))
+    return {
+        'edges': edges,
+        'counts': dict(zip(CONDITIONS, counts.reshape(len(CONDITIONS), -1))),
+        'quantiles': dict(zip(CONDITIONS, group_quantile(condition, rt, len(CONDITIONS), quantiles))),
+        'levels': np.asarray(quantiles)
+    }
+
+def bootstrap_ci(values, n_boot=10000, confidence=0.95, statistic=np.mean, seed=0, max_cells=4_000_000):
+    # Percentile interval of statistic over resamples of values (NaNs dropped). Resamples
+    # are drawn as one matrix per batch, at most max_cells draws at a time.
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return np.nan, np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    batch = max(1, max_cells // len(values))
+    estimates = []
+    for done in range(0, n_boot, batch):
+        draws = rng.integers(0, len(values), (min(batch, n_boot - done), len(values)))
+        estimates.append(statistic(values[draws], axis=1))
+    estimates = np.concatenate(estimates)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(estimates, [alpha, 1 - alpha])
+    return statistic(values), low, high
+
+def group_bootstrap_ci(index, values, n, n_boot=1000, confidence=0.95, seed=0, max_cells=4_000_000):
+    # Percentile interval of the mean of every group, resampling within groups. Rows are
+    # sorted by group so one replicate of all groups is a single reduceat.
+    finite = np.isfinite(values)
+    index, values = index[finite], values[finite]
+    order = np.argsort(index, kind="stable")
+    ordered = values[order]
+    counts = np.bincount(index, minlength=n)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    low = np.full(n, np.nan)
+    high = np.full(n, np.nan)
+    if not len(ordered):
+        return group_mean(index, values, n), low, high
+
+    group_of_row = index[order]
+    row_start = starts[group_of_row]
+    row_count = counts[group_of_row]
+    rng = np.random.default_rng(seed)
+    batch = max(1, max_cells // len(ordered))
+    estimates = []
+    for done in range(0, n_boot, batch):
+        size = min(batch, n_boot - done)
+        draws = row_start + (rng.random((size, len(ordered))) * row_count).astype(np.int64)
+        sums = np.add.reduceat(ordered[draws], starts[present], axis=1)
+        estimates.append(sums / counts[present])
+    estimates = np.concatenate(estimates)
+    alpha = (1 - confidence) / 2
+    low[present], high[present] = np.quantile(estimates, [alpha, 1 - alpha], axis=0)
+    return group_mean(index, values, n), low, high
+
+def report(trials, n_boot=10000, **trim):
+    # Condition means across users with bootstrap intervals, and the interference effect
+    lines = [f"{len(trials)} trials from {len(trials.users)} users"]
+    summary = summarize(trials, **trim)
+    for name in CONDITIONS:
+        rows = summary['condition'] == name
+        mean_rt, low, high = bootstrap_ci(summary['mean_rt'][rows], n_boot)
+        accuracy, acc_low, acc_high = bootstrap_ci(summary['accuracy'][rows], n_boot)
+        lines.append(
+            f"{name:>13}: mean RT {mean_rt:.3f}s [{low:.3f}, {high:.3f}], "
+            f"accuracy {accuracy:.1%} [{acc_low:.1%}, {acc_high:.1%}], {int(summary['n_rt'][rows].sum())} RTs"
+        )
+    effect = interference(trials, **trim)
+    rt_effect, low, high = bootstrap_ci(effect['rt_interference'], n_boot)
+    acc_effect, acc_low, acc_high = bootstrap_ci(effect['accuracy_interference'], n_boot)
+    lines.append(
+        f" interference: RT {rt_effect * 1000:+.0f} ms [{low * 1000:+.0f}, {high * 1000:+.0f}], "
+        f"accuracy {acc_effect:+.1%} [{acc_low:+.1%}, {acc_high:+.1%}] "
+        f"({int(np.isfinite(effect['rt_interference']).sum())} users with both conditions)"
+    )
+    return "\n".join(lines)
+
+def write_csv(path, columns):
+    import pandas as pd
+
+    pd.DataFrame(columns).to_csv(path, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Stroop interference across all participants")
+    parser.add_argument("source", help="supabase, local, or a .csv, .parquet or .jsonl export")
+    parser.add_argument("--version", help="result_version to analyse; default: the rows written by the app")
+    parser.add_argument("--all-versions", action="store_true")
+    parser.add_argument("--min-rt", type=float, default=MIN_RT)
+    parser.add_argument("--max-rt", type=float, default=MAX_RT)
+    parser.add_argument("--trim-sd", type=float, default=TRIM_SD, help="0 turns SD trimming off")
+    parser.add_argument("--bootstrap", type=int, default=10000)
+    parser.add_argument("--output", help="write the per-user summary to this CSV file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.source == "supabase":
+        from dotenv import load_dotenv
+        from supabase import create_client
+        load_dotenv()
+        client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+        trials = load_supabase(client, version=args.version)
+    elif args.source == "local":
+        trials = load_local(os.getenv("LOCAL_DB_PATH", "stroop_local.db"))
+    else:
+        trials = load_export(args.source)
+    loaded = time.perf_counter()
+    if not args.all_versions:
+        trials = trials.version(args.version)
+
+    trim = {"min_rt": args.min_rt, "max_rt": args.max_rt, "trim_sd": args.trim_sd}
+    print(report(trials, n_boot=args.bootstrap, **trim))
+    distribution = rt_distribution(trials, **trim)
+    levels = ", ".join(f"p{int(q * 100)}" for q in distribution['levels'])
+    for name, values in distribution['quantiles'].items():
+        print(f"{name:>13}: RT {levels} = " + ", ".join(f"{v:.3f}" for v in values))
+    if args.output:
+        summary = summarize(trials, **trim)
+        effect = interference(trials, **trim)
+        per_user = dict(zip(effect['user_id'], effect['rt_interference']))
+        summary['rt_interference'] = np.array([per_user[u] for u in summary['user_id']])
+        write_csv(args.output, summary)
+    print(f"Loaded in {loaded - start:.2f}s, analysed in {time.perf_counter() - loaded:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,15 @@
 import streamlit as st
-import random
 import time
-from datetime import datetime
-import openai
-from openai import OpenAI
 import os
-from pathlib import Path
-from dotenv import load_dotenv
-import io
-import wave
-import array
 import uuid
-import supabase
-from supabase import create_client, Client
-import numpy as np  
+from processing import process_phase, process_live_phase
+from pipeline import TRIAL_TIME_LIMIT, NUM_TRIALS, generate_trials
+import metrics
+from resources import load_environment, configure_metrics, get_recording_store, get_write_behind, get_job_runner, get_job_blob_store, get_live_captures, get_rtc_configuration, load_css
+from persistence import build_trial_records, TRIAL_TYPES
+from trial_presenter import trial_presenter
+
+SCRIPT_START = time.perf_counter()
 
 # Page config
 st.set_page_config(
@@ -22,112 +18,20 @@ st.set_page_config(
     layout="wide"
 )
 
-# OpenAI Client and Suoabase setup
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Environment, API clients and styles are loaded once per server process (see resources.py)
+load_environment()
+configure_metrics()
 
 # Custom CSS by v0
-st.markdown("""
-<style>
-    .main {
-        background-color: #000000;
-    }
-    .stApp {
-        background-color: white;
-    }
-    .stroop-word {
-        font-size: 120px;
-        font-weight: bold;
-        text-align: center;
-        padding: 20px 50px;
-        text-transform: uppercase;
-        letter-spacing: -2px;
-    }
-    .progress {
-        font-size: 24px;
-        color: #666;
-        text-align: center;
-        margin-bottom: 15px;
-        margin-top: 20px;
-    }
-    .countdown-timer {
-        font-size: 72px;
-        color: #ef4444;
-        text-align: center;
-        font-weight: bold;
-        padding: 40px;
-    }
-    .FinishedText {
-        font-size: 40px;
-        color: #ef4444;
-        text-align: center;
-        font-weight: bold;
-        padding: 40px;
-    }
-    .FinishedText2 {
-        font-size: 30px;
-        color: #000000;
-        text-align: center;
-        font-weight: bold;
-        padding: 40px;
-    }
-    .countdown {
-        font-size: 48px;
-        color: #ef4444;
-        text-align: center;
-        font-weight: bold;
-        padding: 20px;
-    }
-    .welcome-container {
-        max-width: 800px;
-        margin: 0 auto;
-        padding: 10px 40px;
-        background-color: white;
-    }
-    .finish-container {
-        max-width: 600px;
-        margin: 0 auto;
-        padding: 10px 40px;
-        background-color: white;
-    }
-    .test-container {
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        justify-content: flex-start;
-        padding-top: 20px;
-        width: 100%;
-        background-color: white;
-    }
-    .audio-input-bottom {
-        position: fixed;
-        bottom: 20px;
-        left: 50%;
-        transform: translateX(-50%);
-        z-index: 1000;
-        background-color: white;
-        padding: 10px;
-        border-radius: 10px;
-        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-    }
-    [data-testid="stMetric"] {
-        text-align: center;
-    }
-    [data-testid="stMetricLabel"] {
-        font-size: 40px !important;
-        font-weight: bold;
-        color: #ef4444;
-    }
-    [data-testid="stMetricValue"] {
-        font-size: 36px !important;
-        color: #ef4444;
-    }
-
-</style>
-""", unsafe_allow_html=True)
+st.markdown(load_css(), unsafe_allow_html=True)
+
+# Operators open ?admin for profiling and memory diagnostics (admin.py); without
+# ADMIN_SECRET the page does not exist
+ADMIN_SECRET = os.getenv("ADMIN_SECRET")
+if ADMIN_SECRET and "admin" in st.query_params:
+    from admin import admin_page
+    admin_page(ADMIN_SECRET)
+    st.stop()
 
 # Session state
 if 'started' not in st.session_state:
@@ -152,8 +56,6 @@ if 'results' not in st.session_state:
     st.session_state.results = []
 if 'test_start_time' not in st.session_state:
     st.session_state.test_start_time = None
-if 'audio_data' not in st.session_state:
-    st.session_state.audio_data = None
 if 'await_finish' not in st.session_state:
     st.session_state.await_finish = False
 if 'user_id' not in st.session_state:
@@ -164,12 +66,13 @@ if 'trial1_results' not in st.session_state:
     st.session_state.trial1_results = []
 if 'trial2_results' not in st.session_state:
     st.session_state.trial2_results = []
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = {}
+if 'rerun_count' not in st.session_state:
+    st.session_state.rerun_count = 0
 
 # COLORS AND TRIAL SETTINGS
 COUNTDOWN_TIME = 5
-TRIAL_TIME_LIMIT = 2
-NUM_TRIALS = 20
-COLORS = ['red', 'blue', 'green', 'yellow', 'purple', 'orange']
 COLOR_MAP = {
     'red': '#ef4444',
     'blue': '#3b82f6',
@@ -179,198 +82,133 @@ COLOR_MAP = {
     'orange': '#f97316'
 }
 
-def delete_audio_files():
-    audio_dir = Path("audio")
-    if audio_dir.exists():
-        for audio_file in audio_dir.glob("*.wav"):
-            try:
-                audio_file.unlink()
-            except Exception as e:
-                print(f"Error deleting {audio_file}: {e}")
-
-def generate_trials():
-    trials = []
-    for _ in range(NUM_TRIALS):
-        word = random.choice(COLORS)
-        available_colors = [c for c in COLORS if c != word]
-        color = random.choice(available_colors)
-        trials.append({'word': word, 'color': color})
-    return trials
-
-def segment_audio_wave(audio_bytes, test_start_offset_sec, segment_duration_sec=2, num_segments=20):
-    try:
-        with wave.open(io.BytesIO(audio_bytes), 'rb') as wav_file:
-            n_channels = wav_file.getnchannels()
-            sampwidth = wav_file.getsampwidth()
-            framerate = wav_file.getframerate()
-
-            start_frame = int(test_start_offset_sec * framerate)
-            start_byte = start_frame * n_channels * sampwidth
-
-            all_frames = wav_file.readframes(wav_file.getnframes())
-            test_frames = all_frames[start_byte:]
-
-            frames_per_segment = int(framerate * segment_duration_sec)
-            segments = []
-
-            for i in range(num_segments):
-                segment_start = i * frames_per_segment * n_channels * sampwidth
-                segment_end = segment_start + frames_per_segment * n_channels * sampwidth
-                segment_frames = test_frames[segment_start:segment_end]
-
-                segment_buffer = io.BytesIO()
-                with wave.open(segment_buffer, 'wb') as segment_wav:
-                    segment_wav.setnchannels(n_channels)
-                    segment_wav.setsampwidth(sampwidth)
-                    segment_wav.setframerate(framerate)
-                    segment_wav.writeframes(segment_frames)
-                segment_buffer.seek(0)
-                segments.append(segment_buffer.getvalue())
-
-            return segments
-    except Exception as e:
-        st.error(f"Error segmenting audio: {str(e)}")
-        return None
-
-def transcribe_segment(segment_bytes, segment_index):
-    try:
-        temp_dir = Path("audio")
-        temp_dir.mkdir(exist_ok=True)
+# "thread" processes phases on this server's job pool; "sqlite" hands them to worker.py
+# processes through a shared queue, and the workers also save the results
+JOB_QUEUE = os.getenv("JOB_QUEUE", "thread")
+
+# "upload" records each phase with st.audio_input and processes it once it is stopped;
+# "webrtc" streams the microphone to this server and scores every trial as it ends
+# (live_capture.py). Live audio stays in this process, so it needs the thread job pool.
+CAPTURE_MODE = os.getenv("CAPTURE_MODE", "upload")
+LIVE_CAPTURE = CAPTURE_MODE == "webrtc" and JOB_QUEUE != "sqlite"
+if CAPTURE_MODE == "webrtc" and not LIVE_CAPTURE:
+    print("Warning: CAPTURE_MODE=webrtc does not work with JOB_QUEUE=sqlite, recording phases with uploads")
+
+# Every script run is timed from the top of the file to st.rerun() or the end of the page
+def record_script_run():
+    elapsed = time.perf_counter() - SCRIPT_START
+    st.session_state.rerun_count = st.session_state.get('rerun_count', 0) + 1
+    metrics.observe("stroop_script_seconds", elapsed)
+    metrics.inc("stroop_script_runs_total")
+    metrics.event(
+        "script_run",
+        session=st.session_state.get('user_id'),
+        run=st.session_state.rerun_count,
+        phase=st.session_state.get('current_phase'),
+        seconds=elapsed
+    )
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        audio_path = temp_dir / f"segment_{segment_index}_{timestamp}.wav"
-        
-        # Write the segment to file
-        with open(audio_path, "wb") as f:
-            f.write(segment_bytes)
-
-        # Transcribe the audio file
-        with open(audio_path, "rb") as audio_file:
-            result = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="en",
-                response_format="verbose_json",
-                timestamp_granularities=["word"],
-                prompt="red, blue, green, yellow, purple, orange"
-            )
-
-        try:
-            if audio_path.exists():
-                audio_path.unlink()
-        except Exception as cleanup_error:
-            print(f"Warning: Could not delete temporary file {audio_path}: {cleanup_error}")
-        
-        return result.text.lower().strip()
+def rerun():
+    record_script_run()
+    st.rerun()
 
-    except Exception as e:
-        try:
-            if 'audio_path' in locals() and audio_path.exists():
-                audio_path.unlink()
-        except:
-            pass
-        st.error(f"Error transcribing segment {segment_index}: {str(e)}")
-        return None
+# Seconds between progress updates while the participant waits for results
+JOB_POLL_SEC = float(os.getenv("JOB_POLL_SEC", "1.0"))
 
-def extract_color_and_time(result):
-    if not result or not hasattr(result, "words") or result.words is None:
-        return None, None
-    words = getattr(result, "words", None)
-    if not words:
-        return None, None
-    for w in result.words:
-        clean_word = w.word.lower().strip(" ,.!?")
-        if clean_word in COLORS:
-            return clean_word, w.start
-
-    return None, None
-
-def parse_color_from_transcript(transcript):
-    if not transcript:
+def submit_phase_job(phase, backend=None):
+    # Everything the job needs is captured now, because the session moves on to the
+    # next phase while the job is still running (see jobs.py)
+    store = get_recording_store()
+    user_id = st.session_state.user_id
+    audio_bytes = store.get(user_id, phase)
+    if audio_bytes is None:
         return None
-    for color in COLORS:
-        if color in transcript:
-            return color
-    return None
-
-def detect_voice_start(segment_bytes, energy_threshold=0.01, frame_ms=10):
-    try:
-        with wave.open(io.BytesIO(segment_bytes), 'rb') as wav_file:
-            n_channels = wav_file.getnchannels()
-            sampwidth = wav_file.getsampwidth()
-            framerate = wav_file.getframerate()
-            raw = wav_file.readframes(wav_file.getnframes())
-
-        if sampwidth != 2: 
-            return None
-
-        audio = np.frombuffer(raw, dtype=np.int16).astype(np.float32)
-
-        if n_channels == 2:
-            audio = audio.reshape(-1, 2).mean(axis=1)
 
-        max_val = np.max(np.abs(audio)) + 1e-9
-        audio = audio / max_val
-
-        frame_size = int(framerate * (frame_ms / 1000.0))
-
-        for i in range(0, len(audio), frame_size):
-            frame = audio[i:i+frame_size]
-            if len(frame) == 0:
-                break
-            energy = np.mean(frame ** 2)
-            if energy > energy_threshold:
-                return i / framerate  
-
-        return None
+    trials = list(st.session_state.trials)
+    trial_timestamps = list(st.session_state.trial_timestamps)
+
+    if JOB_QUEUE == "sqlite":
+        # The recording goes to the shared blob store and the job to the queue (job_queue.py)
+        payload = {
+            "session_id": user_id,
+            "user_name": st.session_state.user_name,
+            "phase": phase,
+            "audio": get_job_blob_store().put(audio_bytes),
+            "trials": trials,
+            "trial_timestamps": trial_timestamps
+        }
+        job_id = get_job_runner().enqueue(payload, session_id=user_id, total=len(trials))
+        store.release(user_id, phase)
+    else:
+        def process(job):
+            results = process_phase(job, user_id, phase, audio_bytes, trials, trial_timestamps, backend)
+            if results:
+                store.release(user_id, phase)
+            return results
+
+        job_id = get_job_runner().submit(process, session_id=user_id, total=len(trials))
+    st.session_state.jobs[phase] = job_id
+    return job_id
+
+def submit_live_job(phase, test_start, backend=None):
+    # Runs for the whole phase, scoring trials while the participant is still answering
+    user_id = st.session_state.user_id
+    recorder = get_live_captures().get(user_id)
+    trials = list(st.session_state.trials)
+
+    def process(job):
+        return process_live_phase(job, user_id, phase, recorder, trials, test_start, backend)
+
+    st.session_state.jobs[phase] = get_job_runner().submit(process, session_id=user_id, total=len(trials))
+
+def live_capture_widget():
+    # One stream per session, kept open across both phases by the fixed key
+    from streamlit_webrtc import webrtc_streamer, WebRtcMode
+
+    recorder = get_live_captures().get(st.session_state.user_id)
+    webrtc_streamer(
+        key="live_capture",
+        mode=WebRtcMode.SENDRECV,
+        rtc_configuration=get_rtc_configuration(),
+        media_stream_constraints={"audio": True, "video": False},
+        audio_frame_callback=recorder.on_frame,
+        on_audio_ended=recorder.on_ended,
+        sendback_audio=False
+    )
 
-    except Exception as e:
-        print("VAD ERROR:", e)
-        return None
+def next_phase():
+    st.session_state.await_finish = False
+    if st.session_state.current_phase == 1:
+        # Trial 1 is processed in the background while the participant does trial 2
+        st.session_state.current_phase = 2
+        st.session_state.trials = generate_trials()
+        st.session_state.countdown_complete = False
+        st.session_state.countdown_start_time = time.time()
+    else:
+        st.session_state.test_complete = True
+
+def results_table(results):
+    return [
+        {
+            "Trial": r['trial'],
+            "Word": r['word'].upper(),
+            "Color": r['color'].upper(),
+            "Answer": r['answer'].upper(),
+            "Correct": "✓" if r['correct'] else "✗"
+        }
+        for r in results
+    ]
 
 def save_results_to_supabase(trial1_results, trial2_results, user_id, user_name):
+    # Rows are spooled locally and written to the database in the background (persistence.py)
     try:
-        user_response = supabase.table('stroop_users').upsert({
-            'id': user_id,
-            'name': user_name
-        }).execute()
-
-        records = []
-        
-        for r in trial1_results:
-            record = {
-                'user_id': user_id,
-                'trial_type': 'color_naming',
-                'trial_number': r['trial'],
-                'word_displayed': r['word'].upper(),
-                'color_displayed': r['color'],
-                'spoken_color': r['answer'].upper() if r['answer'] != 'NO RESPONSE' else None,
-                'transcript': r['transcript'],
-                'display_timestamp': r.get('absolute_timestamp', 0),
-                'speech_timestamp': r.get('speech_timestamp'),
-                'reaction_time': r['time'],
-                'correct': r['correct']
-            }
-            records.append(record)
-        
-        for r in trial2_results:  
-            record = {
-                'user_id': user_id,
-                'trial_type': 'word_reading',
-                'trial_number': r['trial'],
-                'word_displayed': r['word'].upper(),
-                'color_displayed': r['color'],
-                'spoken_color': r['answer'].upper() if r['answer'] != 'NO RESPONSE' else None, 
-                'transcript': r['transcript'],
-                'display_timestamp': r.get('absolute_timestamp', 0),
-                'speech_timestamp': r.get('speech_timestamp'),
-                'reaction_time': r['time'],
-                'correct': r['correct']
-            }
-            records.append(record)
-            
-        response = supabase.table('stroop_trials').insert(records).execute()
-        print(f"Successfully inserted {len(response.data)} records")
+        records = (
+            build_trial_records(trial1_results, user_id, TRIAL_TYPES[1]) +
+            build_trial_records(trial2_results, user_id, TRIAL_TYPES[2])
+        )
+        with metrics.timer("save"):
+            get_write_behind().enqueue_session({'id': user_id, 'name': user_name}, records)
+        print(f"Queued {len(records)} records for user {user_id}")
         return True
     except Exception as e:
         st.error(f"Error saving results to database: {str(e)}")
@@ -379,61 +217,62 @@ def save_results_to_supabase(trial1_results, trial2_results, user_id, user_name)
         traceback.print_exc()
         return False
 
-def process_segmented_audio(audio_bytes, trials, phase):
-    test_start_offset = (
-        st.session_state.trial_timestamps[0]
-        if st.session_state.trial_timestamps
-        else 0
-    )
-    segments = segment_audio_wave(
-        audio_bytes,
-        test_start_offset_sec=test_start_offset,
-        segment_duration_sec=TRIAL_TIME_LIMIT,
-        num_segments=NUM_TRIALS
-    )
-
-    if not segments:
-        return None
-
-    results = []
-
-    for i, (segment_bytes, trial) in enumerate(zip(segments, trials)):
-        result = transcribe_segment(segment_bytes, i)
-        if result:
-            transcript = result
-            spoken_color = parse_color_from_transcript(transcript)
-        else:
-            transcript = "N/A"
-            spoken_color = None
-
-        if phase == 1:
-            correct = (spoken_color == trial["color"]) if spoken_color else False
+# Only this part of the page reruns while the jobs are polled
+@st.fragment(run_every=JOB_POLL_SEC)
+def show_processing():
+    runner = get_job_runner()
+    jobs = {phase: runner.get(job_id) for phase, job_id in st.session_state.jobs.items()}
+
+    for phase in (1, 2):
+        job = jobs.get(phase)
+        if job is None:
+            continue
+        completed, total = job.progress()
+        st.progress(min(1.0, completed / total) if total else 1.0,
+                    text=f"Trial {phase}: {completed}/{total} responses transcribed")
+        for message in job.warnings:
+            st.warning(message)
+        partial = job.partial_results()
+        if partial:
+            st.dataframe(results_table(partial), hide_index=True, use_container_width=True)
+
+    if any(job is not None and not job.done for job in jobs.values()):
+        return
+
+    if all(jobs.get(phase) is not None and jobs[phase].status == "done" for phase in (1, 2)):
+        st.session_state.trial1_results = jobs[1].result
+        st.session_state.trial2_results = jobs[2].result
+        for job_id in st.session_state.jobs.values():
+            runner.discard(job_id)
+        st.session_state.jobs = {}
+        get_live_captures().release(st.session_state.user_id)
+        # Queue workers save each phase themselves
+        if JOB_QUEUE != "sqlite":
+            with st.spinner("Saving results to database"):
+                save_success = save_results_to_supabase(
+                    st.session_state.trial1_results,
+                    st.session_state.trial2_results,
+                    st.session_state.user_id,
+                    st.session_state.user_name
+                )
+                if save_success:
+                    st.success("Results saved successfully!")
+                else:
+                    st.warning("Results processed but not saved to database")
+        rerun()
+    else:
+        if LIVE_CAPTURE:
+            st.error("Make sure your microphone is on and streaming!")
         else:
-            correct = (spoken_color == trial["word"]) if spoken_color else False
+            st.error("Make sure to Stop the Audio Recording!")
 
-        vad_time = detect_voice_start(segment_bytes)
-        segment_start = test_start_offset + (i * TRIAL_TIME_LIMIT)
-
-        if vad_time is not None:
-            speech_timestamp = segment_start + vad_time
-            reaction_time = vad_time
-        else:
-            speech_timestamp = None
-            reaction_time = TRIAL_TIME_LIMIT
-
-        results.append({
-            "trial": i + 1,
-            "word": trial["word"],
-            "color": trial["color"],
-            "answer": spoken_color if spoken_color else "NO RESPONSE",
-            "correct": correct,
-            "time": reaction_time,
-            "transcript": transcript,
-            "absolute_timestamp": segment_start,
-            "speech_timestamp": speech_timestamp
-        })
-
-    return results
+        if st.button("Try Again"):
+            get_recording_store().release_session(st.session_state.user_id)
+            get_live_captures().release(st.session_state.user_id)
+            runner.discard_session(st.session_state.user_id)
+            for key in list(st.session_state.keys()):
+                del st.session_state[key]
+            rerun()
 
 # WELCOME PAGE
 if not st.session_state.started:
@@ -446,7 +285,7 @@ if not st.session_state.started:
         st.markdown("<h1 style='color: black; font-size: 72px;'>sayStroop</h1>", unsafe_allow_html=True)
     
         st.markdown("### :red[Welcome! Ready to Test Your Brain?]")
-        st.markdown("""
+        st.markdown(f"""
         <div style='color: black; font-size: 18px; line-height: 1.8;'>
         Our project explores the <strong>Stroop Effect</strong> with TWO trials!
         <br><br>
@@ -463,8 +302,8 @@ if not st.session_state.started:
         <strong>Instructions:</strong>
         <ul>
             <li>Click START and allow microphone access</li>
-            <li>Complete 20 trials for each phase (40 total)</li>
-            <li>Words appear every 2 seconds</li>
+            <li>Complete {NUM_TRIALS} trials for each phase ({NUM_TRIALS * 2} total)</li>
+            <li>Words appear every {TRIAL_TIME_LIMIT:g} seconds</li>
             <li><strong>Please only take the test once for research purposes!</strong></li>
         </ul>
         </div>
@@ -479,7 +318,6 @@ if not st.session_state.started:
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
             if st.button("START TEST", type="primary", use_container_width=True):
-                delete_audio_files()
                 st.session_state.user_name = user_name if user_name else "Anonymous"
                 st.session_state.started = True
                 st.session_state.current_phase = 1
@@ -487,80 +325,57 @@ if not st.session_state.started:
                 st.session_state.current_trial = 0
                 st.session_state.countdown_complete = False
                 st.session_state.countdown_start_time = time.time()
-                st.rerun()
+                rerun()
     
         st.markdown("</div>", unsafe_allow_html=True)
 
-# COUNTDOWN WITH RECORDING
+# COUNTDOWN AND TRIALS WITH RECORDING
+# The countdown and the words run in the browser, so the script only reruns when the phase ends
 elif st.session_state.started and not st.session_state.countdown_complete:
-    elapsed = time.time() - st.session_state.countdown_start_time
-    time_remaining = COUNTDOWN_TIME - elapsed
-    
-    st.markdown("<div class='test-container'>", unsafe_allow_html=True)
-    
-    if time_remaining > 0:
-        if st.session_state.current_phase == 1:
-            st.markdown(f"<div class='progress'>Trial 1: Color Naming</div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='progress'>Say the COLOR of each word!</div>", unsafe_allow_html=True)
-        else:
-            st.markdown(f"<div class='progress'>Trial 2: Word Reading</div>", unsafe_allow_html=True)
-            st.markdown(f"<div class='progress'>Say the WORD displayed!</div>", unsafe_allow_html=True)
-        
-        st.markdown(f"<div class='countdown-timer'>{int(time_remaining) + 1}</div>", unsafe_allow_html=True)
-        st.markdown("<div style='height: 50px;'></div>", unsafe_allow_html=True)
-        st.markdown("<div style='text-align: center; padding: 20px;'>", unsafe_allow_html=True)
-        st.markdown(f"<div class='progress'><strong>Make Sure to Press Record!</strong></div>", unsafe_allow_html=True)
-        audio_bytes = st.audio_input("", key=f"recording_phase{st.session_state.current_phase}")
-        st.markdown("</div>", unsafe_allow_html=True)
-        
-        if audio_bytes:
-            st.session_state.recording_started = True
-            st.session_state.audio_data = audio_bytes.read()
-        
-        time.sleep(0.1)
-        st.rerun()
+    if st.session_state.current_phase == 1:
+        header = ["Trial 1: Color Naming", "Say the COLOR of each word!"]
     else:
-        st.session_state.countdown_complete = True
-        st.session_state.test_start_time = time.time()
-        st.session_state.trial_timestamps = []
-        st.rerun()
-    
-    st.markdown("</div>", unsafe_allow_html=True)
+        header = ["Trial 2: Word Reading", "Say the WORD displayed!"]
+
+    presented = trial_presenter(
+        st.session_state.trials,
+        COLOR_MAP,
+        countdown_sec=COUNTDOWN_TIME,
+        trial_sec=TRIAL_TIME_LIMIT,
+        header=header,
+        key=f"presenter_phase{st.session_state.current_phase}",
+        report_start=LIVE_CAPTURE
+    )
 
-# RUNNING THE TEST
-elif st.session_state.countdown_complete and not st.session_state.test_complete and not st.session_state.await_finish:
-    elapsed = time.time() - st.session_state.test_start_time
-    current_trial_index = int(elapsed // TRIAL_TIME_LIMIT)
-    
-    if current_trial_index >= NUM_TRIALS:
-        st.session_state.await_finish = True
-        st.rerun()
+    st.markdown("<div style='text-align: center; padding: 20px;'>", unsafe_allow_html=True)
+    if LIVE_CAPTURE:
+        live_capture_widget()
     else:
-        st.session_state.current_trial = current_trial_index
-        trial = st.session_state.trials[current_trial_index]
-        
-        if len(st.session_state.trial_timestamps) <= current_trial_index:
-            st.session_state.trial_timestamps.append(elapsed)
-        
-        st.markdown("<div class='test-container'>", unsafe_allow_html=True)
-        
-        word_color = COLOR_MAP[trial['color']]
-        st.markdown(f"<div class='stroop-word' style='color: {word_color};'>{trial['word']}</div>", 
-                    unsafe_allow_html=True)
-        
-        st.markdown("</div>", unsafe_allow_html=True)
-        st.markdown("<div style='height: 50px;'></div>", unsafe_allow_html=True)
-        st.markdown("<div style='text-align: center; padding: 20px;'>", unsafe_allow_html=True)
-        
         audio_bytes = st.audio_input("", key=f"recording_phase{st.session_state.current_phase}")
-       
         if audio_bytes:
-            st.session_state.audio_data = audio_bytes.read()
-        
-        st.markdown("</div>", unsafe_allow_html=True) 
-        
-        time.sleep(0.1)
-        st.rerun()
+            st.session_state.recording_started = True
+            get_recording_store().put(st.session_state.user_id, st.session_state.current_phase, audio_bytes)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    # Live scoring starts with the first word; the start time is only right on this run
+    if presented and not presented["finished"] and st.session_state.current_phase not in st.session_state.jobs:
+        st.session_state.test_start_time = presented["test_start_time"]
+        submit_live_job(st.session_state.current_phase, presented["test_start_time"])
+
+    if presented and presented["finished"]:
+        st.session_state.countdown_complete = True
+        st.session_state.trial_timestamps = presented["trial_timestamps"]
+        if LIVE_CAPTURE:
+            if st.session_state.current_phase not in st.session_state.jobs:
+                # The start message was missed; the phase ended just now
+                submit_live_job(st.session_state.current_phase,
+                                time.time() - len(st.session_state.trials) * TRIAL_TIME_LIMIT)
+            # Nothing to stop or upload, so the next phase follows straight away
+            next_phase()
+        else:
+            st.session_state.test_start_time = presented["test_start_time"]
+            st.session_state.await_finish = True
+        rerun()
 
 # AWAIT FINISH
 elif st.session_state.await_finish: 
@@ -574,69 +389,24 @@ elif st.session_state.await_finish:
     st.markdown("<div class ='FinishedText'>Please Stop Your Recording Now<br>Press the Button Below to Continue.</div>", unsafe_allow_html=True)
     audio_bytes = st.audio_input("", key=f"recording_phase{st.session_state.current_phase}")
     if audio_bytes:
-        st.session_state.audio_data = audio_bytes.read()
+        get_recording_store().put(st.session_state.user_id, st.session_state.current_phase, audio_bytes)
     
     col_left, col_button, col_right = st.columns([1, 2, 1])
     with col_button:
         button_text = "PROCESS TRIAL 1" if st.session_state.current_phase == 1 else "FINISH TEST!"
         if st.button(button_text, type="primary", use_container_width=True):
-            st.session_state.await_finish = False
-            if st.session_state.current_phase == 1:
-                st.session_state.test_complete = True
+            if submit_phase_job(st.session_state.current_phase) is None:
+                st.error("Make sure to Stop the Audio Recording!")
             else:
-                st.session_state.test_complete = True
-            st.rerun()
+                next_phase()
+                rerun()
 
     st.markdown("</div>", unsafe_allow_html=True)
 
 # PROCESSING RESULTS
-elif st.session_state.test_complete and (
-    (st.session_state.current_phase == 1 and not st.session_state.trial1_results) or
-    (st.session_state.current_phase == 2 and not st.session_state.trial2_results)
-):
-    st.markdown(f"Processing Trial {st.session_state.current_phase} responses...")
-    
-    with st.spinner("Segmenting and transcribing audio..."):
-        results = process_segmented_audio(
-            st.session_state.audio_data, 
-            st.session_state.trials,
-            st.session_state.current_phase
-        )
-        
-        if results:
-            if st.session_state.current_phase == 1:
-                st.session_state.trial1_results = results
-                st.success("Trial 1 processed!")
-                time.sleep(2)
-                st.session_state.current_phase = 2
-                st.session_state.trials = generate_trials()  
-                st.session_state.countdown_complete = False
-                st.session_state.countdown_start_time = time.time()
-                st.session_state.test_complete = False
-                st.session_state.audio_data = None
-                st.rerun()
-            else:
-                st.session_state.trial2_results = results
-                with st.spinner("Saving results to database"):
-                    save_success = save_results_to_supabase(
-                        st.session_state.trial1_results,
-                        st.session_state.trial2_results,
-                        st.session_state.user_id,
-                        st.session_state.user_name
-                    )
-                    if save_success:
-                        st.success("Results saved successfully!")
-                    else:
-                        st.warning("Results processed but not saved to database")
-                st.rerun()
-        else:
-            st.error("Make sure to Stop the Audio Recording!")
-            
-            if st.button("Try Again"):
-                delete_audio_files()
-                for key in list(st.session_state.keys()):
-                    del st.session_state[key]
-                st.rerun()
+elif st.session_state.test_complete and not st.session_state.trial2_results:
+    st.markdown("Processing your responses...")
+    show_processing()
 
 # SHOW FINAL RESULTS
 else:
@@ -689,4 +459,6 @@ else:
     st.markdown("</div>", unsafe_allow_html=True)
 
 st.markdown("<div style='text-align: center; color: #666; padding: 20px;'>sayStroop Test © 2025</div>", 
-           unsafe_allow_html=True)
\ No newline at end of file
+           unsafe_allow_html=True)
+
+record_script_run()
@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from pathlib import Path
+
+from compact_audio import ARCHIVE_RATE, CompactAudio, write_compact
+from segmentation import WavSegment, read_wav_view
+from streaming import open_recording
+
+# Phase recordings kept together with everything needed to score them again: the trial
+# list, the display timestamps and the trial length they were recorded with. Each
+# session is a directory named after its user id with one audio file and one JSON file
+# per phase. rescore.py reads them back through the same pipeline the app uses.
+# Recordings are stored in the compact format of compact_audio.py unless compact=False;
+# either kind can be read back.
+
+class ArchivedPhase:
+    def __init__(self, session_id, phase, audio_path, meta):
+        self.session_id = session_id
+        self.phase = phase
+        self.audio_path = audio_path
+        self.trials = meta["trials"]
+        self.trial_timestamps = meta["trial_timestamps"]
+        self.trial_sec = meta["trial_sec"]
+        self.meta = meta
+
+    @property
+    def compact(self):
+        return self.audio_path.suffix == ".sca"
+
+    def audio(self):
+        # A WAV path is enough for pipeline.process_segmented_audio, which memory-maps it;
+        # a compact recording is decoded to WAV bytes
+        if self.compact:
+            with CompactAudio(self.audio_path) as compact:
+                return compact.to_wav()
+        return str(self.audio_path)
+
+    def audio_bytes(self):
+        audio = self.audio()
+        return audio if isinstance(audio, bytes) else Path(audio).read_bytes()
+
+    def trial(self, i):
+        # One trial window as a WavSegment, without decoding the rest of the recording
+        if self.compact:
+            with CompactAudio(self.audio_path) as compact:
+                return compact.trial(i)
+        start, duration = trial_windows(self.trial_timestamps, len(self.trials), self.trial_sec)[i]
+        with open_recording(self.audio_path) as recording:
+            segment = recording.slice_seconds(start, duration)
+            return WavSegment(bytes(segment.pcm), segment.n_channels, segment.sampwidth, segment.framerate)
+
+def trial_windows(trial_timestamps, num_trials, trial_sec):
+    # (start, duration) of each trial window, laid out as pipeline._process_stream does
+    start = trial_timestamps[0] if trial_timestamps else 0
+    return [(start + i * trial_sec, trial_sec) for i in range(num_trials)]
+
+class RecordingArchive:
+    def __init__(self, root, compact=True, rate=ARCHIVE_RATE, codec="zlib"):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.compact = compact
+        self.rate = rate
+        self.codec = codec
+
+    def save(self, session_id, phase, audio_bytes, trials, trial_timestamps, trial_sec, **extra):
+        directory = self.root / session_id
+        directory.mkdir(exist_ok=True)
+        audio_path = directory / f"phase{phase}.{'sca' if self.compact else 'wav'}"
+        meta = {
+            "session_id": session_id,
+            "phase": phase,
+            "audio_file": audio_path.name,
+            "trials": trials,
+            "trial_timestamps": trial_timestamps,
+            "trial_sec": trial_sec,
+            "archived_at": time.time(),
+            **extra
+        }
+        # The metadata is written last, so a phase without it was never completely saved
+        if self.compact:
+            write_compact(
+                audio_path,
+                read_wav_view(audio_bytes),
+                trial_windows(trial_timestamps, len(trials), trial_sec),
+                rate=self.rate,
+                codec=self.codec
+            )
+        else:
+            _write_atomic(audio_path, memoryview(audio_bytes))
+        _write_atomic(directory / f"phase{phase}.json", json.dumps(meta).encode())
+        return audio_path
+
+    def load(self, session_id, phase):
+        meta_path = self.root / session_id / f"phase{phase}.json"
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        audio_path = meta_path.with_name(meta.get("audio_file", f"phase{phase}.wav"))
+        if not audio_path.exists():
+            return None
+        return ArchivedPhase(session_id, phase, audio_path, meta)
+
+    def sessions(self):
+        # Sessions with at least one complete phase, in a stable order for checkpointing
+        return sorted(
+            p.name for p in self.root.iterdir()
+            if p.is_dir() and any(p.glob("phase*.json"))
+        )
+
+    def phases(self, session_id):
+        return sorted(
+            int(p.stem[len("phase"):]) for p in (self.root / session_id).glob("phase*.json")
+        )
+
+def _write_atomic(path, data):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,430 @@
+import contextlib
+import contextvars
+import hashlib
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+import metrics
+from onset import OnsetIndex, decode_pcm
+from segmentation import read_wav_view
+
+COLOR_PROMPT = "red, blue, green, yellow, purple, orange"
+# Label of the single request for a whole phase recording (TRANSCRIPTION_MODE=whole)
+RECORDING_LABEL = "recording"
+
+# Set by HedgedBackend while it times a request; backends that wait for the rate governor
+# call it once the request actually leaves
+request_sent = contextvars.ContextVar("request_sent", default=None)
+
+def mark_sent():
+    callback = request_sent.get()
+    if callback is not None:
+        callback()
+
+def retryable_errors():
+    import openai
+    return (
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError
+    )
+
+def make_transcript(text, words, confidence=1.0, backend=""):
+    # Same shape as a whisper verbose_json response, plus the confidence of the result
+    return SimpleNamespace(
+        text=text,
+        words=[SimpleNamespace(word=w, start=start, end=end) for w, start, end in words],
+        confidence=confidence,
+        backend=backend
+    )
+
+class TranscriptionBackend:
+    name = "base"
+    # Whether transcribe calls mark_sent when the request goes out
+    reports_sent = False
+
+    def transcribe(self, segment, label="segment"):
+        raise NotImplementedError
+
+    def cache_key(self):
+        # Everything besides the audio that changes the transcript (see asr_cache.py)
+        return self.name
+
+def retry_after_seconds(error):
+    # Retry-After from a 429 or 503, in seconds or as an HTTP date; None when absent
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class WhisperBackend(TranscriptionBackend):
+    name = "whisper"
+    reports_sent = True
+
+    def __init__(self, client, model="whisper-1", language="en", prompt=COLOR_PROMPT,
+                 timeout=15, max_retries=2, backoff=0.5, governor=None, max_rate_limit_retries=6):
+        # Retries are handled here so the backoff is the same for every error type.
+        # Rate limits have their own, larger budget: a 429 says nothing about the audio.
+        import openai
+
+        self.client = client.with_options(timeout=timeout, max_retries=0)
+        self.model = model
+        self.language = language
+        self.prompt = prompt
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.governor = governor
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.retryable = retryable_errors()
+        self.rate_limit_error = openai.RateLimitError
+
+    def cache_key(self):
+        return f"{self.name}|{self.model}|{self.language}|{self.prompt}"
+
+    def _slot(self, nbytes):
+        if self.governor is None:
+            return contextlib.nullcontext()
+        return self.governor.slot(nbytes)
+
+    def transcribe(self, segment, label="segment"):
+        audio_file = segment.open(f"{label.replace(' ', '_')}.wav")
+        failures = 0
+        rate_limits = 0
+        while True:
+            try:
+                with self._slot(len(segment)):
+                    mark_sent()
+                    result = self.client.audio.transcriptions.create(
+                        model=self.model,
+                        file=audio_file,
+                        language=self.language,
+                        response_format="verbose_json",
+                        timestamp_granularities=["word"],
+                        prompt=self.prompt
+                    )
+                result.confidence = 1.0
+                result.backend = self.name
+                return result
+            except self.retryable as e:
+                retry_after = retry_after_seconds(e)
+                if isinstance(e, self.rate_limit_error):
+                    rate_limits += 1
+                    if rate_limits > self.max_rate_limit_retries:
+                        raise
+                    attempt = rate_limits
+                    if self.governor is not None:
+                        self.governor.pause(retry_after if retry_after is not None else self.backoff * 2 ** attempt)
+                else:
+                    failures += 1
+                    if failures > self.max_retries:
+                        raise
+                    attempt = failures
+                delay = max(retry_after or 0.0, self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+                print(f"Retrying {label} in {delay:.2f}s after error: {e}")
+                time.sleep(delay)
+
+# Local keyword spotter: MFCC features compared by DTW against recorded templates
+
+KWS_RATE = 16000
+KWS_FRAME = 400
+KWS_HOP = 160
+KWS_FFT = 512
+KWS_MELS = 26
+KWS_CEPS = 13
+
+def resample_linear(samples, framerate, target_rate=KWS_RATE):
+    if framerate == target_rate or len(samples) == 0:
+        return samples
+    n_out = int(len(samples) * target_rate / framerate)
+    positions = np.arange(n_out) * (framerate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+def _mel_filterbank(n_mels=KWS_MELS, n_fft=KWS_FFT, rate=KWS_RATE):
+    to_mel = lambda f: 2595 * np.log10(1 + f / 700)
+    to_hz = lambda m: 700 * (10 ** (m / 2595) - 1)
+    points = to_hz(np.linspace(to_mel(0), to_mel(rate / 2), n_mels + 2))
+    bins = np.floor((n_fft + 1) * points / rate).astype(int)
+
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return bank
+
+def _dct_matrix(n_ceps=KWS_CEPS, n_mels=KWS_MELS):
+    k = np.arange(n_ceps)[:, None]
+    n = np.arange(n_mels)[None, :]
+    return (np.cos(np.pi * k * (2 * n + 1) / (2 * n_mels)) * np.sqrt(2 / n_mels)).astype(np.float32)
+
+MEL_BANK = _mel_filterbank()
+DCT = _dct_matrix()
+WINDOW = np.hamming(KWS_FRAME).astype(np.float32)
+
+def mfcc(samples):
+    samples = np.append(samples[:1], samples[1:] - 0.97 * samples[:-1])
+    if len(samples) < KWS_FRAME:
+        samples = np.pad(samples, (0, KWS_FRAME - len(samples)))
+    n_frames = 1 + (len(samples) - KWS_FRAME) // KWS_HOP
+    frames = np.lib.stride_tricks.as_strided(
+        samples,
+        shape=(n_frames, KWS_FRAME),
+        strides=(samples.strides[0] * KWS_HOP, samples.strides[0]),
+        writeable=False
+    )
+    power = np.abs(np.fft.rfft(frames * WINDOW, KWS_FFT)) ** 2 / KWS_FFT
+    features = np.log(power @ MEL_BANK.T + 1e-10) @ DCT.T
+    # Cepstral mean normalization removes the microphone response
+    return features - features.mean(axis=0)
+
+def dtw_distance(a, b):
+    cost = np.sqrt(((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2))
+    previous = np.full(len(b) + 1, np.inf)
+    previous[0] = 0.0
+    for i in range(len(a)):
+        # D[i, j] = c[i, j] + min(D[i-1, j-1], D[i-1, j], D[i, j-1]); the last term is
+        # resolved for the whole row at once with a running minimum over the cumulative cost
+        diagonal_or_up = cost[i] + np.minimum(previous[:-1], previous[1:])
+        running = np.concatenate(([0.0], np.cumsum(cost[i])))
+        row = running[1:] + np.minimum.accumulate(diagonal_or_up - running[1:])
+        previous = np.concatenate(([np.inf], row))
+    return previous[-1] / (len(a) + len(b))
+
+class KeywordSpotterBackend(TranscriptionBackend):
+    name = "local"
+
+    def __init__(self, templates):
+        # templates maps each word to a list of MFCC matrices
+        self.templates = {word: feats for word, feats in templates.items() if feats}
+        if not self.templates:
+            raise ValueError("keyword spotter needs at least one template")
+        digest = hashlib.blake2b(digest_size=8)
+        for word in sorted(self.templates):
+            digest.update(word.encode())
+            for template in self.templates[word]:
+                digest.update(np.ascontiguousarray(template, dtype=np.float32).tobytes())
+        self.fingerprint = digest.hexdigest()
+
+    def cache_key(self):
+        return f"{self.name}|{self.fingerprint}"
+
+    @classmethod
+    def from_directory(cls, template_dir, vocabulary):
+        # Templates are short recordings named after the word, e.g. red_1.wav, red_2.wav
+        templates = {word: [] for word in vocabulary}
+        for path in sorted(Path(template_dir).glob("*.wav")):
+            word = path.stem.split("_")[0].lower()
+            if word not in templates:
+                continue
+            recording = read_wav_view(path.read_bytes())
+            samples = resample_linear(
+                decode_pcm(recording.pcm, recording.sampwidth, recording.n_channels),
+                recording.framerate
+            )
+            index = OnsetIndex(samples, KWS_RATE)
+            regions = index.regions()
+            if regions:
+                start, end = regions[0][0], regions[-1][1]
+                samples = samples[int(start * KWS_RATE):int(end * KWS_RATE)]
+            templates[word].append(mfcc(samples))
+        return cls(templates)
+
+    def classify(self, samples):
+        features = mfcc(samples)
+        distances = {
+            word: min(dtw_distance(features, template) for template in feats)
+            for word, feats in self.templates.items()
+        }
+        ranked = sorted(distances, key=distances.get)
+        best = ranked[0]
+        if len(ranked) == 1:
+            return best, 1.0
+        # Confidence is the margin between the best and the runner-up distance
+        margin = 1 - distances[best] / max(distances[ranked[1]], 1e-9)
+        return best, float(np.clip(margin * 4, 0.0, 1.0))
+
+    def transcribe(self, segment, label="segment"):
+        samples = resample_linear(
+            decode_pcm(segment.pcm, segment.sampwidth, segment.n_channels),
+            segment.framerate
+        )
+        words = []
+        confidences = []
+        for start, end in OnsetIndex(samples, KWS_RATE).regions():
+            word, confidence = self.classify(samples[int(start * KWS_RATE):int(end * KWS_RATE)])
+            words.append((word, start, end))
+            confidences.append(confidence)
+
+        confidence = min(confidences) if confidences else 1.0
+        return make_transcript(" ".join(w for w, _, _ in words), words, confidence, self.name)
+
+class CascadeBackend(TranscriptionBackend):
+    # Tries the primary backend first and only sends low-confidence results to the fallback
+    name = "cascade"
+
+    def __init__(self, primary, fallback, min_confidence=0.3):
+        self.primary = primary
+        self.fallback = fallback
+        self.min_confidence = min_confidence
+
+    def cache_key(self):
+        return f"{self.name}|{self.primary.cache_key()}|{self.fallback.cache_key()}|{self.min_confidence}"
+
+    def transcribe(self, segment, label="segment"):
+        try:
+            result = self.primary.transcribe(segment, label)
+            if result is not None and getattr(result, "confidence", 1.0) >= self.min_confidence:
+                return result
+        except Exception as e:
+            print(f"{self.primary.name} failed on {label}, using {self.fallback.name}: {e}")
+        return self.fallback.transcribe(segment, label)
+
+class HedgedBackend(TranscriptionBackend):
+    # Sends a duplicate when a request is slower than the given quantile of recent
+    # latencies and returns whichever answers first. Hedges are capped at a fraction of
+    # all requests so a slow server is not hit with twice the load. The wait starts when
+    # the request leaves the rate governor, so requests still queued there are not hedged
+    # and latencies are the server's alone. Every request in flight holds a thread of the
+    # pool, and a hedged one two, so max_workers must cover the ASR concurrency. Whole
+    # recordings are neither hedged nor timed: they take far longer than trial segments
+    # and a copy would upload the whole phase again.
+
+    def __init__(self, backend, quantile=0.9, initial_delay=2.0, min_delay=0.25, window=200,
+                 min_samples=20, max_hedge_ratio=0.1, max_workers=64):
+        self.backend = backend
+        self.name = backend.name
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.requests = 0
+        self.hedges_issued = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="asr-hedge")
+
+    def cache_key(self):
+        return self.backend.cache_key()
+
+    def hedge_delay(self):
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            return max(self.min_delay, float(np.quantile(self._latencies, self.quantile)))
+
+    def stats(self):
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges_issued": self.hedges_issued,
+                "hedges_won": self.hedges_won,
+                "hedge_delay": delay
+            }
+
+    def _submit(self, segment, label):
+        # Returns the future and an event set once the request is sent (or has finished)
+        sent = threading.Event()
+        sent_at = []
+
+        def on_sent():
+            if not sent_at:
+                sent_at.append(time.monotonic())
+                sent.set()
+
+        def run():
+            request_sent.set(on_sent)
+            if not self.backend.reports_sent:
+                on_sent()
+            return self.backend.transcribe(segment, label)
+
+        # Copy of the caller's context, so the governor still sees the right session
+        future = self._executor.submit(contextvars.copy_context().run, run)
+
+        def record(done):
+            sent.set()
+            if sent_at and not done.cancelled() and done.exception() is None:
+                with self._lock:
+                    self._latencies.append(time.monotonic() - sent_at[0])
+
+        future.add_done_callback(record)
+        return future, sent
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.hedges_issued >= self.max_hedge_ratio * self.requests:
+                return False
+            self.hedges_issued += 1
+            return True
+
+    def transcribe(self, segment, label="segment"):
+        if label == RECORDING_LABEL:
+            return self.backend.transcribe(segment, label)
+        with self._lock:
+            self.requests += 1
+        primary, sent = self._submit(segment, label)
+        futures = {primary}
+        sent.wait()
+        if not wait(futures, timeout=self.hedge_delay()).done and self._may_hedge():
+            metrics.inc("stroop_asr_hedges_total", result="issued")
+            futures.add(self._submit(segment, f"{label} hedge")[0])
+
+        error = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is not primary:
+                    with self._lock:
+                        self.hedges_won += 1
+                    metrics.inc("stroop_asr_hedges_total", result="won")
+                # The slower request is left to finish on its own; its answer is dropped
+                return result
+        raise error
+
+def build_backend(name, client=None, template_dir="templates", vocabulary=(), min_confidence=0.3,
+                  hedging=None, **whisper_options):
+    # hedging holds HedgedBackend options and wraps every Whisper backend when given
+    def whisper():
+        backend = WhisperBackend(client, **whisper_options)
+        return HedgedBackend(backend, **hedging) if hedging is not None else backend
+
+    if name == "whisper":
+        return whisper()
+    if name == "local":
+        return KeywordSpotterBackend.from_directory(template_dir, vocabulary)
+    if name == "local+whisper":
+        return CascadeBackend(
+            KeywordSpotterBackend.from_directory(template_dir, vocabulary),
+            whisper(),
+            min_confidence
+        )
+    raise ValueError(f"unknown ASR backend {name!r}")
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import metrics
+from asr import TranscriptionBackend, make_transcript
+
+# Transcripts keyed by a hash of the segment's PCM and format plus the backend settings
+# that affect the result (model, language, prompt, templates). A bounded in-memory LRU
+# sits in front of an optional directory of JSON files that is trimmed oldest first
+# once it grows past its size limit. Identical segments, such as digital silence or a
+# recording that is processed again, are transcribed once.
+
+def segment_key(segment, backend_key):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{backend_key}|{segment.n_channels}|{segment.sampwidth}|{segment.framerate}|".encode())
+    digest.update(segment.pcm)
+    return digest.hexdigest()
+
+def _to_record(result):
+    words = getattr(result, "words", None) or []
+    return {
+        "text": result.text,
+        "words": [[w.word, w.start, getattr(w, "end", w.start)] for w in words],
+        "confidence": getattr(result, "confidence", 1.0),
+        "backend": getattr(result, "backend", "")
+    }
+
+def _from_record(record):
+    return make_transcript(
+        record["text"],
+        [tuple(w) for w in record["words"]],
+        record["confidence"],
+        record["backend"]
+    )
+
+class TranscriptCache:
+    def __init__(self, max_entries=4096, disk_dir=None, disk_max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(p.stat().st_size for p in self.disk_dir.glob("*/*.json"))
+
+    def get(self, key):
+        with self._lock:
+            record = self._memory.get(key)
+            if record is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+        if record is not None:
+            metrics.inc("stroop_asr_cache_total", result="hit_memory")
+            return _from_record(record)
+
+        record = self._disk_get(key)
+        if record is not None:
+            with self._lock:
+                self.hits_disk += 1
+                self._remember(key, record)
+            metrics.inc("stroop_asr_cache_total", result="hit_disk")
+            return _from_record(record)
+
+        with self._lock:
+            self.misses += 1
+        metrics.inc("stroop_asr_cache_total", result="miss")
+        return None
+
+    def put(self, key, result):
+        record = _to_record(result)
+        with self._lock:
+            self._remember(key, record)
+        self._disk_put(key, record)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0
+            }
+
+    def _remember(self, key, record):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = record
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            record = json.loads(path.read_text())
+            # The modification time doubles as the last access time for eviction
+            os.utime(path)
+            return record
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, record):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        data = json.dumps(record).encode()
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            # An entry written again replaces the old file, which no longer counts
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Warning: Could not write transcript cache entry {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Trims to 90% of the limit so eviction does not run on every write
+        entries = []
+        for path in self.disk_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+class CachingBackend(TranscriptionBackend):
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def cache_key(self):
+        return self.backend.cache_key()
+
+    def transcribe(self, segment, label="segment"):
+        key = segment_key(segment, self.backend.cache_key())
+        while True:
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+            # A segment that is already being transcribed is waited for, not sent twice
+            with self._lock:
+                pending = self._in_flight.get(key)
+                if pending is None:
+                    pending = self._in_flight[key] = threading.Event()
+                    break
+            pending.wait()
+
+        try:
+            result = self.backend.transcribe(segment, label)
+            if result is not None:
+                self.cache.put(key, result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            pending.set()
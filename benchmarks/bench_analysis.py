@@ -0,0 +1,86 @@
+# Time to load and analyse a large synthetic stroop_trials export with analysis.py:
+# loading from CSV and Parquet, trimming, the per-user summary, interference, RT
+# distributions and bootstrap intervals across users and within every user.
+#
+#   python benchmarks/bench_analysis.py
+#   python benchmarks/bench_analysis.py --users 10000 --trials 20
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import analysis
+from pipeline import COLORS
+
+def synth_trials(n_users, n_trials, rng):
+    # Word reading around 0.7 s, color naming about 80 ms slower, with a skewed tail,
+    # some errors, misses and anticipations
+    n = n_users * len(analysis.CONDITIONS) * n_trials
+    user = np.repeat(np.arange(n_users), len(analysis.CONDITIONS) * n_trials)
+    condition = np.tile(np.repeat(np.arange(len(analysis.CONDITIONS)), n_trials), n_users)
+    speed = rng.normal(0, 0.08, n_users)[user]
+    slowdown = np.where(np.array(analysis.CONDITIONS)[condition] == 'color_naming', 0.08, 0.0)
+    rt = 0.7 + speed + slowdown + rng.gamma(2.0, 0.06, n) + rng.normal(0, 0.05, n)
+    rt[rng.random(n) < 0.01] = rng.uniform(0.05, 0.19)
+    responded = rng.random(n) > 0.03
+    correct = responded & (rng.random(n) > np.where(slowdown > 0, 0.08, 0.03))
+    spoken = np.where(responded, np.array(COLORS, dtype=object)[rng.integers(0, len(COLORS), n)], None)
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'user_id': np.char.add("user", user.astype(str)),
+        'trial_type': np.array(analysis.CONDITIONS, dtype=object)[condition],
+        'trial_number': np.tile(np.arange(1, n_trials + 1), n_users * len(analysis.CONDITIONS)),
+        'spoken_color': spoken,
+        'reaction_time': np.where(responded, rt, 2.0),
+        'correct': correct,
+        'result_version': None
+    })
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:>28}: {time.perf_counter() - start:7.3f}s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Analysis module throughput benchmark")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--trials", type=int, default=20, help="trials per condition")
+    parser.add_argument("--bootstrap", type=int, default=10000)
+    args = parser.parse_args()
+
+    frame = synth_trials(args.users, args.trials, np.random.default_rng(0))
+    print(f"{len(frame)} rows, {args.users} users")
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, "trials.csv")
+    parquet_path = os.path.join(directory, "trials.parquet")
+    frame.to_csv(csv_path, index=False)
+    frame.to_parquet(parquet_path, index=False)
+    try:
+        timed("load csv", lambda: analysis.load_export(csv_path))
+        trials = timed("load parquet", lambda: analysis.load_export(parquet_path))
+        timed("trim", lambda: analysis.rt_mask(trials))
+        timed("summarize", lambda: analysis.summarize(trials))
+        timed("interference", lambda: analysis.interference(trials))
+        timed("rt distribution", lambda: analysis.rt_distribution(trials))
+        timed(f"report ({args.bootstrap} boots)", lambda: analysis.report(trials, n_boot=args.bootstrap))
+        mask = analysis.rt_mask(trials)
+        cells, n = analysis.cell_index(trials)
+        timed("per-cell bootstrap (1000)", lambda: analysis.group_bootstrap_ci(
+            cells[mask], trials.reaction_time[mask], n, n_boot=1000
+        ))
+    finally:
+        for path in (csv_path, parquet_path):
+            os.unlink(path)
+        os.rmdir(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Size and read speed of the compact archive format (compact_audio.py) for each codec
+# and predictor order, against keeping the original WAV. "ratio" is the original WAV
+# size over the compact size, "vs 16k" the same for a 16 kHz mono WAV. Trial reads are
+# the median time to fetch one random trial window; the WAV column slices it out of a
+# memory-mapped file. Synthetic recordings are mostly white noise, which compresses
+# worse than a real room, so the ratios are a lower bound. --wav measures a real file.
+#
+#   python benchmarks/bench_archive.py
+#   python benchmarks/bench_archive.py --minutes 1 10 20 --framerate 44100 --channels 1
+#   python benchmarks/bench_archive.py --wav participant.wav
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pipeline
+from compact_audio import ARCHIVE_RATE, CODECS, CompactAudio, write_compact
+from streaming import open_recording
+from synth import synth_recording
+
+LEAD_IN_SEC = 5
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def median_read_ms(read, n_trials, reads, rng):
+    times = []
+    for i in rng.integers(0, n_trials, reads):
+        _, elapsed = timed(lambda: read(int(i)))
+        times.append(elapsed * 1000)
+    return statistics.median(times)
+
+def bench(path, label, codecs, orders, trial_sec, reads, rng):
+    size = os.path.getsize(path)
+    with open_recording(path) as recording:
+        duration = recording.duration
+        n_trials = max(1, int((duration - LEAD_IN_SEC) // trial_sec))
+        windows = [(LEAD_IN_SEC + i * trial_sec, trial_sec) for i in range(n_trials)]
+        mono_size = 44 + int(recording.nframes * ARCHIVE_RATE / recording.framerate) * 2
+        wav_read_ms = median_read_ms(
+            lambda i: recording.slice_seconds(*windows[i]).pcm.tobytes(), n_trials, reads, rng
+        )
+
+        print(f"\n{label}: {duration / 60:.1f} min, {size / 2 ** 20:.1f} MB WAV, "
+              f"{n_trials} trials, WAV trial read {wav_read_ms:.3f} ms")
+        print(f"{'codec':>5} {'order':>5} {'MB':>7} {'ratio':>6} {'vs 16k':>7} "
+              f"{'encode s':>9} {'decode s':>9} {'trial ms':>9}")
+
+        fd, compact_path = tempfile.mkstemp(suffix=".sca")
+        os.close(fd)
+        try:
+            for codec in codecs:
+                for order in orders:
+                    compact_size, encode_sec = timed(
+                        lambda: write_compact(compact_path, recording, windows, codec=codec, order=order)
+                    )
+                    with CompactAudio(compact_path) as compact:
+                        _, decode_sec = timed(compact.to_wav)
+                        trial_ms = median_read_ms(compact.trial, n_trials, reads, rng)
+                    print(f"{codec:>5} {order:>5} {compact_size / 2 ** 20:>7.2f} {size / compact_size:>6.1f} "
+                          f"{mono_size / compact_size:>7.2f} {encode_sec:>9.2f} {decode_sec:>9.2f} {trial_ms:>9.3f}")
+        finally:
+            os.unlink(compact_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact archive compression and random access benchmark")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--framerate", type=int, default=48000)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--trial-sec", type=float, default=pipeline.TRIAL_TIME_LIMIT)
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    parser.add_argument("--orders", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--reads", type=int, default=200, help="random trial reads per measurement")
+    parser.add_argument("--wav", help="benchmark this recording instead of synthetic ones")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.wav:
+        bench(args.wav, args.wav, args.codecs, args.orders, args.trial_sec, args.reads, rng)
+        return
+
+    for minutes in args.minutes:
+        wav_bytes, _ = synth_recording(minutes * 60, args.framerate, args.channels, rng, args.trial_sec,
+                                       lead_in_sec=LEAD_IN_SEC)
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        with os.fdopen(fd, "wb") as f:
+            f.write(wav_bytes)
+        del wav_bytes
+        try:
+            bench(path, f"{args.framerate} Hz, {args.channels} ch", args.codecs, args.orders, args.trial_sec,
+                  args.reads, rng)
+        finally:
+            os.unlink(path)
+
+if __name__ == "__main__":
+    main()
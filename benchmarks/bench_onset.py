@@ -0,0 +1,135 @@
+# Compares the per-segment voice onset loop the app used to run against the
+# vectorized OnsetIndex on synthetic recordings of 1 to 10 minutes.
+#
+#   python benchmarks/bench_onset.py
+#   python benchmarks/bench_onset.py --minutes 1 5 10 --framerate 48000 --channels 2
+
+import argparse
+import io
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from onset import OnsetIndex
+from segmentation import read_wav_view
+from synth import synth_recording
+
+TRIAL_SEC = 2
+
+def legacy_segment_audio_wave(audio_bytes, test_start_offset_sec, segment_duration_sec, num_segments):
+    with wave.open(io.BytesIO(audio_bytes), 'rb') as wav_file:
+        n_channels = wav_file.getnchannels()
+        sampwidth = wav_file.getsampwidth()
+        framerate = wav_file.getframerate()
+
+        start_frame = int(test_start_offset_sec * framerate)
+        start_byte = start_frame * n_channels * sampwidth
+
+        all_frames = wav_file.readframes(wav_file.getnframes())
+        test_frames = all_frames[start_byte:]
+
+        frames_per_segment = int(framerate * segment_duration_sec)
+        segments = []
+
+        for i in range(num_segments):
+            segment_start = i * frames_per_segment * n_channels * sampwidth
+            segment_end = segment_start + frames_per_segment * n_channels * sampwidth
+            segment_frames = test_frames[segment_start:segment_end]
+
+            segment_buffer = io.BytesIO()
+            with wave.open(segment_buffer, 'wb') as segment_wav:
+                segment_wav.setnchannels(n_channels)
+                segment_wav.setsampwidth(sampwidth)
+                segment_wav.setframerate(framerate)
+                segment_wav.writeframes(segment_frames)
+            segments.append(segment_buffer.getvalue())
+
+        return segments
+
+def legacy_detect_voice_start(segment_bytes, energy_threshold=0.01, frame_ms=10):
+    with wave.open(io.BytesIO(segment_bytes), 'rb') as wav_file:
+        n_channels = wav_file.getnchannels()
+        sampwidth = wav_file.getsampwidth()
+        framerate = wav_file.getframerate()
+        raw = wav_file.readframes(wav_file.getnframes())
+
+    if sampwidth != 2:
+        return None
+
+    audio = np.frombuffer(raw, dtype=np.int16).astype(np.float32)
+
+    if n_channels == 2:
+        audio = audio.reshape(-1, 2).mean(axis=1)
+
+    max_val = np.max(np.abs(audio)) + 1e-9
+    audio = audio / max_val
+
+    frame_size = int(framerate * (frame_ms / 1000.0))
+
+    for i in range(0, len(audio), frame_size):
+        frame = audio[i:i+frame_size]
+        if len(frame) == 0:
+            break
+        energy = np.mean(frame ** 2)
+        if energy > energy_threshold:
+            return i / framerate
+
+    return None
+
+def run_legacy(audio_bytes, n_trials):
+    segments = legacy_segment_audio_wave(audio_bytes, 0, TRIAL_SEC, n_trials)
+    return [legacy_detect_voice_start(segment) for segment in segments]
+
+def run_vectorized(audio_bytes, n_trials):
+    index = OnsetIndex.from_segment(read_wav_view(audio_bytes))
+    return index.onsets([i * TRIAL_SEC for i in range(n_trials)], TRIAL_SEC)
+
+def best_of(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def accuracy(detected, expected):
+    errors = [abs(d - e) for d, e in zip(detected, expected) if d is not None and e is not None]
+    false_hits = sum(1 for d, e in zip(detected, expected) if d is not None and e is None)
+    misses = sum(1 for d, e in zip(detected, expected) if d is None and e is not None)
+    mean_error_ms = 1000 * sum(errors) / len(errors) if errors else float('nan')
+    return mean_error_ms, false_hits, misses
+
+def main():
+    parser = argparse.ArgumentParser(description='Voice onset benchmark')
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 2, 5, 10])
+    parser.add_argument('--framerate', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{args.framerate} Hz, {args.channels} channel(s), {TRIAL_SEC}s trial windows, best of {args.repeat}")
+    print(f"{'minutes':>7} {'trials':>6} {'legacy s':>9} {'vector s':>9} {'speedup':>8}   "
+          f"{'legacy err ms/false/miss':>24} {'vector err ms/false/miss':>24}")
+
+    for minutes in args.minutes:
+        audio_bytes, expected = synth_recording(minutes * 60, args.framerate, args.channels, rng, TRIAL_SEC)
+        n_trials = len(expected)
+
+        legacy_time, legacy_onsets = best_of(lambda: run_legacy(audio_bytes, n_trials), args.repeat)
+        vector_time, vector_onsets = best_of(lambda: run_vectorized(audio_bytes, n_trials), args.repeat)
+
+        legacy_acc = "%.1f/%d/%d" % accuracy(legacy_onsets, expected)
+        vector_acc = "%.1f/%d/%d" % accuracy(vector_onsets, expected)
+        print(f"{minutes:>7g} {n_trials:>6} {legacy_time:>9.3f} {vector_time:>9.3f} "
+              f"{legacy_time / vector_time:>7.1f}x   {legacy_acc:>24} {vector_acc:>24}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Measures how long app.py takes to start and to rerun on the welcome page.
+# Cold start runs in a fresh interpreter; reruns reuse one AppTest session, which is
+# what Streamlit does on every widget interaction. Credentials are dummies, nothing
+# is sent over the network.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --app /path/to/other/checkout/app.py --reruns 100
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_APP = Path(__file__).resolve().parent.parent / "app.py"
+
+DUMMY_ENV = {
+    "OPENAI_API_KEY": "sk-benchmark",
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark",
+}
+
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+AppTest.from_file(sys.argv[1], default_timeout=60).run()
+done = time.perf_counter()
+print(json.dumps({"streamlit_import": imported - start, "first_run": done - imported}))
+"""
+
+def cold_start(app_path, repeat):
+    env = dict(os.environ, **DUMMY_ENV)
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START, str(app_path)],
+            env=env, capture_output=True, text=True, check=True,
+            cwd=Path(app_path).parent
+        )
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return min(s["first_run"] for s in samples)
+
+def rerun_times(app_path, reruns):
+    os.environ.update(DUMMY_ENV)
+    os.chdir(Path(app_path).parent)
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(str(app_path), default_timeout=60)
+    app.run()
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app.run()
+        times.append(time.perf_counter() - start)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py startup and rerun benchmark")
+    parser.add_argument("--app", default=str(DEFAULT_APP))
+    parser.add_argument("--reruns", type=int, default=50)
+    parser.add_argument("--cold-repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app_path = Path(args.app).resolve()
+    first_run = cold_start(app_path, args.cold_repeat)
+    times = rerun_times(app_path, args.reruns)
+    times_ms = sorted(t * 1000 for t in times)
+
+    print(f"app: {app_path}")
+    print(f"first run in a fresh process: {first_run * 1000:.1f} ms (best of {args.cold_repeat})")
+    print(f"rerun over {args.reruns} runs: median {statistics.median(times_ms):.1f} ms, "
+          f"p95 {times_ms[int(0.95 * (len(times_ms) - 1))]:.1f} ms, min {times_ms[0]:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Peak Python heap (tracemalloc) of voice onset detection on long sessions read from a
+# WAV file: the whole-recording OnsetIndex against the chunked stream_trial_windows,
+# and the full per-phase pipeline on the stream with a backend that returns at once.
+# The streamed peak should stay flat as the number of trials grows.
+#
+#   python benchmarks/bench_streaming.py
+#   python benchmarks/bench_streaming.py --trials 50 200 600 --framerate 48000 --channels 2
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pipeline
+from asr import TranscriptionBackend, make_transcript
+from gating import SpeechGate
+from onset import OnsetIndex
+from streaming import open_recording, stream_trial_windows
+from synth import synth_recording
+
+LEAD_IN_SEC = 5
+
+class InstantBackend(TranscriptionBackend):
+    name = "instant"
+
+    def transcribe(self, segment, label="segment"):
+        return make_transcript("red", [], 1.0, self.name)
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming segmentation and VAD memory benchmark")
+    parser.add_argument("--trials", type=int, nargs="+", default=[50, 200, 400])
+    parser.add_argument("--framerate", type=int, default=16000)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--trial-sec", type=float, default=pipeline.TRIAL_TIME_LIMIT)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'trials':>6} {'minutes':>7} {'file MB':>8} {'batch s':>8} {'batch MB':>9} "
+          f"{'stream s':>9} {'stream MB':>10} {'pipeline s':>10} {'pipeline MB':>11}")
+    for n_trials in args.trials:
+        duration = LEAD_IN_SEC + n_trials * args.trial_sec
+        wav_bytes, _ = synth_recording(duration, args.framerate, args.channels, rng, args.trial_sec,
+                                       lead_in_sec=LEAD_IN_SEC)
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        with os.fdopen(fd, "wb") as f:
+            f.write(wav_bytes)
+        size_mb = len(wav_bytes) / 2 ** 20
+        del wav_bytes
+
+        starts = [LEAD_IN_SEC + i * args.trial_sec for i in range(n_trials)]
+        trials = pipeline.generate_trials(n_trials)
+
+        def batch():
+            with open_recording(path) as recording:
+                OnsetIndex.from_segment(recording).onsets(starts, args.trial_sec)
+
+        def stream():
+            with open_recording(path) as recording:
+                for _ in stream_trial_windows(recording, starts, args.trial_sec):
+                    pass
+
+        def full_pipeline():
+            # The per-phase savings line would break up the table
+            with contextlib.redirect_stdout(io.StringIO()):
+                pipeline.process_segmented_audio(path, trials, 1, starts, InstantBackend(), gate=SpeechGate(),
+                                                 warn=lambda message: None)
+
+        try:
+            batch_sec, batch_mb = measure(batch)
+            stream_sec, stream_mb = measure(stream)
+            pipeline_sec, pipeline_mb = measure(full_pipeline)
+        finally:
+            os.unlink(path)
+
+        print(f"{n_trials:>6} {duration / 60:>7.1f} {size_mb:>8.1f} {batch_sec:>8.2f} {batch_mb:>9.1f} "
+              f"{stream_sec:>9.2f} {stream_mb:>10.1f} {pipeline_sec:>10.2f} {pipeline_mb:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# Regression suite for the audio and scoring hot paths. Synthetic sessions are generated
+# for every combination of sample rate, channel count and duration, and each hot function
+# is timed (best of --repeat runs) and its peak Python heap measured with tracemalloc in
+# one more run: splitting the recording into trial windows, per-segment and whole-
+# recording voice onset detection, the streamed windows, the speech gate and the whole
+# offline scoring path with a recognizer that answers at once. Transcript parsing and
+# the aggregation of results into database rows and the per-user summary run once.
+#
+# Results are compared against a JSON baseline and the run fails when a time or peak
+# memory is more than the threshold above it. Save the baseline on the machine that
+# runs the comparison; timings from different machines are not comparable.
+#
+#   python benchmarks/bench_suite.py --save
+#   python benchmarks/bench_suite.py --threshold 0.2
+#   python benchmarks/bench_suite.py --durations 40 --only "onset|end_to_end"
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import mmap
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pipeline
+from analysis import Trials, summarize
+from asr import TranscriptionBackend, make_transcript
+from gating import SpeechGate
+from onset import OnsetIndex, detect_voice_start
+from persistence import build_trial_records, TRIAL_TYPES
+from streaming import open_recording, stream_trial_windows
+from synth import write_recording
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+LEAD_IN_SEC = 2
+# What Whisper returns for a single color word, including the near misses
+TRANSCRIPTS = (
+    "red", "Blue.", " green", "yellow!", "I think purple", "orange orange", "um, red", "",
+    "the word is blue", "grain", "read", "bread", "thank you", "purple.", "yellow", "no idea"
+)
+
+class InstantBackend(TranscriptionBackend):
+    name = "instant"
+
+    def transcribe(self, segment, label="segment"):
+        return make_transcript("red", [], 1.0, self.name)
+
+def measure(fn, repeat):
+    # Best time of repeat runs, then the peak heap of one traced run
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "peak_mb": peak / 2 ** 20}
+
+@contextlib.contextmanager
+def mapped(path):
+    # The recording as the app and the workers hold it: a read-only map of the file
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            pass
+
+def audio_cases(path, duration, trial_sec):
+    # name -> function, for one recording on disk
+    n_trials = int((duration - LEAD_IN_SEC) // trial_sec)
+    starts = [LEAD_IN_SEC + i * trial_sec for i in range(n_trials)]
+    trials = pipeline.generate_trials(n_trials)
+    gate = SpeechGate()
+
+    def segment_audio_wave():
+        with mapped(path) as data:
+            pipeline.segment_audio_wave(data, LEAD_IN_SEC, trial_sec, n_trials)
+
+    def detect_voice_start_each():
+        with mapped(path) as data:
+            for segment in pipeline.segment_audio_wave(data, LEAD_IN_SEC, trial_sec, n_trials):
+                detect_voice_start(segment)
+
+    def detect_trial_onsets():
+        with open_recording(path) as recording:
+            OnsetIndex.from_segment(recording).onsets(starts, trial_sec)
+
+    def stream_windows():
+        with open_recording(path) as recording:
+            for _ in stream_trial_windows(recording, starts, trial_sec):
+                pass
+
+    def speech_gate():
+        with open_recording(path) as recording:
+            for _, segment, _, span in stream_trial_windows(recording, starts, trial_sec):
+                gate.prepare(segment, span)
+
+    def end_to_end():
+        # The per-phase savings line would break up the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline.process_segmented_audio(str(path), trials, 1, starts, InstantBackend(), gate=gate,
+                                             warn=lambda message: None)
+
+    return {
+        "segment_audio_wave": segment_audio_wave,
+        "detect_voice_start": detect_voice_start_each,
+        "detect_trial_onsets": detect_trial_onsets,
+        "stream_trial_windows": stream_windows,
+        "speech_gate": speech_gate,
+        "end_to_end": end_to_end,
+    }
+
+def scoring_cases(n_sessions, rng):
+    # Transcript parsing and result aggregation for many sessions' worth of trials
+    transcripts = [TRANSCRIPTS[i] for i in rng.integers(0, len(TRANSCRIPTS), n_sessions * pipeline.NUM_TRIALS)]
+    sessions = []
+    for s in range(n_sessions):
+        phases = {}
+        for phase in TRIAL_TYPES:
+            trials = pipeline.generate_trials()
+            onsets = rng.uniform(0.3, 1.5, len(trials))
+            phases[phase] = [
+                pipeline.segment_result(i, trial, phase, TRANSCRIPTS[(s + i) % len(TRANSCRIPTS)].lower(),
+                                        None if onset > 1.4 else onset, i * pipeline.TRIAL_TIME_LIMIT)
+                for i, (trial, onset) in enumerate(zip(trials, onsets))
+            ]
+        sessions.append((f"user{s}", phases))
+
+    def parse_colors():
+        for transcript in transcripts:
+            pipeline.parse_color_from_transcript(transcript.lower().strip())
+
+    def aggregate_results():
+        # What the app does at the end of a test, then the cross-participant summary
+        records = []
+        scores = []
+        for user_id, phases in sessions:
+            for phase, results in phases.items():
+                scores.append((sum(1 for r in results if r['correct']), sum(r['time'] for r in results) / len(results)))
+                records.extend(build_trial_records(results, user_id, TRIAL_TYPES[phase]))
+        columns = {
+            name: [record[name] for record in records]
+            for name in ('user_id', 'trial_type', 'trial_number', 'spoken_color', 'reaction_time', 'correct')
+        }
+        summarize(Trials(columns))
+
+    return {
+        f"parse_color_from_transcript/{len(transcripts)}": parse_colors,
+        f"aggregate_results/{n_sessions}_sessions": aggregate_results,
+    }
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+def run(args):
+    results = {}
+    only = re.compile(args.only) if args.only else None
+
+    def record(name, fn):
+        if only and not only.search(name):
+            return
+        results[name] = measure(fn, args.repeat)
+        print(f"{name:<52} {results[name]['seconds']:>9.4f}s {results[name]['peak_mb']:>9.1f} MB", flush=True)
+
+    for name, fn in scoring_cases(args.sessions, np.random.default_rng(0)).items():
+        record(name, fn)
+
+    directory = tempfile.mkdtemp()
+    try:
+        for framerate in args.rates:
+            for channels in args.channels:
+                for duration in args.durations:
+                    prefix = f"{framerate}hz/{channels}ch/{duration:g}s"
+                    path = Path(directory) / "session.wav"
+                    cases = audio_cases(path, duration, args.trial_sec)
+                    if only and not any(only.search(f"{name}/{prefix}") for name in cases):
+                        continue
+                    # Seeded per recording, so a partial run measures the same audio
+                    rng = np.random.default_rng([framerate, channels, int(duration * 1000)])
+                    write_recording(path, duration, framerate, channels, rng, args.trial_sec,
+                                    lead_in_sec=LEAD_IN_SEC)
+                    try:
+                        for name, fn in cases.items():
+                            record(f"{name}/{prefix}", fn)
+                    finally:
+                        os.unlink(path)
+    finally:
+        os.rmdir(directory)
+    return results
+
+def compare(results, baseline, threshold, memory_threshold, min_seconds, min_mb):
+    # Returns the regressions; changes below min_seconds or min_mb are noise
+    regressions = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<52} new")
+            continue
+        time_change = current["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        memory_change = current["peak_mb"] / base["peak_mb"] - 1 if base["peak_mb"] else 0.0
+        slower = time_change > threshold and current["seconds"] - base["seconds"] > min_seconds
+        bigger = memory_change > memory_threshold and current["peak_mb"] - base["peak_mb"] > min_mb
+        flag = "REGRESSION" if slower or bigger else ""
+        print(f"{name:<52} {time_change:>+8.1%} time {memory_change:>+8.1%} memory  {flag}")
+        if slower:
+            regressions.append(f"{name}: {base['seconds']:.4f}s -> {current['seconds']:.4f}s")
+        if bigger:
+            regressions.append(f"{name}: {base['peak_mb']:.1f} MB -> {current['peak_mb']:.1f} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path benchmarks with baseline regression checks")
+    parser.add_argument("--rates", type=int, nargs="+", default=[16000, 44100, 48000])
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--durations", type=float, nargs="+", default=[40, 300, 1200],
+                        help="session lengths in seconds")
+    parser.add_argument("--trial-sec", type=float, default=pipeline.TRIAL_TIME_LIMIT)
+    parser.add_argument("--sessions", type=int, default=2000, help="sessions for the scoring benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark; the best counts")
+    parser.add_argument("--only", help="regular expression selecting benchmarks by name")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results into the baseline")
+    parser.add_argument("--output", type=Path, help="also write this run's results here")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_THRESHOLD", "0.25")),
+                        help="allowed slowdown, as a fraction of the baseline time")
+    parser.add_argument("--memory-threshold", type=float, default=float(os.getenv("BENCH_MEMORY_THRESHOLD", "0.10")),
+                        help="allowed growth of the peak memory, as a fraction of the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.01,
+                        help="slowdowns smaller than this are ignored, whatever the fraction")
+    parser.add_argument("--min-mb", type=float, default=1.0,
+                        help="memory growth smaller than this is ignored, whatever the fraction")
+    args = parser.parse_args()
+
+    results = run(args)
+    report = {"environment": environment(), "created": time.time(), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+    if args.save:
+        # A partial run only replaces the benchmarks it ran
+        merged = dict(stored["results"]) if stored else {}
+        merged.update(results)
+        report["results"] = merged
+        args.baseline.write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"Saved {len(results)} results to {args.baseline}")
+        return
+    if stored is None:
+        print(f"No baseline at {args.baseline}; run with --save to create one")
+        return
+
+    if stored.get("environment") != report["environment"]:
+        print(f"Warning: the baseline was recorded on {stored.get('environment')}, "
+              f"this is {report['environment']}")
+    print()
+    regressions = compare(results, stored["results"], args.threshold, args.memory_threshold,
+                          args.min_seconds, args.min_mb)
+    if regressions:
+        print(f"\n{len(regressions)} regressions over the baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
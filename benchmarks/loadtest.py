@@ -0,0 +1,301 @@
+# Load test for one app server process. Simulated participants go through welcome,
+# countdown, two phases of trials, processing and saving at the same time. The real
+# OpenAI and Supabase clients are pointed at a local stand-in server with configurable
+# latency and error rates. Every concurrency level runs in a fresh process, so CPU
+# time and peak RSS are measured per level.
+#
+#   python benchmarks/loadtest.py --concurrency 1 5 10 25
+#   python benchmarks/loadtest.py --concurrency 20 --asr-latency-ms 800 --asr-error-rate 0.05 --time-scale 0.01
+#   python benchmarks/loadtest.py --concurrency 20 --asr-limit-rps 40 --governor-rps 35
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import pipeline
+from synth import synth_recording
+
+COLORS = pipeline.COLORS
+COUNTDOWN_TIME = 5
+DUMMY_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.loadtest"
+
+# Stand-in for the OpenAI transcription endpoint and the Supabase REST API
+
+def standin_handler(options):
+    rng = random.Random(options["seed"])
+    lock = threading.Lock()
+    # Server-side limit like the real API: a fixed number of requests per second window
+    window = {"start": time.monotonic(), "count": 0}
+
+    def over_limit():
+        if not options["asr_limit_rps"]:
+            return False
+        with lock:
+            now = time.monotonic()
+            if now - window["start"] >= 1.0:
+                window["start"], window["count"] = now, 0
+            window["count"] += 1
+            return window["count"] > options["asr_limit_rps"]
+
+    def draw():
+        with lock:
+            return rng.random(), rng.lognormvariate(0, options["latency_sigma"])
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body, headers=()):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            roll, spread = draw()
+
+            if self.path.startswith("/v1/audio/transcriptions"):
+                if over_limit():
+                    return self._reply(429, {"error": {"message": "rate limited"}}, [("Retry-After", "1")])
+                time.sleep(options["asr_latency_ms"] / 1000 * spread)
+                if roll < options["asr_429_rate"]:
+                    return self._reply(429, {"error": {"message": "rate limited"}}, [("Retry-After", "1")])
+                if roll < options["asr_429_rate"] + options["asr_error_rate"]:
+                    return self._reply(500, {"error": {"message": "stand-in failure"}})
+                word = COLORS[int(roll * 1e6) % len(COLORS)]
+                start = 0.3 + (roll * 1e3 % 1) * 0.8
+                return self._reply(200, {
+                    "task": "transcribe",
+                    "language": "english",
+                    "duration": 2.0,
+                    "text": word,
+                    "words": [{"word": word, "start": start, "end": start + 0.3}]
+                })
+
+            if self.path.startswith("/rest/v1/"):
+                time.sleep(options["db_latency_ms"] / 1000 * spread)
+                if roll < options["db_error_rate"]:
+                    return self._reply(503, {"message": "stand-in failure"})
+                return self._reply(201, [])
+
+            self._reply(404, {"error": "not found"})
+
+    return Handler
+
+def run_standin(options, port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), standin_handler(options))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+# One concurrency level, run in its own process
+
+class FakeUpload(io.BytesIO):
+    def __init__(self, data, file_id):
+        super().__init__(data)
+        self.file_id = file_id
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    return float(np.percentile(values, q))
+
+def run_level(concurrency, args, port, result_queue):
+    import httpx
+    from openai import OpenAI
+    from supabase import create_client
+
+    from asr import WhisperBackend
+    from gating import SpeechGate
+    from governor import RateGovernor, session_scope
+    from persistence import SupabaseSink, SpoolJournal, WriteBehindQueue, build_trial_records, TRIAL_TYPES
+    from recording_store import RecordingStore
+
+    rng = np.random.default_rng(args.seed)
+    phase_sec = COUNTDOWN_TIME + pipeline.NUM_TRIALS * pipeline.TRIAL_TIME_LIMIT
+    recordings = [
+        synth_recording(phase_sec - COUNTDOWN_TIME + 1, args.framerate, 1, rng, pipeline.TRIAL_TIME_LIMIT)[0]
+        for _ in range(4)
+    ]
+
+    client = OpenAI(
+        api_key="sk-loadtest",
+        base_url=f"http://127.0.0.1:{port}/v1",
+        http_client=httpx.Client(limits=httpx.Limits(max_connections=200, max_keepalive_connections=50))
+    )
+    governor = RateGovernor(args.governor_rps, args.governor_burst) if args.governor_rps else None
+    backend = WhisperBackend(client, timeout=args.asr_timeout, max_retries=args.asr_retries, backoff=0.2,
+                             governor=governor)
+    gate = SpeechGate() if args.speech_gate else None
+    spool_dir = tempfile.mkdtemp(prefix="loadtest-")
+    queue = WriteBehindQueue(
+        SupabaseSink(create_client(f"http://127.0.0.1:{port}", DUMMY_SUPABASE_KEY)),
+        SpoolJournal(os.path.join(spool_dir, "spool.db")),
+        flush_interval=0.5,
+        base_backoff=0.2
+    )
+    store = RecordingStore(spill_dir=spool_dir)
+
+    lock = threading.Lock()
+    phase_latencies = []
+    session_latencies = []
+    failed_segments = [0]
+
+    def session(worker_index):
+        for _ in range(args.rounds):
+            user_id = str(uuid.uuid4())
+            with session_scope(user_id):
+                run_session(worker_index, user_id)
+
+    def run_session(worker_index, user_id):
+        trials = pipeline.generate_trials()
+        phase_results = {}
+        for phase in (1, 2):
+            # Countdown and trials run in the browser; the server only waits for the upload
+            time.sleep(phase_sec * args.time_scale)
+            recording = recordings[(worker_index + phase) % len(recordings)]
+            store.put(user_id, phase, FakeUpload(recording, f"{user_id}-{phase}"))
+            timestamps = [i * pipeline.TRIAL_TIME_LIMIT for i in range(len(trials))]
+
+            start = time.perf_counter()
+            results = pipeline.process_segmented_audio(
+                store.get(user_id, phase), trials, phase, timestamps, backend,
+                mode=args.mode, max_concurrency=args.asr_concurrency, warn=lambda message: None,
+                gate=gate
+            )
+            store.release(user_id, phase)
+            if phase == 2:
+                records = (
+                    build_trial_records(phase_results[1], user_id, TRIAL_TYPES[1]) +
+                    build_trial_records(results, user_id, TRIAL_TYPES[2])
+                )
+                queue.enqueue_session({"id": user_id, "name": "load test"}, records)
+            elapsed = time.perf_counter() - start
+
+            phase_results[phase] = results
+            with lock:
+                phase_latencies.append(elapsed)
+                if phase == 2:
+                    session_latencies.append(elapsed)
+                failed_segments[0] += sum(1 for r in results if r["transcript"] == "N/A")
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.perf_counter()
+    threads = []
+    for i in range(concurrency):
+        thread = threading.Thread(target=session, args=(i,))
+        threads.append(thread)
+        thread.start()
+        time.sleep(args.ramp_sec / max(concurrency, 1))
+    for thread in threads:
+        thread.join()
+    flushed = queue.stop(timeout=60)
+    wall = time.perf_counter() - wall_start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    sessions = concurrency * args.rounds
+    result_queue.put({
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "wall_sec": wall,
+        "throughput": sessions / wall,
+        "p50": percentile(phase_latencies, 50),
+        "p95": percentile(phase_latencies, 95),
+        "p99": percentile(phase_latencies, 99),
+        "final_p95": percentile(session_latencies, 95),
+        "cpu_sec": cpu,
+        "cpu_cores": cpu / wall,
+        # ru_maxrss is reported in KiB on Linux
+        "peak_rss_mb": usage_after.ru_maxrss / 1024,
+        "failed_segments": failed_segments[0],
+        "spool_drained": flushed
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent participant load test")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 25])
+    parser.add_argument("--rounds", type=int, default=1, help="sessions run back to back by each participant")
+    parser.add_argument("--time-scale", type=float, default=0.0,
+                        help="fraction of the real countdown and trial time to wait (0 = skip)")
+    parser.add_argument("--ramp-sec", type=float, default=0.0, help="spread participant arrivals over this time")
+    parser.add_argument("--mode", choices=["segmented", "whole"], default="segmented")
+    parser.add_argument("--framerate", type=int, default=48000)
+    parser.add_argument("--speech-gate", action="store_true", help="skip silent trials and trim uploads")
+    parser.add_argument("--asr-concurrency", type=int, default=5)
+    parser.add_argument("--asr-timeout", type=float, default=15)
+    parser.add_argument("--asr-retries", type=int, default=2)
+    parser.add_argument("--asr-latency-ms", type=float, default=400)
+    parser.add_argument("--asr-error-rate", type=float, default=0.0)
+    parser.add_argument("--asr-429-rate", type=float, default=0.0)
+    parser.add_argument("--asr-limit-rps", type=int, default=0,
+                        help="stand-in answers 429 above this many requests per second (0 = no limit)")
+    parser.add_argument("--governor-rps", type=float, default=0.0,
+                        help="pace requests with the shared rate governor (0 = off)")
+    parser.add_argument("--governor-burst", type=int, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=150)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="lognormal spread of stand-in latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print one JSON object per level")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    standin = context.Process(target=run_standin, args=({
+        "seed": args.seed,
+        "latency_sigma": args.latency_sigma,
+        "asr_latency_ms": args.asr_latency_ms,
+        "asr_error_rate": args.asr_error_rate,
+        "asr_429_rate": args.asr_429_rate,
+        "asr_limit_rps": args.asr_limit_rps,
+        "db_latency_ms": args.db_latency_ms,
+        "db_error_rate": args.db_error_rate
+    }, port_queue), daemon=True)
+    standin.start()
+    port = port_queue.get(timeout=30)
+
+    if not args.json:
+        print(f"{'conc':>5} {'sessions':>8} {'sess/s':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+              f"{'cpu cores':>9} {'peak RSS MB':>11} {'N/A segs':>8}")
+    try:
+        for concurrency in args.concurrency:
+            result_queue = context.Queue()
+            worker = context.Process(target=run_level, args=(concurrency, args, port, result_queue))
+            worker.start()
+            result = result_queue.get()
+            worker.join()
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['concurrency']:>5} {result['sessions']:>8} {result['throughput']:>7.2f} "
+                      f"{result['p50']:>7.2f} {result['p95']:>7.2f} {result['p99']:>7.2f} "
+                      f"{result['cpu_cores']:>9.2f} {result['peak_rss_mb']:>11.0f} {result['failed_segments']:>8}")
+    finally:
+        standin.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Synthetic participant recordings: background noise with a short harmonic burst
+# (a stand-in for a spoken word) at a known onset inside some of the trial windows.
+
+import io
+import wave
+
+import numpy as np
+
+def synth_recording(duration_sec, framerate, n_channels, rng, trial_sec=2, response_rate=0.8,
+                    lead_in_sec=0.0):
+    n_samples = int(duration_sec * framerate)
+    audio = rng.normal(0, 0.004, n_samples).astype(np.float32)
+    n_trials = int((duration_sec - lead_in_sec) // trial_sec)
+    onsets = []
+
+    for i in range(n_trials):
+        if rng.random() > response_rate:
+            onsets.append(None)
+            continue
+        onset = rng.uniform(0.35, 1.2)
+        length = rng.uniform(0.25, 0.5)
+        t = np.arange(int(length * framerate)) / framerate
+        f0 = rng.uniform(110, 220)
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+        envelope = np.sin(np.pi * t / length) ** 0.5
+        start = int((lead_in_sec + i * trial_sec + onset) * framerate)
+        audio[start:start + len(t)] += (0.25 * voiced * envelope).astype(np.float32)
+        onsets.append(onset)
+
+    pcm = (np.clip(audio, -1, 1) * 32767).astype('<i2')
+    if n_channels > 1:
+        pcm = np.repeat(pcm[:, None], n_channels, axis=1)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(n_channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(framerate)
+        wav_file.writeframes(pcm.tobytes())
+    return buffer.getvalue(), onsets
+
+def write_recording(path, duration_sec, framerate, n_channels, rng, trial_sec=2, response_rate=0.8,
+                    lead_in_sec=0.0):
+    # The same kind of recording written to a WAV file one trial at a time, for sessions
+    # too long to build in memory. Returns the onsets.
+    onsets = []
+    n_trials = int((duration_sec - lead_in_sec) // trial_sec)
+    total = int(duration_sec * framerate)
+    written = 0
+
+    with wave.open(str(path), 'wb') as wav_file:
+        wav_file.setnchannels(n_channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(framerate)
+
+        def emit(audio):
+            pcm = (np.clip(audio, -1, 1) * 32767).astype('<i2')
+            if n_channels > 1:
+                pcm = np.repeat(pcm[:, None], n_channels, axis=1)
+            wav_file.writeframes(pcm.tobytes())
+            return len(audio)
+
+        written += emit(rng.normal(0, 0.004, int(lead_in_sec * framerate)).astype(np.float32))
+        for i in range(n_trials):
+            end = int((lead_in_sec + (i + 1) * trial_sec) * framerate)
+            audio = rng.normal(0, 0.004, end - written).astype(np.float32)
+            if rng.random() > response_rate:
+                onsets.append(None)
+            else:
+                onset = rng.uniform(0.35, 1.2)
+                length = rng.uniform(0.25, 0.5)
+                t = np.arange(int(length * framerate)) / framerate
+                f0 = rng.uniform(110, 220)
+                voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+                envelope = np.sin(np.pi * t / length) ** 0.5
+                start = int(onset * framerate)
+                audio[start:start + len(t)] += (0.25 * voiced * envelope).astype(np.float32)
+                onsets.append(onset)
+            written += emit(audio)
+        emit(rng.normal(0, 0.004, max(0, total - written)).astype(np.float32))
+    return onsets
@@ -0,0 +1,211 @@
+import bz2
+import json
+import lzma
+import math
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from onset import decode_pcm
+from segmentation import WavSegment, wav_header
+
+# Archival format for phase recordings. The audio is converted to 16 kHz mono 16-bit,
+# the same as what is uploaded for transcription, and stored as independently compressed
+# blocks: each sample is replaced by its difference from the previous one (small numbers
+# for audio), the differences are zigzag-mapped to unsigned and split into a low-byte and
+# a high-byte plane, and the planes are compressed with zlib, lzma or bz2. Block
+# boundaries fall on every trial window, and a JSON header lists the byte range of each
+# block, so one trial is read by decoding only its own block.
+#
+#   magic "SCA1" | header length (uint32) | JSON header | blocks
+
+MAGIC = b"SCA1"
+ARCHIVE_RATE = 16000
+# Blocks between trial windows (the lead-in, long gaps) are split at this length
+BLOCK_SEC = 10.0
+CHUNK_SEC = 10.0
+
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=6), lzma.decompress),
+    "bz2": (lambda data: bz2.compress(data, 9), bz2.decompress)
+}
+
+def encode_block(samples, codec="zlib", order=1):
+    # samples: int16 array. The arithmetic wraps around, which cumsum undoes exactly.
+    residual = samples
+    for _ in range(order):
+        residual = np.diff(residual, prepend=np.int16(0))
+    zigzag = (residual.astype(np.uint16) << 1) ^ (residual >> 15).astype(np.uint16)
+    planes = zigzag.astype('<u2').view(np.uint8).reshape(-1, 2).T
+    return CODECS[codec][0](planes.tobytes())
+
+def decode_block(data, codec="zlib", order=1):
+    planes = np.frombuffer(CODECS[codec][1](data), dtype=np.uint8).reshape(2, -1)
+    zigzag = planes[0].astype(np.uint16) | (planes[1].astype(np.uint16) << 8)
+    samples = (zigzag >> 1).astype(np.int16) ^ -(zigzag & 1).astype(np.int16)
+    for _ in range(order):
+        samples = np.cumsum(samples, dtype=np.int16)
+    return samples
+
+def mono_pcm16(recording, rate=ARCHIVE_RATE, chunk_sec=CHUNK_SEC):
+    # Yields the recording as 16-bit mono at rate, chunk by chunk. The interpolation runs
+    # across chunk boundaries, so the result is resample_linear on the whole recording
+    # up to floating-point rounding.
+    if recording.n_channels == 1 and recording.sampwidth == 2 and recording.framerate == rate:
+        chunk = max(1, int(chunk_sec * rate))
+        for start in range(0, recording.nframes, chunk):
+            yield np.frombuffer(recording.slice_frames(start, start + chunk).pcm, dtype='<i2')
+        return
+
+    n_in = recording.nframes
+    ratio = recording.framerate / rate
+    n_out = int(n_in * rate / recording.framerate)
+    chunk = max(1, int(chunk_sec * recording.framerate))
+    k = 0
+    for start in range(0, n_in, chunk):
+        end = min(n_in, start + chunk)
+        # One frame past the chunk so the last outputs interpolate across the boundary
+        samples = decode_pcm(
+            recording.slice_frames(start, end + 1).pcm, recording.sampwidth, recording.n_channels
+        )
+        k_end = n_out if end == n_in else min(n_out, math.ceil(end / ratio))
+        if rate == recording.framerate:
+            out = samples[:end - start]
+        else:
+            positions = np.arange(k, k_end) * ratio - start
+            out = np.interp(positions, np.arange(len(samples)), samples)
+        k = k_end
+        yield (np.clip(out, -1.0, 1.0) * 32767).astype('<i2')
+
+def write_compact(path, recording, windows=(), rate=ARCHIVE_RATE, codec="zlib", order=1, block_sec=BLOCK_SEC):
+    # recording: a WavSegment. windows: (start_sec, duration_sec) per trial, indexed for
+    # trial(). Returns the number of bytes written.
+    n_out = recording.nframes if rate == recording.framerate else int(recording.nframes * rate / recording.framerate)
+    trial_frames = []
+    boundaries = set(range(0, n_out, max(1, int(block_sec * rate))))
+    for start_sec, duration_sec in windows:
+        start = min(n_out, max(0, int(start_sec * rate)))
+        end = min(n_out, start + int(duration_sec * rate))
+        trial_frames.append([start, end])
+        boundaries.update((start, end))
+    boundaries.discard(0)
+    cuts = iter(sorted(b for b in boundaries if b < n_out))
+
+    blocks = []
+    position = 0
+
+    def emit(samples):
+        nonlocal position
+        if len(samples):
+            blocks.append((position, len(samples), encode_block(samples, codec, order)))
+            position += len(samples)
+
+    # Samples are collected until the next block boundary; only one block is held at a time
+    buffered = np.empty(0, dtype=np.int16)
+    cut = next(cuts, None)
+    for chunk in mono_pcm16(recording, rate):
+        buffered = np.concatenate((buffered, chunk)) if len(buffered) else chunk
+        while cut is not None and position + len(buffered) >= cut:
+            block, buffered = buffered[:cut - position], buffered[cut - position:]
+            emit(block)
+            cut = next(cuts, None)
+    emit(buffered)
+
+    offset = 0
+    index = []
+    chunks = []
+    for start, nframes, data in blocks:
+        index.append([start, nframes, offset, len(data)])
+        offset += len(data)
+        chunks.append(data)
+    header = json.dumps({
+        "framerate": rate,
+        "nframes": position,
+        "codec": codec,
+        "order": order,
+        "blocks": index,
+        "trials": trial_frames
+    }).encode()
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack('<4sI', MAGIC, len(header)))
+        f.write(header)
+        for data in chunks:
+            f.write(data)
+    os.replace(tmp, path)
+    return 8 + len(header) + offset
+
+class CompactAudio:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = struct.unpack_from('<4sI', self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a compact audio file")
+        header = json.loads(self._map[8:8 + header_len])
+        self._data_start = 8 + header_len
+        self.framerate = header["framerate"]
+        self.nframes = header["nframes"]
+        self.codec = header["codec"]
+        self.order = header["order"]
+        self.blocks = header["blocks"]
+        self.trials = header["trials"]
+        self._block_starts = np.array([block[0] for block in self.blocks], dtype=np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    @property
+    def duration(self):
+        return self.nframes / self.framerate
+
+    def _decode(self, i):
+        _, _, offset, length = self.blocks[i]
+        start = self._data_start + offset
+        return decode_block(self._map[start:start + length], self.codec, self.order)
+
+    def read_frames(self, start, end):
+        # int16 samples [start, end), decoding only the blocks that overlap them
+        start = max(0, start)
+        end = min(self.nframes, end)
+        out = np.empty(max(0, end - start), dtype=np.int16)
+        if not len(out):
+            return out
+        first = int(np.searchsorted(self._block_starts, start, side="right")) - 1
+        for i in range(first, len(self.blocks)):
+            block_start, nframes = self.blocks[i][:2]
+            if block_start >= end:
+                break
+            samples = self._decode(i)
+            lo = max(start, block_start)
+            hi = min(end, block_start + nframes)
+            out[lo - start:hi - start] = samples[lo - block_start:hi - block_start]
+        return out
+
+    def segment(self, start_sec, duration_sec):
+        # Same frame arithmetic as WavSegment.slice_seconds
+        start = int(start_sec * self.framerate)
+        return self._wav(self.read_frames(start, start + int(duration_sec * self.framerate)))
+
+    def trial(self, i):
+        start, end = self.trials[i]
+        return self._wav(self.read_frames(start, end))
+
+    def to_wav(self):
+        pcm = self.read_frames(0, self.nframes).astype('<i2', copy=False)
+        return wav_header(1, 2, self.framerate, pcm.nbytes) + pcm.tobytes()
+
+    def _wav(self, samples):
+        return WavSegment(memoryview(samples.astype('<i2', copy=False)).cast('B'), 1, 2, self.framerate)
@@ -0,0 +1,390 @@
+# Exports archived trials as a training set for fine-tuning a speech recognizer on the
+# color words. Every trial window is written as 16 kHz mono 16-bit audio, one row of a
+# fixed-size shard, together with its labels: the displayed word and color, the answer
+# the phase expects, the voice onset and end found by the same detector the app uses,
+# and the transcript stored in stroop_trials (by the app, or by a rescore.py run).
+#
+#   python dataset_export.py --output dataset --labels onset-v2.jsonl --version onset-v2
+#   python dataset_export.py --output dataset --labels local --workers 8
+#
+# Layout of the output directory:
+#
+#   dataset.json      rate, window length and shard size, written once
+#   shard-00000.npy   int16 array (shard_trials, window frames), one trial per row
+#   index.jsonl       one line per trial: shard, row, valid frames and the labels
+#   sessions.done     sessions whose rows are all in the index
+#
+# Sessions are decoded by a pool of worker processes and appended in order, so memory
+# holds a few sessions at a time however large the archive is. Audio rows are flushed
+# before their index lines are written, and a session is listed as done after its index
+# lines, so an interrupted export resumes after the last finished session. Shards are
+# plain .npy files: np.load(path, mmap_mode="r") reads any trial without decoding.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import pipeline
+from archive import RecordingArchive, trial_windows
+from compact_audio import ARCHIVE_RATE, CompactAudio, mono_pcm16
+from persistence import TRIAL_TYPES
+from segmentation import WavSegment, read_wav_view
+from streaming import open_recording, stream_trial_windows
+
+FORMAT_VERSION = 1
+# 1024 two-second trials at 16 kHz are 64 MB per shard
+SHARD_TRIALS = 1024
+MANIFEST_FILE = "dataset.json"
+INDEX_FILE = "index.jsonl"
+DONE_FILE = "sessions.done"
+
+_worker = {}
+
+def shard_name(shard):
+    return f"shard-{shard:05d}.npy"
+
+def phase_samples(recording, rate=ARCHIVE_RATE):
+    # The whole phase as mono int16 at rate; a compact archive already stores it that way
+    if recording.compact:
+        with CompactAudio(recording.audio_path) as compact:
+            if compact.framerate == rate:
+                return compact.read_frames(0, compact.nframes)
+            wav = compact.to_wav()
+        return np.concatenate(list(mono_pcm16(read_wav_view(wav), rate)) or [np.empty(0, np.int16)])
+    with open_recording(recording.audio_path) as wav:
+        return np.concatenate(list(mono_pcm16(wav, rate)) or [np.empty(0, np.int16)])
+
+def phase_windows(recording, rate, window_sec):
+    # (audio rows, valid frames per row, speech span per trial) of one archived phase
+    samples = phase_samples(recording, rate)
+    source = WavSegment(memoryview(samples.astype('<i2', copy=False)).cast('B'), 1, 2, rate)
+    starts = [start for start, _ in trial_windows(recording.trial_timestamps, len(recording.trials), window_sec)]
+    window_frames = int(window_sec * rate)
+    audio = np.zeros((len(starts), window_frames), dtype=np.int16)
+    frames = np.zeros(len(starts), dtype=np.int64)
+    spans = [None] * len(starts)
+    for i, segment, _, span in stream_trial_windows(source, starts, window_sec):
+        # The last window of a recording that stopped early is shorter; the rest is silence
+        row = np.frombuffer(segment.pcm, dtype='<i2')[:window_frames]
+        audio[i, :len(row)] = row
+        frames[i] = len(row)
+        spans[i] = span
+    return audio, frames, spans
+
+def init_worker(options):
+    _worker.update(
+        archive=RecordingArchive(options["archive"]),
+        rate=options["rate"],
+        window_sec=options["window_sec"]
+    )
+
+def export_session(session_id):
+    # Returns (session_id, phases, problems); a session with problems is not written
+    archive = _worker["archive"]
+    phases = []
+    problems = []
+    for phase in archive.phases(session_id):
+        recording = archive.load(session_id, phase)
+        if recording is None:
+            continue
+        if recording.trial_sec != _worker["window_sec"]:
+            problems.append(
+                f"phase {phase} was recorded with {recording.trial_sec} s trials, "
+                f"the dataset has {_worker['window_sec']} s windows"
+            )
+            continue
+        try:
+            audio, frames, spans = phase_windows(recording, _worker["rate"], _worker["window_sec"])
+        except Exception as e:
+            problems.append(f"phase {phase}: {type(e).__name__}: {e}")
+            continue
+        phases.append((phase, recording.trials, audio, frames, spans))
+    return session_id, phases, problems
+
+def load_labels(source, version=None):
+    # (user_id, trial_type, trial_number) -> stroop_trials row, from the local database or
+    # a CSV, Parquet or JSON lines export. None selects the rows written by the app itself.
+    columns = ('user_id', 'trial_type', 'trial_number', 'transcript', 'spoken_color', 'result_version')
+    suffix = os.path.splitext(str(source))[1].lower()
+    if source == "local" or suffix == ".db":
+        import sqlite3
+
+        path = os.getenv("LOCAL_DB_PATH", "stroop_local.db") if source == "local" else source
+        with sqlite3.connect(str(path)) as db:
+            available = {row[1] for row in db.execute("PRAGMA table_info(stroop_trials)")}
+            names = [name for name in columns if name in available]
+            cursor = db.execute(f"SELECT {', '.join(names)} FROM stroop_trials ORDER BY id")
+            rows = [dict(zip(names, row)) for row in cursor]
+    else:
+        import pandas as pd
+
+        if suffix == ".parquet":
+            frame = pd.read_parquet(source)
+        elif suffix in (".jsonl", ".json"):
+            frame = pd.read_json(source, lines=True)
+            if 'table' in frame:
+                frame = frame[frame['table'] == 'stroop_trials']
+        else:
+            frame = pd.read_csv(source)
+        frame = frame[[name for name in columns if name in frame.columns]]
+        rows = frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+    labels = {}
+    for row in rows:
+        if row.get('result_version') != version:
+            continue
+        # Later rows win, as a session that was saved twice keeps its last result
+        labels[(str(row['user_id']), row['trial_type'], int(row['trial_number']))] = row
+    return labels
+
+def read_done(path):
+    if not path.exists():
+        return set()
+    return {line.strip() for line in path.read_text().splitlines() if line.strip()}
+
+class DatasetWriter:
+    # Appends trials to the shards and the index. Shards are created at their full size
+    # (a sparse file until rows are written), so a row's place never changes.
+    def __init__(self, root, rate=ARCHIVE_RATE, window_sec=pipeline.TRIAL_TIME_LIMIT, shard_trials=SHARD_TRIALS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest = {
+            "format": FORMAT_VERSION,
+            "rate": rate,
+            "window_sec": window_sec,
+            "window_frames": int(window_sec * rate),
+            "shard_trials": shard_trials,
+            "dtype": "int16"
+        }
+        manifest_path = self.root / MANIFEST_FILE
+        if manifest_path.exists():
+            stored = json.loads(manifest_path.read_text())
+            changed = {key for key, value in self.manifest.items() if stored.get(key) != value}
+            if changed:
+                raise ValueError(f"{self.root} was exported with different settings: {', '.join(sorted(changed))}")
+        else:
+            manifest_path.write_text(json.dumps({**self.manifest, "created": time.time()}, indent=2))
+
+        self.window_frames = self.manifest["window_frames"]
+        self.shard_trials = shard_trials
+        self.done = read_done(self.root / DONE_FILE)
+        self.rows = self._recover_index()
+        self._shard = None
+        self._shard_number = None
+        self._index = open(self.root / INDEX_FILE, "a")
+        self._done = open(self.root / DONE_FILE, "a")
+
+    def _recover_index(self):
+        # Index lines of a session that never reached sessions.done are dropped, and the
+        # audio rows they pointed to are written over by the next session
+        path = self.root / INDEX_FILE
+        if not path.exists():
+            return 0
+        kept = 0
+        rows = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    session_id = json.loads(line)["session_id"]
+                except ValueError:
+                    break
+                if session_id not in self.done:
+                    break
+                kept += len(line)
+                rows += 1
+        os.truncate(path, kept)
+        return rows
+
+    def _place(self, position):
+        shard, row = divmod(position, self.shard_trials)
+        if shard != self._shard_number:
+            self._close_shard()
+            path = self.root / shard_name(shard)
+            if path.exists():
+                self._shard = np.load(path, mmap_mode="r+")
+            else:
+                self._shard = np.lib.format.open_memmap(
+                    path, mode="w+", dtype=np.int16, shape=(self.shard_trials, self.window_frames)
+                )
+            self._shard_number = shard
+        return shard, row
+
+    def _close_shard(self):
+        if self._shard is not None:
+            self._shard.flush()
+            self._shard = None
+            self._shard_number = None
+
+    def add_session(self, session_id, phases, labels=None):
+        # Returns the number of trials written and how many of them had no stored transcript
+        labels = labels or {}
+        lines = []
+        unlabelled = 0
+        for phase, trials, audio, frames, spans in phases:
+            trial_type = TRIAL_TYPES.get(phase)
+            for i, trial in enumerate(trials):
+                shard, row = self._place(self.rows + len(lines))
+                self._shard[row] = audio[i]
+                stored = labels.get((session_id, trial_type, i + 1))
+                if stored is None:
+                    unlabelled += 1
+                span = spans[i]
+                lines.append(json.dumps({
+                    "shard": shard,
+                    "row": row,
+                    "frames": int(frames[i]),
+                    "session_id": session_id,
+                    "phase": phase,
+                    "trial_type": trial_type,
+                    "trial": i + 1,
+                    "word": trial["word"],
+                    "color": trial["color"],
+                    "expected": pipeline.expected_answer(trial, phase),
+                    "onset": float(span[0]) if span else None,
+                    "speech_end": float(span[1]) if span else None,
+                    "transcript": stored.get('transcript') if stored else None,
+                    "spoken_color": stored.get('spoken_color') if stored else None
+                }) + "\n")
+        if self._shard is not None:
+            self._shard.flush()
+
+        self._index.write("".join(lines))
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        # Only written after the index lines, so a crash repeats a session at most
+        self._done.write(session_id + "\n")
+        self._done.flush()
+        os.fsync(self._done.fileno())
+        self.done.add(session_id)
+        self.rows += len(lines)
+        return len(lines), unlabelled
+
+    def close(self):
+        self._close_shard()
+        self._index.close()
+        self._done.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TrialDataset:
+    # Random access to an exported dataset for training loaders. Shards are opened as
+    # read-only memory maps on first use, so only the rows read are paged in, and each
+    # loader process opens its own maps.
+    def __init__(self, root):
+        self.root = Path(root)
+        self.manifest = json.loads((self.root / MANIFEST_FILE).read_text())
+        self.rate = self.manifest["rate"]
+        done = read_done(self.root / DONE_FILE)
+        self.rows = []
+        with open(self.root / INDEX_FILE) as f:
+            for line in f:
+                row = json.loads(line)
+                # An export still running may have lines for a session it has not finished
+                if row["session_id"] not in done:
+                    break
+                self.rows.append(row)
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.audio(i), self.rows[i]
+
+    def __getstate__(self):
+        return {**self.__dict__, "_shards": {}}
+
+    def shard(self, shard):
+        array = self._shards.get(shard)
+        if array is None:
+            array = self._shards[shard] = np.load(self.root / shard_name(shard), mmap_mode="r")
+        return array
+
+    def audio(self, i):
+        # int16 samples of trial i, a view into the memory-mapped shard
+        row = self.rows[i]
+        return self.shard(row["shard"])[row["row"], :row["frames"]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Export archived trials as sharded training data")
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR", "archive"))
+    parser.add_argument("--output", required=True, help="dataset directory; an existing export is continued")
+    parser.add_argument("--labels", help="transcripts from stroop_trials: local, a SQLite database, "
+                                         "or a .csv, .parquet or .jsonl export such as rescore.py writes")
+    parser.add_argument("--version", help="result_version of the labels; default: the rows written by the app")
+    parser.add_argument("--rate", type=int, default=ARCHIVE_RATE)
+    parser.add_argument("--window-sec", type=float, default=pipeline.TRIAL_TIME_LIMIT)
+    parser.add_argument("--shard-trials", type=int, default=SHARD_TRIALS, help="trials per shard")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sessions", nargs="*", help="only these session ids")
+    args = parser.parse_args()
+
+    try:
+        writer = DatasetWriter(args.output, args.rate, args.window_sec, args.shard_trials)
+    except ValueError as e:
+        sys.exit(str(e))
+    labels = load_labels(args.labels, args.version) if args.labels else {}
+    archive = RecordingArchive(args.archive)
+    sessions = [s for s in (args.sessions or archive.sessions()) if s not in writer.done]
+    print(f"{len(sessions)} sessions to export, {len(writer.done)} already in {args.output}; "
+          f"{len(labels)} labelled trials")
+    if not sessions:
+        writer.close()
+        return 0
+
+    options = {"archive": args.archive, "rate": args.rate, "window_sec": args.window_sec}
+    failed = {}
+    exported = 0
+    trials = 0
+    unlabelled = 0
+    start = time.perf_counter()
+    pending = iter(sessions)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(args.workers, mp_context=context, initializer=init_worker, initargs=(options,)) as pool, \
+            writer:
+        # Sessions are written in archive order; at most two per worker are decoded ahead
+        in_flight = deque()
+        while True:
+            while len(in_flight) < 2 * args.workers:
+                session_id = next(pending, None)
+                if session_id is None:
+                    break
+                in_flight.append(pool.submit(export_session, session_id))
+            if not in_flight:
+                break
+
+            session_id, phases, problems = in_flight.popleft().result()
+            if problems:
+                failed[session_id] = problems
+                continue
+            written, missing = writer.add_session(session_id, phases, labels)
+            exported += 1
+            trials += written
+            unlabelled += missing
+            if exported % 50 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{exported + len(failed)}/{len(sessions)} sessions, {trials} trials, "
+                      f"{exported / elapsed:.2f} sessions/s", flush=True)
+
+    for session_id, problems in failed.items():
+        print(f"{session_id}: " + "; ".join(problems))
+    print(f"Exported {exported} sessions ({trials} trials, {unlabelled} without a transcript) "
+          f"in {time.perf_counter() - start:.1f}s, {len(failed)} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
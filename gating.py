@@ -0,0 +1,61 @@
+import numpy as np
+
+from asr import resample_linear
+from onset import decode_pcm
+from segmentation import WavSegment
+
+# Decides what is actually sent for transcription. Trial windows without detected speech
+# are not uploaded at all; voiced ones are cut to the speech plus some padding and
+# converted to 16 kHz mono 16-bit, which is all the recognizer uses anyway.
+
+UPLOAD_RATE = 16000
+
+class SpeechGate:
+    def __init__(self, pad_sec=0.25, target_rate=UPLOAD_RATE):
+        self.pad_sec = pad_sec
+        self.target_rate = target_rate
+
+    def trim(self, segment, span):
+        start = max(0.0, span[0] - self.pad_sec)
+        end = min(segment.duration, span[1] + self.pad_sec)
+        return segment.slice_seconds(start, end - start)
+
+    def convert(self, segment):
+        if segment.n_channels == 1 and segment.sampwidth == 2 and segment.framerate == self.target_rate:
+            return segment
+        samples = resample_linear(
+            decode_pcm(segment.pcm, segment.sampwidth, segment.n_channels),
+            segment.framerate,
+            self.target_rate
+        )
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+        return WavSegment(memoryview(pcm).cast('B'), 1, 2, self.target_rate)
+
+    def prepare(self, segment, span):
+        # The upload for one trial window, or None when it has no speech
+        if span is None:
+            return None
+        return self.convert(self.trim(segment, span))
+
+    def apply(self, segments, spans):
+        # Returns the uploads (None for skipped segments) and the savings for the report
+        stats = empty_stats()
+        uploads = []
+        for segment, span in zip(segments, spans):
+            upload = self.prepare(segment, span)
+            tally(stats, segment, upload)
+            uploads.append(upload)
+        return uploads, stats
+
+def empty_stats():
+    return {"segments": 0, "calls": 0, "calls_saved": 0, "bytes_original": 0, "bytes_uploaded": 0, "bytes_saved": 0}
+
+def tally(stats, segment, upload):
+    stats["segments"] += 1
+    stats["bytes_original"] += len(segment)
+    if upload is None:
+        stats["calls_saved"] += 1
+    else:
+        stats["calls"] += 1
+        stats["bytes_uploaded"] += len(upload)
+    stats["bytes_saved"] = stats["bytes_original"] - stats["bytes_uploaded"]
@@ -0,0 +1,153 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# One governor per server process sits in front of every Whisper request. Requests and
+# uploaded bytes are metered by token buckets, and waiting requests are served one
+# session at a time in rotation, so a participant with twenty queued segments cannot
+# hold back one who just finished. A 429 pauses everyone for the Retry-After time.
+
+# The session a request belongs to. Set by the job that processes a phase; the worker
+# threads of transcribe_stream run in a copy of the job's context.
+current_session = contextvars.ContextVar("asr_session", default=None)
+
+@contextmanager
+def session_scope(session_id):
+    token = current_session.set(session_id)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        # A rate of 0 turns the bucket off
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        # Seconds until amount can be taken. More than the capacity is allowed from a
+        # full bucket and leaves it in debt, so large uploads are slowed but never stuck.
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.tokens -= amount
+
+class RateGovernor:
+    def __init__(self, requests_per_sec=5.0, request_burst=10, bytes_per_sec=0, byte_burst=0, max_in_flight=20):
+        self.requests = TokenBucket(requests_per_sec, request_burst)
+        self.bytes = TokenBucket(bytes_per_sec, byte_burst or bytes_per_sec)
+        self.max_in_flight = max(1, max_in_flight)
+        self.granted = 0
+        self.rate_limited = 0
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._rotation = deque()
+        self._in_flight = 0
+        self._paused_until = 0.0
+
+    @contextmanager
+    def slot(self, nbytes=0, session=None):
+        self.acquire(nbytes, session)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, nbytes=0, session=None):
+        session = session if session is not None else current_session.get()
+        ticket = object()
+        enqueued = time.monotonic()
+        with self._cond:
+            queue = self._queues.get(session)
+            if queue is None:
+                queue = self._queues[session] = deque()
+                self._rotation.append(session)
+            queue.append(ticket)
+            self._publish()
+
+            while True:
+                now = time.monotonic()
+                if self._rotation[0] == session and queue[0] is ticket:
+                    delay = self._delay(nbytes, now)
+                    if delay is not None and delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+
+            # Served: the session goes to the back of the rotation if it has more waiting
+            queue.popleft()
+            self._rotation.popleft()
+            if queue:
+                self._rotation.append(session)
+            else:
+                del self._queues[session]
+            self.requests.take(1, now)
+            self.bytes.take(nbytes, now)
+            self._in_flight += 1
+            self.granted += 1
+            self._publish()
+            self._cond.notify_all()
+        metrics.observe("stroop_asr_queue_wait_seconds", time.monotonic() - enqueued)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._publish()
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        # Called on a 429; nothing is sent until the server's Retry-After has passed
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.rate_limited += 1
+            self._cond.notify_all()
+        metrics.inc("stroop_asr_rate_limited_total")
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": sum(len(q) for q in self._queues.values()),
+                "queued_sessions": len(self._queues),
+                "in_flight": self._in_flight,
+                "granted": self.granted,
+                "rate_limited": self.rate_limited,
+                "paused_for": max(0.0, self._paused_until - time.monotonic())
+            }
+
+    def _delay(self, nbytes, now):
+        # None means waiting for a request in flight to finish
+        if self._in_flight >= self.max_in_flight:
+            return None
+        return max(
+            self._paused_until - now,
+            self.requests.delay(1, now),
+            self.bytes.delay(nbytes, now)
+        )
+
+    def _publish(self):
+        if not metrics.enabled():
+            return
+        metrics.set_gauge("stroop_asr_queue_depth", sum(len(q) for q in self._queues.values()))
+        metrics.set_gauge("stroop_asr_queue_sessions", len(self._queues))
+        metrics.set_gauge("stroop_asr_in_flight", self._in_flight)
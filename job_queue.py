@@ -0,0 +1,307 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import metrics
+
+# Phase jobs shared between app replicas and a separate tier of worker processes
+# (worker.py). A replica stores the recording in a BlobStore, enqueues the phase and
+# only reads the job's state back while the participant waits. Workers claim jobs
+# under a lease they keep renewing; a job whose worker died is claimed again once the
+# lease runs out. SQLite on a shared volume and a plain directory stand in for a real
+# queue and object store, and only need these methods to be swapped out.
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(self, data):
+        # Returns the reference that goes into the job payload
+        ref = f"{uuid.uuid4().hex}.wav"
+        tmp = self.root / f".{ref}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(memoryview(data))
+        os.replace(tmp, self.root / ref)
+        return ref
+
+    def path(self, ref):
+        return self.root / ref
+
+    def delete(self, ref):
+        try:
+            (self.root / ref).unlink()
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, max_age_sec):
+        # Recordings of jobs that were discarded or given up on
+        cutoff = time.time() - max_age_sec
+        for path in self.root.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+class QueuedJob:
+    # A read-only snapshot with the same interface as jobs.Job, for the processing page
+    def __init__(self, row, results, warnings):
+        self.id = row["id"]
+        self.session_id = row["session_id"]
+        self.total = row["total"]
+        self.status = row["status"]
+        self.result = json.loads(row["result"]) if row["result"] is not None else None
+        self.error = row["error"]
+        self.warnings = warnings
+        self._partial = results
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def partial_results(self):
+        return self._partial
+
+    def progress(self):
+        return len(self._partial), self.total
+
+class ClaimedJob:
+    # What a worker gets: the payload plus report and warn, as on jobs.Job
+    def __init__(self, queue, job_id, payload, attempt):
+        self.queue = queue
+        self.id = job_id
+        self.payload = payload
+        self.attempt = attempt
+
+    def report(self, result):
+        self.queue._report(self.id, result)
+
+    def warn(self, message):
+        self.queue._warn(self.id, message)
+
+def _encode(value):
+    # Results carry NumPy scalars from the onset detector
+    return json.dumps(value, default=lambda v: v.item() if hasattr(v, "item") else str(v))
+
+class SqliteJobQueue:
+    def __init__(self, path, lease_sec=60, max_attempts=3, max_age_sec=3600):
+        self.path = str(path)
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.max_age_sec = max_age_sec
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, session_id TEXT, status TEXT NOT NULL, payload TEXT NOT NULL, "
+                "total INTEGER, result TEXT, error TEXT, worker TEXT, attempts INTEGER DEFAULT 0, "
+                "created REAL, started REAL, lease_until REAL, finished REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS job_results ("
+                "job_id TEXT, trial INTEGER, result TEXT, PRIMARY KEY (job_id, trial))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS job_warnings ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT, message TEXT)"
+            )
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    # App side
+
+    def enqueue(self, payload, session_id=None, total=0):
+        job_id = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, session_id, status, payload, total, created) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, session_id, _encode(payload), total, time.time())
+            )
+        self._update_gauge()
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            results = [
+                json.loads(r["result"])
+                for r in db.execute("SELECT result FROM job_results WHERE job_id = ? ORDER BY trial", (job_id,))
+            ]
+            warnings = [
+                r["message"]
+                for r in db.execute("SELECT message FROM job_warnings WHERE job_id = ? ORDER BY id", (job_id,))
+            ]
+        return QueuedJob(row, results, warnings)
+
+    def discard(self, job_id):
+        with self._connect() as db:
+            self._delete(db, [job_id])
+        self._update_gauge()
+
+    def discard_session(self, session_id):
+        with self._connect() as db:
+            ids = [r["id"] for r in db.execute("SELECT id FROM jobs WHERE session_id = ?", (session_id,))]
+            self._delete(db, ids)
+        self._update_gauge()
+
+    def stats(self):
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
+
+    def shutdown(self, wait=True):
+        # Nothing runs in the app process
+        pass
+
+    # Worker side
+
+    def claim(self, worker=None):
+        # The oldest queued job, or a running one whose worker stopped renewing its lease.
+        # BEGIN IMMEDIATE takes the write lock first, so two workers never get the same job.
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(db, now)
+                row = db.execute(
+                    "SELECT id, payload, attempts FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY created LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                attempt = row["attempts"] + 1
+                if attempt > self.max_attempts:
+                    db.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                        (f"gave up after {self.max_attempts} attempts", now, row["id"])
+                    )
+                    db.execute("COMMIT")
+                    return self.claim(worker)
+                # A retried job starts over, so results of the lost attempt are dropped
+                db.execute("DELETE FROM job_results WHERE job_id = ?", (row["id"],))
+                db.execute("DELETE FROM job_warnings WHERE job_id = ?", (row["id"],))
+                db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = ?, started = ?, lease_until = ? "
+                    "WHERE id = ?",
+                    (worker, attempt, now, now + self.lease_sec, row["id"])
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        metrics.inc("stroop_jobs_claimed_total", attempt=str(min(attempt, 3)))
+        self._update_gauge()
+        return ClaimedJob(self, row["id"], json.loads(row["payload"]), attempt)
+
+    def renew(self, job_ids):
+        # Called by the worker's heartbeat for every job it is still running
+        if not job_ids:
+            return
+        with self._connect() as db:
+            db.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                [(time.time() + self.lease_sec, job_id) for job_id in job_ids]
+            )
+
+    def complete(self, job_id, result):
+        # None counts as a failure, as with jobs.JobRunner
+        status = "done" if result is not None else "failed"
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ?",
+                (status, _encode(result) if result is not None else None, time.time(), job_id)
+            )
+        metrics.inc("stroop_jobs_total", status=status)
+        self._update_gauge()
+
+    def fail(self, job_id, error):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+        metrics.inc("stroop_jobs_total", status="failed")
+        self._update_gauge()
+
+    def _report(self, job_id, result):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO job_results (job_id, trial, result) VALUES (?, ?, ?)",
+                (job_id, result["trial"], _encode(result))
+            )
+
+    def _warn(self, job_id, message):
+        with self._connect() as db:
+            db.execute("INSERT INTO job_warnings (job_id, message) VALUES (?, ?)", (job_id, message))
+
+    def _expire(self, db, now):
+        # Finished jobs nobody collected are dropped once they are old enough
+        ids = [
+            r["id"] for r in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished < ?", (now - self.max_age_sec,)
+            )
+        ]
+        self._delete(db, ids)
+        # Trials reported by a worker after the page discarded its job
+        db.execute("DELETE FROM job_results WHERE job_id NOT IN (SELECT id FROM jobs)")
+        db.execute("DELETE FROM job_warnings WHERE job_id NOT IN (SELECT id FROM jobs)")
+
+    def _delete(self, db, ids):
+        for job_id in ids:
+            db.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM job_warnings WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _update_gauge(self):
+        if not metrics.enabled():
+            return
+        stats = self.stats()
+        metrics.set_gauge("stroop_jobs_active", stats["queued"] + stats["running"])
+
+class Heartbeat:
+    # Renews the leases of a worker's running jobs from a background thread
+    def __init__(self, queue, interval):
+        self.queue = queue
+        self.interval = interval
+        self._jobs = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-heartbeat", daemon=True)
+        self._thread.start()
+
+    def add(self, job_id):
+        with self._lock:
+            self._jobs.add(job_id)
+
+    def remove(self, job_id):
+        with self._lock:
+            self._jobs.discard(job_id)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                job_ids = list(self._jobs)
+            try:
+                self.queue.renew(job_ids)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not renew job leases: {e}")
@@ -0,0 +1,112 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Phase processing runs on a shared worker pool instead of the script thread. A job is
+# submitted with an id that the session keeps in st.session_state; the page polls the
+# job and shows each trial's result as it is reported. Jobs run without a Streamlit
+# script context, so warnings are collected on the job and rendered by the page.
+
+class Job:
+    def __init__(self, job_id, session_id, total):
+        self.id = job_id
+        self.session_id = session_id
+        self.total = total
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.warnings = []
+        self.created = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+        self._partial = {}
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def report(self, result):
+        with self._lock:
+            self._partial[result["trial"]] = result
+
+    def warn(self, message):
+        with self._lock:
+            self.warnings.append(message)
+
+    def partial_results(self):
+        with self._lock:
+            return [self._partial[k] for k in sorted(self._partial)]
+
+    def progress(self):
+        with self._lock:
+            return len(self._partial), self.total
+
+class JobRunner:
+    def __init__(self, max_workers=4, max_age_sec=3600):
+        self.max_age_sec = max_age_sec
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="phase-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, fn, session_id=None, total=0):
+        # fn(job) does the work and returns the job's result; None counts as a failure
+        job = Job(uuid.uuid4().hex, session_id, total)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn)
+        self._update_gauge()
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+        self._update_gauge()
+
+    def discard_session(self, session_id):
+        with self._lock:
+            for job_id in [i for i, job in self._jobs.items() if job.session_id == session_id]:
+                del self._jobs[job_id]
+        self._update_gauge()
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _run(self, job, fn):
+        job.status = "running"
+        metrics.observe("stroop_job_queue_seconds", time.monotonic() - job.created)
+        self._update_gauge()
+        try:
+            job.result = fn(job)
+            job.status = "done" if job.result is not None else "failed"
+        except Exception as e:
+            print(f"Job {job.id} failed: {e}")
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+        job.finished = time.monotonic()
+        metrics.inc("stroop_jobs_total", status=job.status)
+        self._update_gauge()
+
+    def _expire(self):
+        # Results nobody came back for are dropped once they are old enough
+        now = time.monotonic()
+        for job_id in [i for i, job in self._jobs.items() if job.done and now - job.finished > self.max_age_sec]:
+            del self._jobs[job_id]
+
+    def _update_gauge(self):
+        if not metrics.enabled():
+            return
+        stats = self.stats()
+        metrics.set_gauge("stroop_jobs_active", stats["queued"] + stats["running"])
@@ -0,0 +1,232 @@
+import threading
+import time
+
+import numpy as np
+
+from onset import (
+    FRAME_MS, NOISE_PERCENTILE, SNR_DB, MIN_ENERGY, MIN_SPEECH_FRAMES,
+    OnsetIndex, decode_pcm, frame_energy, speech_threshold
+)
+from segmentation import WavSegment
+from streaming import NOISE_HISTORY_SEC
+
+# Live capture for CAPTURE_MODE=webrtc. The participant's microphone is streamed over
+# WebRTC (streamlit-webrtc) and every frame is resampled to 16 kHz mono and written to a
+# per-session ring buffer. The phase job does not wait for an upload: it reads each trial
+# window from the buffer as soon as the audio after it has arrived, scores it for speech
+# against the noise of the preceding audio and sends it for transcription while the
+# participant is still naming the next words.
+#
+# Buffer positions are mapped to this server's clock from the arrival of the first
+# frame, and the trial presenter reports the test start the same way, so the network
+# delay of the audio and of the start message largely cancel out.
+
+LIVE_RATE = 16000
+# Enough for the noise history and a default phase, which is archived from the buffer
+BUFFER_SEC = 180.0
+# How long past its end a window waits for audio before it is scored with what arrived
+WINDOW_GRACE_SEC = 3.0
+# A stream this far behind the clock was stopped and started again
+RESYNC_SEC = 0.5
+
+class RingBuffer:
+    # int16 samples addressed by their absolute position since the stream started
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self.written = 0
+        self.ended = False
+        self._cond = threading.Condition()
+
+    @property
+    def oldest(self):
+        return max(0, self.written - self.capacity)
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        with self._cond:
+            start = self.written % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self.written += len(samples)
+            self._cond.notify_all()
+
+    def skip(self, count):
+        # Silence for positions the stream never delivered
+        with self._cond:
+            if count >= self.capacity:
+                self._data[:] = 0
+            else:
+                start = self.written % self.capacity
+                first = min(count, self.capacity - start)
+                self._data[start:start + first] = 0
+                self._data[:count - first] = 0
+            self.written += count
+            self._cond.notify_all()
+
+    def end(self):
+        with self._cond:
+            self.ended = True
+            self._cond.notify_all()
+
+    def wait_for(self, position, timeout):
+        # True once the buffer holds audio up to position
+        with self._cond:
+            return self._cond.wait_for(lambda: self.written >= position or self.ended, timeout) and \
+                self.written >= position
+
+    def read(self, start, end, pad=False):
+        # A copy of [start, end) without the positions not written yet. Positions before
+        # the oldest one still held are left out, or read as silence with pad so the
+        # result stays aligned to start.
+        with self._cond:
+            end = min(end, self.written)
+            missing = max(0, min(end, self.oldest) - start)
+            start = max(start, self.oldest)
+            if end <= start:
+                samples = np.empty(0, dtype=np.int16)
+            else:
+                first, last = start % self.capacity, end % self.capacity
+                if first < last or last == 0:
+                    samples = self._data[first:last or self.capacity].copy()
+                else:
+                    samples = np.concatenate((self._data[first:], self._data[:last]))
+        if pad and missing:
+            samples = np.concatenate((np.zeros(missing, dtype=np.int16), samples))
+        return samples
+
+class LiveRecorder:
+    # One participant's microphone stream; on_frame is the streamlit-webrtc frame callback
+    def __init__(self, rate=LIVE_RATE, buffer_sec=BUFFER_SEC):
+        self.rate = rate
+        self.buffer = RingBuffer(int(buffer_sec * rate))
+        self.origin = None
+        self.last_frame = None
+        self._resampler = None
+        self._next_time = None
+
+    def on_frame(self, frame):
+        import av
+
+        now = time.time()
+        if self._resampler is None:
+            self._resampler = av.AudioResampler(format="s16", layout="mono", rate=self.rate)
+        samples = np.concatenate(
+            [f.to_ndarray().reshape(-1) for f in self._resampler.resample(frame)] or [np.empty(0, np.int16)]
+        )
+
+        if self.origin is None:
+            # The first frame ended when it arrived
+            self.origin = now - len(samples) / self.rate
+        self.buffer.ended = False
+
+        frame_time = float(frame.pts * frame.time_base) if frame.pts is not None and frame.time_base else None
+        behind = self.position(now) - len(samples) - self.buffer.written
+        if behind > RESYNC_SEC * self.rate:
+            self.buffer.skip(behind)
+        elif frame_time is not None and self._next_time is not None:
+            # Packets lost on the way leave a gap in the timestamps; keep the buffer on time
+            gap = int((frame_time - self._next_time) * self.rate)
+            if gap > 0:
+                self.buffer.skip(gap)
+        if frame_time is not None:
+            self._next_time = frame_time + frame.samples / frame.sample_rate
+
+        self.buffer.write(samples)
+        self.last_frame = now
+        # Nothing is sent back to the browser
+        return frame
+
+    def on_ended(self):
+        self.buffer.end()
+
+    def position(self, epoch):
+        # Buffer position of a time.time() value
+        return int(round((epoch - self.origin) * self.rate))
+
+    def segment(self, start, end):
+        pcm = self.buffer.read(start, end, pad=True).tobytes()
+        return WavSegment(pcm, 1, 2, self.rate)
+
+    def wav(self, start_epoch, end_epoch):
+        # The audio between two times as WAV bytes, or None when it is no longer buffered
+        if self.origin is None:
+            return None
+        start, end = self.position(start_epoch), self.position(end_epoch)
+        if start < self.buffer.oldest:
+            return None
+        segment = self.segment(start, end)
+        return bytes(segment.header) + segment.pcm
+
+def live_trial_windows(recorder, test_start, window_starts, window_sec, grace_sec=WINDOW_GRACE_SEC,
+                       history_sec=NOISE_HISTORY_SEC, frame_ms=FRAME_MS,
+                       noise_percentile=NOISE_PERCENTILE, snr_db=SNR_DB, min_energy=MIN_ENERGY,
+                       min_speech_frames=MIN_SPEECH_FRAMES):
+    # Yields (index, segment, onset, span) per window in start order, like
+    # streaming.stream_trial_windows, blocking until each window's audio has arrived.
+    # test_start is the time.time() of the first trial; window starts are relative to it.
+    rate = recorder.rate
+    frame_size = max(1, int(rate * frame_ms / 1000))
+    lookahead = (max(1, min_speech_frames) - 1) * frame_size
+    window_length = int(window_sec * rate)
+
+    for i, start in sorted(enumerate(window_starts), key=lambda item: item[1]):
+        window_end = test_start + start + window_sec
+        # Wait until the audio should be here, then a little longer for the network
+        while recorder.origin is None and time.time() < window_end + grace_sec:
+            time.sleep(0.1)
+        if recorder.origin is None:
+            yield i, WavSegment(b"", 1, 2, rate), None, None
+            continue
+
+        first = recorder.position(test_start + start)
+        needed = first + window_length + lookahead
+        recorder.buffer.wait_for(needed, max(0.0, window_end + grace_sec - time.time()))
+
+        history = decode_pcm(recorder.buffer.read(needed - int(history_sec * rate), needed).tobytes(), 2, 1)
+        local = decode_pcm(recorder.buffer.read(first, needed, pad=True).tobytes(), 2, 1)
+        span = None
+        if len(history) >= frame_size and len(local) >= frame_size:
+            threshold = speech_threshold(frame_energy(history, frame_size), noise_percentile, snr_db, min_energy)
+            index = OnsetIndex.from_energy(
+                frame_energy(local, frame_size), rate, frame_size, threshold, min_speech_frames
+            )
+            span = index.spans([0.0], window_sec)[0]
+        yield i, recorder.segment(first, first + window_length), (span[0] if span else None), span
+
+class LiveCaptures:
+    # The recorders of the sessions on this server. A session keeps its recorder, and so
+    # its WebRTC stream, across both phases; ones without audio for max_age_sec are dropped.
+    def __init__(self, rate=LIVE_RATE, buffer_sec=BUFFER_SEC, max_age_sec=3600):
+        self.rate = rate
+        self.buffer_sec = buffer_sec
+        self.max_age_sec = max_age_sec
+        self._recorders = {}
+        self._created = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            self._sweep()
+            recorder = self._recorders.get(session_id)
+            if recorder is None:
+                recorder = self._recorders[session_id] = LiveRecorder(self.rate, self.buffer_sec)
+                self._created[session_id] = time.time()
+            return recorder
+
+    def release(self, session_id):
+        with self._lock:
+            self._recorders.pop(session_id, None)
+            self._created.pop(session_id, None)
+
+    def buffer_bytes(self):
+        with self._lock:
+            return {session_id: recorder.buffer._data.nbytes for session_id, recorder in self._recorders.items()}
+
+    def _sweep(self):
+        cutoff = time.time() - self.max_age_sec
+        for session_id, recorder in list(self._recorders.items()):
+            if (recorder.last_frame or self._created[session_id]) < cutoff:
+                del self._recorders[session_id]
+                del self._created[session_id]
@@ -0,0 +1,184 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide counters and histograms for the processing pipeline. Everything is a
+# no-op until configure(enabled=True) is called, so the hooks can stay in the hot path.
+# Metrics are served as Prometheus text on /metrics (and JSON on /metrics.json) when a
+# port is configured, and every observation can also be written as a JSON log line.
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(16384 * 4 ** i for i in range(8))
+
+_enabled = False
+_json_logger = None
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_server = None
+
+def configure(enabled=False, json_logs=False, port=None):
+    global _enabled, _json_logger, _server
+    _enabled = enabled
+    if enabled and json_logs and _json_logger is None:
+        _json_logger = logging.getLogger("saystroop.metrics")
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _json_logger.addHandler(handler)
+        _json_logger.setLevel(logging.INFO)
+        _json_logger.propagate = False
+    if enabled and port and _server is None:
+        _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+
+def enabled():
+    return _enabled
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _log(kind, name, value, labels):
+    if _json_logger is not None:
+        _json_logger.info(json.dumps({"ts": time.time(), "type": kind, "metric": name, "value": value, **labels}))
+
+def event(name, **fields):
+    # Per-session detail that would blow up label cardinality only goes to the JSON log
+    if _enabled and _json_logger is not None:
+        _json_logger.info(json.dumps({"ts": time.time(), "type": "event", "event": name, **fields}))
+
+def inc(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _log("counter", name, value, labels)
+
+def set_gauge(name, value, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+    _log("gauge", name, value, labels)
+
+def observe(name, value, **labels):
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    buckets = BYTES_BUCKETS if name.endswith("_bytes") else SECONDS_BUCKETS
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+    _log("histogram", name, value, labels)
+
+@contextmanager
+def _timer(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+def timer(stage, **labels):
+    if not _enabled:
+        return _NULL_TIMER
+    return _timer("stroop_stage_seconds", dict(labels, stage=stage))
+
+def timed(name, **labels):
+    if not _enabled:
+        return _NULL_TIMER
+    return _timer(name, labels)
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {k: dict(v, counts=list(v["counts"])) for k, v in _histograms.items()}
+
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in series}):
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in series.items():
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (series_name, labels), histogram in histograms.items():
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": [{"metric": n, **dict(l), "value": v} for (n, l), v in _counters.items()],
+            "gauges": [{"metric": n, **dict(l), "value": v} for (n, l), v in _gauges.items()],
+            "histograms": [
+                {"metric": n, **dict(l), "count": h["count"], "sum": h["sum"]}
+                for (n, l), h in _histograms.items()
+            ]
+        }
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,151 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FRAME_MS = 10
+# Frames quieter than this percentile of the recording are taken as background noise
+NOISE_PERCENTILE = 20
+# Speech has to be this many dB above the noise floor
+SNR_DB = 12
+# Absolute floor (about -60 dBFS) so digital silence does not make every click count as speech
+MIN_ENERGY = 1e-6
+# Consecutive loud frames needed before an onset is accepted
+MIN_SPEECH_FRAMES = 3
+
+def _pcm_to_int(pcm, sampwidth):
+    if sampwidth == 1:
+        return np.frombuffer(pcm, dtype=np.uint8), 128, 128
+    if sampwidth == 2:
+        return np.frombuffer(pcm, dtype='<i2'), 0, 32768
+    if sampwidth == 3:
+        raw = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        return (raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8, 0, 8388608
+    if sampwidth == 4:
+        return np.frombuffer(pcm, dtype='<i4'), 0, 2147483648
+    raise ValueError(f"unsupported sample width {sampwidth}")
+
+def decode_pcm(pcm, sampwidth, n_channels):
+    samples, offset, scale = _pcm_to_int(pcm, sampwidth)
+    # Channels are summed column by column, which is much faster than mean(axis=1) on a narrow axis
+    channels = samples.reshape(-1, n_channels)
+    audio = channels[:, 0].astype(np.float32)
+    for c in range(1, n_channels):
+        audio += channels[:, c]
+    if offset:
+        audio -= offset * n_channels
+    audio *= 1 / (scale * n_channels)
+    return audio
+
+def frame_energy(samples, frame_size):
+    n_frames = len(samples) // frame_size
+    frames = samples[:n_frames * frame_size].reshape(n_frames, frame_size)
+    return np.einsum('ij,ij->i', frames, frames) / frame_size
+
+def speech_threshold(energy, noise_percentile=NOISE_PERCENTILE, snr_db=SNR_DB, min_energy=MIN_ENERGY):
+    if len(energy) == 0:
+        return min_energy
+    noise_floor = np.percentile(energy, noise_percentile)
+    return max(noise_floor * 10 ** (snr_db / 10), min_energy)
+
+class OnsetIndex:
+    def __init__(self, samples, framerate, frame_ms=FRAME_MS, noise_percentile=NOISE_PERCENTILE,
+                 snr_db=SNR_DB, min_energy=MIN_ENERGY, min_speech_frames=MIN_SPEECH_FRAMES):
+        self.framerate = framerate
+        self.frame_size = max(1, int(framerate * frame_ms / 1000))
+        self.energy = frame_energy(samples, self.frame_size)
+        self.threshold = speech_threshold(self.energy, noise_percentile, snr_db, min_energy)
+        self._classify(min_speech_frames)
+
+    def _classify(self, min_speech_frames):
+        loud = self.energy > self.threshold
+        self.loud = loud
+        run = max(1, min_speech_frames)
+        if len(loud) >= run:
+            # Frame i starts speech when frames i..i+run-1 are all loud
+            self.speech = np.zeros(len(loud), dtype=bool)
+            self.speech[:len(loud) - run + 1] = sliding_window_view(loud, run).all(axis=1)
+        else:
+            self.speech = np.zeros(len(loud), dtype=bool)
+
+    @classmethod
+    def from_segment(cls, segment, **kwargs):
+        samples = decode_pcm(segment.pcm, segment.sampwidth, segment.n_channels)
+        return cls(samples, segment.framerate, **kwargs)
+
+    @classmethod
+    def from_energy(cls, energy, framerate, frame_size, threshold, min_speech_frames=MIN_SPEECH_FRAMES):
+        # For frame energies computed elsewhere, e.g. chunk by chunk in streaming.py
+        index = cls.__new__(cls)
+        index.framerate = framerate
+        index.frame_size = frame_size
+        index.energy = energy
+        index.threshold = threshold
+        index._classify(min_speech_frames)
+        return index
+
+    @property
+    def frame_sec(self):
+        return self.frame_size / self.framerate
+
+    def _window_frames(self, window_starts, window_sec):
+        starts = np.asarray(window_starts, dtype=np.float64)
+        first_frames = np.floor(starts / self.frame_sec).astype(np.int64)
+        frames_per_window = max(1, int(round(window_sec / self.frame_sec)))
+        frame_ids = first_frames[:, None] + np.arange(frames_per_window)[None, :]
+        valid = (frame_ids >= 0) & (frame_ids < len(self.speech))
+        return starts, np.clip(frame_ids, 0, max(len(self.speech) - 1, 0)), valid
+
+    def onsets(self, window_starts, window_sec):
+        if len(window_starts) == 0:
+            return []
+        if len(self.speech) == 0:
+            return [None] * len(window_starts)
+
+        starts, frame_ids, valid = self._window_frames(window_starts, window_sec)
+        hits = self.speech[frame_ids] & valid
+        found = hits.any(axis=1)
+        first = frame_ids[np.arange(len(starts)), hits.argmax(axis=1)]
+        onset_sec = np.maximum(first * self.frame_sec - starts, 0.0)
+        return [float(t) if f else None for t, f in zip(onset_sec, found)]
+
+    def spans(self, window_starts, window_sec):
+        # (onset, end) of the voiced part of each window, relative to the window start,
+        # or None when the window has no speech. The end is the last loud frame.
+        if len(window_starts) == 0:
+            return []
+        if len(self.speech) == 0:
+            return [None] * len(window_starts)
+
+        starts, frame_ids, valid = self._window_frames(window_starts, window_sec)
+        rows = np.arange(len(starts))
+        hits = self.speech[frame_ids] & valid
+        loud = self.loud[frame_ids] & valid
+        found = hits.any(axis=1)
+        first = frame_ids[rows, hits.argmax(axis=1)]
+        last = frame_ids[rows, frame_ids.shape[1] - 1 - loud[:, ::-1].argmax(axis=1)]
+        onset_sec = np.maximum(first * self.frame_sec - starts, 0.0)
+        end_sec = np.minimum((last + 1) * self.frame_sec - starts, window_sec)
+        return [(float(a), float(b)) if f else None for a, b, f in zip(onset_sec, end_sec, found)]
+
+    def regions(self, min_gap_sec=0.15, min_length_sec=0.1):
+        # Runs of loud frames as (start_sec, end_sec), bridging short pauses inside a word
+        padded = np.concatenate(([False], self.loud, [False]))
+        edges = np.flatnonzero(padded[1:] != padded[:-1])
+        starts, ends = edges[0::2], edges[1::2]
+        if len(starts) == 0:
+            return []
+
+        min_gap = int(round(min_gap_sec / self.frame_sec))
+        keep_gap = (starts[1:] - ends[:-1]) >= min_gap
+        starts = starts[np.concatenate(([True], keep_gap))]
+        ends = ends[np.concatenate((keep_gap, [True]))]
+
+        long_enough = (ends - starts) * self.frame_sec >= min_length_sec
+        return [(float(s * self.frame_sec), float(e * self.frame_sec))
+                for s, e in zip(starts[long_enough], ends[long_enough])]
+
+def detect_voice_start(segment, **kwargs):
+    try:
+        return OnsetIndex.from_segment(segment, **kwargs).onsets([0.0], segment.duration)[0]
+    except Exception as e:
+        print("VAD ERROR:", e)
+        return None
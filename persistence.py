@@ -0,0 +1,360 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# Write-behind persistence: sessions append their rows to a local SQLite spool and return
+# immediately. A background flusher batches rows from all sessions into the database and
+# removes them from the spool once the write is acknowledged. Delivery is at-least-once,
+# a write that times out after the server committed it can be repeated.
+
+TRIAL_TYPES = {1: 'color_naming', 2: 'word_reading'}
+# SQLSTATE classes a retry cannot fix: data exceptions, constraint violations, and
+# syntax errors or unknown columns
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+
+def permanent_error(error):
+    # True when the same rows will fail the same way however often they are sent.
+    # Connection errors, timeouts, 5xx answers, rate limits and authentication failures
+    # are not, and are retried for as long as they last.
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.ProgrammingError, TypeError)):
+        return True
+    code = getattr(error, "code", None)
+    # postgrest puts the HTTP status in code when the answer is not JSON
+    status = code if isinstance(code, int) else getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return 400 <= status < 500 and status not in (401, 403, 408, 429)
+    if isinstance(code, str):
+        # PGRST1xx are malformed requests, PGRST2xx unknown tables or columns
+        return (len(code) == 5 and code[:2] in PERMANENT_SQLSTATE_CLASSES) or code.startswith(("PGRST1", "PGRST2"))
+    return False
+
+def build_trial_records(results, user_id, trial_type):
+    records = []
+    for r in results:
+        records.append({
+            'user_id': user_id,
+            'trial_type': trial_type,
+            'trial_number': r['trial'],
+            'word_displayed': r['word'].upper(),
+            'color_displayed': r['color'],
+            'spoken_color': r['answer'].upper() if r['answer'] != 'NO RESPONSE' else None,
+            'transcript': r['transcript'],
+            'display_timestamp': r.get('absolute_timestamp', 0),
+            'speech_timestamp': r.get('speech_timestamp'),
+            'reaction_time': r['time'],
+            'correct': r['correct']
+        })
+    return records
+
+class SupabaseSink:
+    name = "supabase"
+
+    def __init__(self, client):
+        self.client = client
+
+    def write_users(self, rows):
+        self.client.table('stroop_users').upsert(rows).execute()
+
+    def write_trials(self, rows):
+        self.client.table('stroop_trials').insert(rows).execute()
+
+class LocalSink:
+    # Stand-in for Supabase with the same two tables, for development and tests
+    name = "local"
+
+    TRIAL_COLUMNS = (
+        'user_id', 'trial_type', 'trial_number', 'word_displayed', 'color_displayed',
+        'spoken_color', 'transcript', 'display_timestamp', 'speech_timestamp',
+        'reaction_time', 'correct', 'result_version'
+    )
+
+    def __init__(self, path):
+        self.path = str(path)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS stroop_users (id TEXT PRIMARY KEY, name TEXT)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS stroop_trials (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                + ", ".join(self.TRIAL_COLUMNS) + ")"
+            )
+            # Databases created before re-scoring existed lack the version column
+            existing = {row[1] for row in db.execute("PRAGMA table_info(stroop_trials)")}
+            for column in self.TRIAL_COLUMNS:
+                if column not in existing:
+                    db.execute(f"ALTER TABLE stroop_trials ADD COLUMN {column}")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write_users(self, rows):
+        with self._connect() as db:
+            db.executemany(
+                "INSERT INTO stroop_users (id, name) VALUES (:id, :name) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name",
+                rows
+            )
+
+    def write_trials(self, rows):
+        columns = ", ".join(self.TRIAL_COLUMNS)
+        values = ", ".join(f":{c}" for c in self.TRIAL_COLUMNS)
+        with self._connect() as db:
+            db.executemany(
+                f"INSERT INTO stroop_trials ({columns}) VALUES ({values})",
+                [{c: row.get(c) for c in self.TRIAL_COLUMNS} for row in rows]
+            )
+
+class JsonLinesSink:
+    # One JSON object per line, for re-scoring runs that should not touch the database
+    name = "jsonl"
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def _append(self, table, rows):
+        with open(self.path, "a") as f:
+            for row in rows:
+                f.write(json.dumps({"table": table, **row}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_users(self, rows):
+        self._append('stroop_users', rows)
+
+    def write_trials(self, rows):
+        self._append('stroop_trials', rows)
+
+class SpoolJournal:
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL DEFAULT 0, "
+            "created REAL NOT NULL)"
+        )
+        # Rows that still failed after max_attempts, kept for inspection and requeue_dead
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "created REAL NOT NULL, failed_at REAL NOT NULL, error TEXT)"
+        )
+        self._db.commit()
+
+    def append(self, entries):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO spool (kind, payload, created) VALUES (?, ?, ?)",
+                [(kind, json.dumps(payload), now) for kind, payload in entries]
+            )
+
+    def due(self, limit):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, kind, payload, attempts FROM spool WHERE next_attempt <= ? "
+                "ORDER BY id LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        return [(row_id, kind, json.loads(payload), attempts) for row_id, kind, payload, attempts in rows]
+
+    def acknowledge(self, ids):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+
+    def retry_later(self, ids, attempts, delay):
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE spool SET attempts = ?, next_attempt = ? WHERE id = ?",
+                [(attempts, time.time() + delay, i) for i in ids]
+            )
+
+    def bury(self, ids, error):
+        with self._lock, self._db:
+            now = time.time()
+            self._db.executemany(
+                "INSERT INTO dead_letter (id, kind, payload, attempts, created, failed_at, error) "
+                "SELECT id, kind, payload, attempts, created, ?, ? FROM spool WHERE id = ?",
+                [(now, error, i) for i in ids]
+            )
+            self._db.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+
+    def requeue_dead(self):
+        # Puts the dead rows back at the end of the spool once the cause is fixed
+        with self._lock, self._db:
+            count = self._db.execute(
+                "INSERT INTO spool (kind, payload, created) SELECT kind, payload, created FROM dead_letter ORDER BY id"
+            ).rowcount
+            self._db.execute("DELETE FROM dead_letter")
+        return count
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def dead(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+def unique_users(rows):
+    # (payload, spool ids) per user id. The spool is appended to rather than keyed, so a
+    # user can be queued more than once, and one upsert may touch each id only once; the
+    # row queued last wins.
+    groups = {}
+    for i, payload, _ in rows:
+        ids = groups[payload['id']][1] if payload['id'] in groups else []
+        ids.append(i)
+        groups[payload['id']] = (payload, ids)
+    return list(groups.values())
+
+class WriteBehindQueue:
+    def __init__(self, sink, journal, batch_size=500, flush_interval=1.0, base_backoff=1.0, max_backoff=60.0,
+                 max_attempts=20):
+        self.sink = sink
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.last_error = None
+        self.flushed_rows = 0
+        self._wake = threading.Event()
+        self._idle = threading.Condition()
+        self._stopped = False
+        # Rows left over from a previous process are picked up on the first pass
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+
+    def enqueue_session(self, user_row, trial_rows):
+        self.journal.append([('user', user_row)] + [('trial', row) for row in trial_rows])
+        if self.journal.pending() >= self.batch_size:
+            self._wake.set()
+
+    def flush(self, timeout=30):
+        # Blocks until the spool is empty or the timeout passes; returns whether it drained
+        deadline = time.monotonic() + timeout
+        while self.journal.pending():
+            self._wake.set()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            with self._idle:
+                self._idle.wait(min(remaining, self.flush_interval))
+        return True
+
+    def stop(self, timeout=30):
+        drained = self.flush(timeout)
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout)
+        return drained
+
+    def stats(self):
+        return {
+            "pending": self.journal.pending(),
+            "dead": self.journal.dead(),
+            "flushed_rows": self.flushed_rows,
+            "last_error": self.last_error
+        }
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            while self._flush_batch():
+                pass
+            with self._idle:
+                self._idle.notify_all()
+
+    def _flush_batch(self):
+        batch = self.journal.due(self.batch_size)
+        if not batch:
+            return False
+
+        users = [(i, payload, attempts) for i, kind, payload, attempts in batch if kind == 'user']
+        trials = [(i, payload, attempts) for i, kind, payload, attempts in batch if kind == 'trial']
+
+        # Users go first because trials reference them; if they fail the whole batch waits
+        if users and not self._write(self.sink.write_users, unique_users(users), users + trials, 'stroop_users'):
+            return False
+        if trials and not self._write(self.sink.write_trials, [(p, [i]) for i, p, _ in trials], trials, 'stroop_trials'):
+            return False
+        metrics.set_gauge("stroop_spool_pending_rows", self.journal.pending())
+        metrics.set_gauge("stroop_spool_dead_rows", self.journal.dead())
+        return len(batch) == self.batch_size
+
+    def _write(self, write, groups, retry_rows, table):
+        # groups: (payload, spool ids) pairs, one row each in the database
+        try:
+            with metrics.timed("stroop_db_flush_seconds", table=table):
+                write([payload for payload, _ in groups])
+        except Exception as e:
+            metrics.inc("stroop_db_flush_errors_total", table=table)
+            self.last_error = f"{type(e).__name__}: {e}"
+            attempts = max(a for _, _, a in retry_rows) + 1
+            if attempts >= self.max_attempts and permanent_error(e):
+                return self._write_each(write, groups, retry_rows, attempts, table)
+            self._retry(retry_rows, attempts, len(groups), e)
+            return False
+        self._written(groups, table)
+        return True
+
+    def _retry(self, retry_rows, attempts, count, error):
+        # Outages are waited out at up to max_backoff between attempts, however long they last
+        backoff = self.base_backoff * 2 ** min(attempts - 1, 30)
+        delay = min(self.max_backoff, backoff) * (0.5 + random.random())
+        print(f"Write-behind flush of {count} rows failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+        self.journal.retry_later([i for i, _, _ in retry_rows], attempts, delay)
+
+    def _write_each(self, write, groups, retry_rows, attempts, table):
+        # A batch still rejected after max_attempts is written one row at a time, so one
+        # bad row cannot hold back every later save. Rows the database rejects on their
+        # own go to the dead-letter table; if it becomes unreachable instead, the rest
+        # waits for the next attempt.
+        written = []
+        for payload, ids in groups:
+            try:
+                write([payload])
+            except Exception as e:
+                if not permanent_error(e):
+                    if written:
+                        self._written(written, table)
+                    self._retry(retry_rows, attempts, len(groups) - len(written), e)
+                    return False
+                self.journal.bury(ids, f"{type(e).__name__}: {e}")
+                metrics.inc("stroop_db_dead_rows_total", len(ids), table=table)
+                print(f"Write-behind gave up on a {table} row after {attempts} attempts: {e}")
+                continue
+            written.append((payload, ids))
+        if written:
+            self._written(written, table)
+        return True
+
+    def _written(self, groups, table):
+        self.journal.acknowledge([i for _, ids in groups for i in ids])
+        metrics.inc("stroop_db_rows_written_total", len(groups), table=table)
+        self.flushed_rows += len(groups)
+        self.last_error = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the write-behind spool")
+    parser.add_argument("--spool", default=os.getenv("SPOOL_PATH", "stroop_spool.db"))
+    parser.add_argument("--requeue-dead", action="store_true",
+                        help="send the dead-letter rows again, once whatever rejected them is fixed")
+    args = parser.parse_args()
+
+    journal = SpoolJournal(args.spool)
+    if args.requeue_dead:
+        print(f"Requeued {journal.requeue_dead()} rows; a running app or worker sends them on its next flush")
+    print(f"{args.spool}: {journal.pending()} rows pending, {journal.dead()} dead")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from types import SimpleNamespace
+
+import metrics
+from asr import RECORDING_LABEL
+from compact_audio import mono_pcm16
+from onset import OnsetIndex
+from segmentation import split_wav, read_wav_view, wav_header
+from streaming import open_recording, stream_trial_windows
+from gating import UPLOAD_RATE, empty_stats, tally
+
+# COLORS AND TRIAL SETTINGS
+# Longer protocols (hundreds of trials, 10+ minute phases) only need these two changed
+TRIAL_TIME_LIMIT = float(os.getenv("TRIAL_TIME_LIMIT", "2"))
+NUM_TRIALS = int(os.getenv("NUM_TRIALS", "20"))
+COLORS = ['red', 'blue', 'green', 'yellow', 'purple', 'orange']
+# Whisper rejects larger uploads
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+def generate_trials(num_trials=NUM_TRIALS):
+    trials = []
+    for _ in range(num_trials):
+        word = random.choice(COLORS)
+        available_colors = [c for c in COLORS if c != word]
+        color = random.choice(available_colors)
+        trials.append({'word': word, 'color': color})
+    return trials
+
+def segment_audio_wave(audio_bytes, test_start_offset_sec, segment_duration_sec=2, num_segments=20, warn=print):
+    try:
+        with metrics.timer("segment"):
+            return split_wav(audio_bytes, test_start_offset_sec, segment_duration_sec, num_segments)
+    except Exception as e:
+        warn(f"Error segmenting audio: {str(e)}")
+        return None
+
+def transcribe_segment(segment, segment_index, backend):
+    start = time.perf_counter()
+    try:
+        result = backend.transcribe(segment, f"segment {segment_index}")
+        metrics.observe("stroop_asr_request_seconds", time.perf_counter() - start, backend=backend.name, outcome="ok")
+        return result.text.lower().strip()
+    except Exception as e:
+        metrics.observe("stroop_asr_request_seconds", time.perf_counter() - start, backend=backend.name, outcome="error")
+        print(f"Error transcribing segment {segment_index}: {e}")
+        return None
+
+def recording_upload(audio_bytes, rate=UPLOAD_RATE, max_bytes=WHISPER_MAX_UPLOAD_BYTES):
+    # The phase recording as 16 kHz mono 16-bit WAV, the format segments are sent in, or
+    # None when even that is too large for one request
+    recording = read_wav_view(audio_bytes)
+    data_size = int(recording.nframes * rate / recording.framerate) * 2
+    if data_size + 44 > max_bytes:
+        return None
+    pcm = b"".join(chunk.tobytes() for chunk in mono_pcm16(recording, rate))
+    return wav_header(1, 2, rate, len(pcm)) + pcm
+
+def transcribe_recording(audio_bytes, backend, timeout=None):
+    # With a timeout the request runs in its own thread and is left to finish in the
+    # background once the time is up; None is returned as for a failed request
+    if timeout is not None:
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(contextvars.copy_context().run, transcribe_recording, audio_bytes, backend)
+        executor.shutdown(wait=False)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            metrics.inc("stroop_asr_deadline_fallbacks_total", kind="whole")
+            print(f"Whole-recording transcription took longer than {timeout:.1f}s")
+            return None
+
+    start = time.perf_counter()
+    try:
+        with metrics.timer("transcribe_whole"):
+            result = backend.transcribe(read_wav_view(audio_bytes), RECORDING_LABEL)
+        metrics.observe("stroop_asr_request_seconds", time.perf_counter() - start, backend=backend.name, outcome="ok")
+        return result
+    except Exception as e:
+        metrics.observe("stroop_asr_request_seconds", time.perf_counter() - start, backend=backend.name, outcome="error")
+        print(f"Error transcribing recording: {e}")
+        return None
+
+def transcribe_stream(items, backend, max_concurrency=5, on_transcript=None, deadline=None, fallback=None):
+    # Consumes (index, segment) pairs lazily and keeps at most two requests per worker
+    # queued, so long recordings are read only shortly before each segment is sent.
+    # Runs in worker threads, so errors are printed instead of sent to the page.
+    # on_transcript(i, transcript) is called as each segment finishes, in completion order,
+    # from the request's thread, so results go out even while items is waiting for audio.
+    # Segments still open at the deadline (a time.monotonic() value) get fallback(i, segment).
+    limit = max(1, max_concurrency)
+    transcripts = {}
+    in_flight = {}
+    lock = threading.Lock()
+    expired = False
+
+    def deliver(i, transcript):
+        with lock:
+            transcripts[i] = transcript
+            if on_transcript:
+                on_transcript(i, transcript)
+
+    def finish(future):
+        # Runs once per request, from its done callback or from wait_for_one
+        with lock:
+            entry = in_flight.pop(future, None)
+        if entry is None:
+            return
+        i, _ = entry
+        try:
+            transcript = future.result()
+        except Exception as e:
+            print(f"Error transcribing segment {i}: {e}")
+            transcript = None
+        deliver(i, transcript)
+
+    def remaining():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def wait_for_one():
+        # Returns False once the deadline has passed with nothing finished
+        with lock:
+            pending = list(in_flight)
+        done = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED).done
+        for future in done:
+            finish(future)
+        return bool(done)
+
+    executor = ThreadPoolExecutor(max_workers=limit)
+    try:
+        with metrics.timer("transcribe"):
+            for i, segment in items:
+                if not expired and deadline is not None and time.monotonic() >= deadline:
+                    expired = True
+                while not expired and len(in_flight) >= 2 * limit:
+                    expired = not wait_for_one()
+                if expired:
+                    deliver(i, fallback(i, segment) if fallback else None)
+                    continue
+                # Workers run in a copy of the caller's context, which carries the session (governor.py)
+                context = contextvars.copy_context()
+                future = executor.submit(context.run, transcribe_segment, segment, i, backend)
+                with lock:
+                    in_flight[future] = (i, segment)
+                future.add_done_callback(finish)
+            while in_flight and not expired:
+                expired = not wait_for_one()
+            with lock:
+                abandoned = list(in_flight.items())
+                in_flight.clear()
+            for future, (i, segment) in abandoned:
+                future.cancel()
+                deliver(i, fallback(i, segment) if fallback else None)
+    finally:
+        # Requests abandoned at the deadline finish in the background
+        executor.shutdown(wait=not expired, cancel_futures=True)
+    return transcripts
+
+def transcribe_segments(segments, backend, max_concurrency=5, on_transcript=None, indices=None):
+    # indices gives the trial number of each segment when some were left out
+    indices = list(indices) if indices is not None else list(range(len(segments)))
+    transcripts = transcribe_stream(zip(indices, segments), backend, max_concurrency, on_transcript)
+    return [transcripts.get(i) for i in indices]
+
+def extract_color_and_time(result):
+    if not result or not hasattr(result, "words") or result.words is None:
+        return None, None
+    words = getattr(result, "words", None)
+    if not words:
+        return None, None
+    for w in result.words:
+        clean_word = w.word.lower().strip(" ,.!?")
+        if clean_word in COLORS:
+            return clean_word, w.start
+
+    return None, None
+
+def parse_color_from_transcript(transcript):
+    if not transcript:
+        return None
+    for color in COLORS:
+        if color in transcript:
+            return color
+    return None
+
+def trial_window_starts(trial_timestamps, num_trials, test_start_offset):
+    # Trials skipped by a slow rerun leave gaps, so only trust a complete list
+    if len(trial_timestamps) >= num_trials:
+        return list(trial_timestamps[:num_trials])
+    return [test_start_offset + i * TRIAL_TIME_LIMIT for i in range(num_trials)]
+
+def align_words_to_trials(words, window_starts):
+    aligned = []
+    for i, window_start in enumerate(window_starts):
+        if i + 1 < len(window_starts):
+            window_end = window_starts[i + 1]
+        else:
+            window_end = window_start + TRIAL_TIME_LIMIT
+        window_words = [w for w in words if window_start <= w.start < window_end]
+
+        transcript = " ".join(w.word.lower().strip() for w in window_words)
+        color, color_start = extract_color_and_time(SimpleNamespace(words=window_words))
+        if color_start is not None:
+            onset = color_start
+        elif window_words:
+            onset = window_words[0].start
+        else:
+            onset = None
+
+        aligned.append({
+            "transcript": transcript,
+            "color": color,
+            "onset": onset
+        })
+    return aligned
+
+def detect_trial_onsets(audio_bytes, window_starts):
+    # Decodes the recording once and finds the voice onset of every trial window
+    try:
+        with metrics.timer("vad"):
+            index = OnsetIndex.from_segment(read_wav_view(audio_bytes))
+            return index.onsets(window_starts, TRIAL_TIME_LIMIT)
+    except Exception as e:
+        print("VAD ERROR:", e)
+        return [None] * len(window_starts)
+
+def expected_answer(trial, phase):
+    # Phase 1 names the ink color, phase 2 reads the word
+    return trial["color"] if phase == 1 else trial["word"]
+
+def score_answer(spoken_color, trial, phase):
+    if not spoken_color:
+        return False
+    return spoken_color == expected_answer(trial, phase)
+
+def segment_result(i, trial, phase, transcript, onset, segment_start, gated=False):
+    # Gated segments had no speech and were never sent, so there is no transcript to fail
+    if gated:
+        transcript = ""
+        spoken_color = None
+    elif transcript:
+        spoken_color = parse_color_from_transcript(transcript)
+    else:
+        transcript = "N/A"
+        spoken_color = None
+
+    if onset is not None:
+        speech_timestamp = segment_start + onset
+        reaction_time = onset
+    else:
+        speech_timestamp = None
+        reaction_time = TRIAL_TIME_LIMIT
+
+    return {
+        "trial": i + 1,
+        "word": trial["word"],
+        "color": trial["color"],
+        "answer": spoken_color if spoken_color else "NO RESPONSE",
+        "correct": score_answer(spoken_color, trial, phase),
+        "time": reaction_time,
+        "transcript": transcript,
+        "absolute_timestamp": segment_start,
+        "speech_timestamp": speech_timestamp
+    }
+
+def process_whole_audio(audio_bytes, trials, phase, trial_timestamps, test_start_offset, backend, timeout=None):
+    result = transcribe_recording(audio_bytes, backend, timeout)
+    if result is None or getattr(result, "words", None) is None:
+        return None
+
+    window_starts = trial_window_starts(trial_timestamps, len(trials), test_start_offset)
+    aligned = align_words_to_trials(result.words, window_starts)
+
+    results = []
+    for i, (trial, window, window_start) in enumerate(zip(trials, aligned, window_starts)):
+        spoken_color = window["color"]
+        if window["onset"] is not None:
+            speech_timestamp = window["onset"]
+            reaction_time = window["onset"] - window_start
+        else:
+            speech_timestamp = None
+            reaction_time = TRIAL_TIME_LIMIT
+
+        results.append({
+            "trial": i + 1,
+            "word": trial["word"],
+            "color": trial["color"],
+            "answer": spoken_color if spoken_color else "NO RESPONSE",
+            "correct": score_answer(spoken_color, trial, phase),
+            "time": reaction_time,
+            "transcript": window["transcript"] or "N/A",
+            "absolute_timestamp": window_start,
+            "speech_timestamp": speech_timestamp
+        })
+
+    return results
+
+def report_gate_savings(phase, stats):
+    saved = stats["bytes_saved"] / stats["bytes_original"] if stats["bytes_original"] else 0.0
+    print(
+        f"Phase {phase}: {stats['calls']}/{stats['segments']} segments uploaded "
+        f"({stats['calls_saved']} calls saved), {stats['bytes_uploaded']}/{stats['bytes_original']} bytes "
+        f"({saved:.0%} saved)"
+    )
+    metrics.inc("stroop_asr_calls_saved_total", stats["calls_saved"])
+    metrics.inc("stroop_asr_bytes_saved_total", stats["bytes_saved"])
+    metrics.inc("stroop_asr_bytes_uploaded_total", stats["bytes_uploaded"])
+
+def process_segmented_audio(audio_bytes, trials, phase, trial_timestamps, backend,
+                            mode="segmented", max_concurrency=5, warn=print, on_result=None, gate=None,
+                            deadline_sec=None, fallback_backend=None):
+    # on_result(result) receives each trial's result as soon as it is known. With a
+    # SpeechGate (gating.py) silent trials are not uploaded and the rest are trimmed.
+    # Segments not transcribed deadline_sec after the start go to fallback_backend (the
+    # local keyword spotter) or, without one, keep only their voice onset. In whole mode
+    # the single request gets half that time before the phase falls back to segments.
+    deadline = time.monotonic() + deadline_sec if deadline_sec else None
+    with metrics.timer("process_phase", mode=mode):
+        results = _process_phase(
+            audio_bytes, trials, phase, trial_timestamps, backend, mode, max_concurrency, warn, on_result, gate,
+            deadline, fallback_backend
+        )
+    count_phase(results)
+    return results
+
+def process_live_windows(windows, trials, phase, segment_starts, backend, max_concurrency=5, warn=print,
+                         on_result=None, gate=None, deadline=None, fallback_backend=None):
+    # For audio that is still being captured (live_capture.py): windows yields each trial
+    # window, starting at segment_starts, as soon as it has arrived, so transcription runs
+    # while the phase goes on. deadline is a time.monotonic() value, since only the caller
+    # knows when the phase ends.
+    with metrics.timer("process_phase", mode="live"):
+        results = _process_windows(windows, trials, phase, segment_starts, backend, max_concurrency, warn,
+                                   on_result, gate, deadline, fallback_backend)
+    count_phase(results)
+    return results
+
+def count_phase(results):
+    metrics.inc("stroop_phases_total", outcome="ok" if results else "failed")
+    if results:
+        metrics.inc("stroop_failed_segments_total", sum(1 for r in results if r["transcript"] == "N/A"))
+
+def _process_phase(audio_bytes, trials, phase, trial_timestamps, backend, mode, max_concurrency, warn, on_result, gate,
+                   deadline, fallback_backend):
+    test_start_offset = trial_timestamps[0] if trial_timestamps else 0
+
+    if mode == "whole":
+        upload = recording_upload(audio_bytes)
+        if upload is None:
+            warn("The recording is too long for one Whisper request, transcribing it per segment")
+        else:
+            # The single request may use half the time to the deadline, so the per-segment
+            # fallback still has the other half
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic()) / 2
+            results = process_whole_audio(upload, trials, phase, trial_timestamps, test_start_offset, backend,
+                                          timeout)
+            if results:
+                if on_result:
+                    for result in results:
+                        on_result(result)
+                return results
+            warn("Whole-recording transcription failed, falling back to per-segment mode")
+
+    try:
+        with open_recording(audio_bytes) as recording:
+            return _process_stream(recording, trials, phase, test_start_offset, backend, max_concurrency, warn,
+                                   on_result, gate, deadline, fallback_backend)
+    except Exception as e:
+        warn(f"Error segmenting audio: {str(e)}")
+        return None
+
+def _process_stream(recording, trials, phase, test_start_offset, backend, max_concurrency, warn, on_result, gate,
+                    deadline, fallback_backend):
+    # Each trial window is scored for speech and sent for transcription as soon as the
+    # stream reaches it; memory stays bounded however many trials there are
+    segment_starts = [test_start_offset + i * TRIAL_TIME_LIMIT for i in range(len(trials))]
+    windows = stream_trial_windows(recording, segment_starts, TRIAL_TIME_LIMIT)
+    return _process_windows(windows, trials, phase, segment_starts, backend, max_concurrency, warn, on_result, gate,
+                            deadline, fallback_backend)
+
+def _process_windows(windows, trials, phase, segment_starts, backend, max_concurrency, warn, on_result, gate,
+                     deadline, fallback_backend):
+    # windows yields (index, segment, onset, span) per trial, from a recording or live
+    onsets = [None] * len(trials)
+    results = [None] * len(trials)
+    stats = empty_stats()
+
+    def collect(i, transcript, gated=False):
+        results[i] = segment_result(i, trials[i], phase, transcript, onsets[i], segment_starts[i], gated)
+        if on_result:
+            on_result(results[i])
+
+    def uploads():
+        for i, segment, onset, span in windows:
+            onsets[i] = onset
+            if gate is None:
+                yield i, segment
+                continue
+            upload = gate.prepare(segment, span)
+            tally(stats, segment, upload)
+            if upload is None:
+                collect(i, None, gated=True)
+            else:
+                yield i, upload
+
+    late = set()
+
+    def fallback(i, segment):
+        late.add(i)
+        metrics.inc("stroop_asr_deadline_fallbacks_total", kind="local" if fallback_backend else "vad")
+        if fallback_backend is None:
+            return None
+        return transcribe_segment(segment, i, fallback_backend)
+
+    transcripts = transcribe_stream(
+        uploads(), backend, max_concurrency, on_transcript=collect, deadline=deadline, fallback=fallback
+    )
+    if late:
+        method = "the local recognizer" if fallback_backend else "voice onsets only"
+        warn(f"{len(late)} segments were not transcribed in time and used {method}")
+    if gate is not None:
+        report_gate_savings(phase, stats)
+    failed = sum(1 for i, t in transcripts.items() if t is None and i not in late)
+    if failed:
+        warn(f"{failed} of {len(transcripts)} segments could not be transcribed")
+
+    return results
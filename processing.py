@@ -0,0 +1,119 @@
+import os
+import time
+
+from resources import load_environment, get_asr_backend, get_fallback_backend, get_recording_archive
+
+# Processing of one phase recording, the same whether it runs on the app's own job pool
+# (jobs.py) or in a separate worker process (worker.py). The settings here and in
+# pipeline.py are read at import, so .env is loaded first.
+load_environment()
+
+import pipeline
+from gating import SpeechGate
+from live_capture import live_trial_windows
+from governor import session_scope
+from pipeline import TRIAL_TIME_LIMIT, COLORS
+
+# ASR SETTINGS
+# "segmented" uploads one file per trial, "whole" uploads the phase recording once
+TRANSCRIPTION_MODE = os.getenv("TRANSCRIPTION_MODE", "segmented")
+ASR_MAX_CONCURRENCY = int(os.getenv("ASR_MAX_CONCURRENCY", "5"))
+ASR_TIMEOUT_SEC = float(os.getenv("ASR_TIMEOUT_SEC", "15"))
+ASR_MAX_RETRIES = int(os.getenv("ASR_MAX_RETRIES", "2"))
+ASR_BACKOFF_SEC = float(os.getenv("ASR_BACKOFF_SEC", "0.5"))
+# "whisper", "local" (offline keyword spotter) or "local+whisper" (local first, low confidence to whisper)
+ASR_BACKEND = os.getenv("ASR_BACKEND", "whisper")
+KWS_TEMPLATE_DIR = os.getenv("KWS_TEMPLATE_DIR", "templates")
+KWS_MIN_CONFIDENCE = float(os.getenv("KWS_MIN_CONFIDENCE", "0.3"))
+# Silent trials are not uploaded; voiced ones are trimmed and sent as 16 kHz mono
+SPEECH_GATE = os.getenv("ASR_SPEECH_GATE", "1").lower() in ("1", "true", "yes")
+ASR_TRIM_PAD_SEC = float(os.getenv("ASR_TRIM_PAD_SEC", "0.25"))
+ASR_UPLOAD_RATE = int(os.getenv("ASR_UPLOAD_RATE", "16000"))
+# Segments still waiting this long after processing starts use the keyword spotter, or
+# keep only their voice onset when there are no templates (0 turns the deadline off)
+ASR_PHASE_DEADLINE_SEC = float(os.getenv("ASR_PHASE_DEADLINE_SEC", "120"))
+
+def default_asr_backend():
+    return get_asr_backend(
+        ASR_BACKEND,
+        KWS_TEMPLATE_DIR,
+        tuple(COLORS),
+        KWS_MIN_CONFIDENCE,
+        ASR_TIMEOUT_SEC,
+        ASR_MAX_RETRIES,
+        ASR_BACKOFF_SEC
+    )
+
+def speech_gate():
+    return SpeechGate(ASR_TRIM_PAD_SEC, ASR_UPLOAD_RATE) if SPEECH_GATE else None
+
+def deadline_fallback():
+    return get_fallback_backend(KWS_TEMPLATE_DIR, tuple(COLORS)) if ASR_PHASE_DEADLINE_SEC else None
+
+def archive_recording(session_id, phase, audio_bytes, trials, trial_timestamps):
+    archive = get_recording_archive()
+    if archive is None:
+        return
+    try:
+        archive.save(session_id, phase, audio_bytes, trials, trial_timestamps, TRIAL_TIME_LIMIT)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not archive recording {session_id} phase {phase}: {e}")
+
+def process_phase(job, session_id, phase, audio_bytes, trials, trial_timestamps, backend=None):
+    # job provides warn(message) and report(result); returns the phase results or None
+    backend = backend or default_asr_backend()
+
+    # Requests are queued per participant by the shared rate governor. The recording is
+    # archived afterwards, so compressing it does not delay the results.
+    try:
+        with session_scope(session_id):
+            return pipeline.process_segmented_audio(
+                audio_bytes,
+                trials,
+                phase,
+                trial_timestamps,
+                backend,
+                mode=TRANSCRIPTION_MODE,
+                max_concurrency=ASR_MAX_CONCURRENCY,
+                warn=job.warn,
+                on_result=job.report,
+                gate=speech_gate(),
+                deadline_sec=ASR_PHASE_DEADLINE_SEC,
+                fallback_backend=deadline_fallback()
+            )
+    finally:
+        archive_recording(session_id, phase, audio_bytes, trials, trial_timestamps)
+
+def process_live_phase(job, session_id, phase, recorder, trials, test_start, backend=None):
+    # Started when the first word is shown; scores each trial from the recorder's ring
+    # buffer (live_capture.py) as soon as its window has been captured. test_start is the
+    # time.time() of the first word on this server's clock.
+    backend = backend or default_asr_backend()
+    segment_starts = [i * TRIAL_TIME_LIMIT for i in range(len(trials))]
+    phase_end = test_start + len(trials) * TRIAL_TIME_LIMIT
+    # The deadline counts from the end of the phase, as it does from the upload otherwise
+    deadline = time.monotonic() + max(0.0, phase_end - time.time()) + ASR_PHASE_DEADLINE_SEC \
+        if ASR_PHASE_DEADLINE_SEC else None
+
+    with session_scope(session_id):
+        results = pipeline.process_live_windows(
+            live_trial_windows(recorder, test_start, segment_starts, TRIAL_TIME_LIMIT),
+            trials,
+            phase,
+            segment_starts,
+            backend,
+            max_concurrency=ASR_MAX_CONCURRENCY,
+            warn=job.warn,
+            on_result=job.report,
+            gate=speech_gate(),
+            deadline=deadline,
+            fallback_backend=deadline_fallback()
+        )
+
+    if recorder.origin is None:
+        job.warn("No audio was received from the microphone")
+        return None
+    audio_bytes = recorder.wav(test_start, phase_end)
+    if audio_bytes is not None:
+        archive_recording(session_id, phase, audio_bytes, trials, segment_starts)
+    return results
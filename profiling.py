@@ -0,0 +1,247 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter
+
+import numpy as np
+
+# In-process diagnostics for the admin page (admin.py). Nothing here runs until an
+# operator asks for it: the sampler runs in the admin's own script thread for the length
+# of one profile, and tracemalloc is started and stopped on request, so participants'
+# script runs pay nothing otherwise.
+#
+# Stacks are written in the folded format ("frame;frame;frame count" per line) that
+# flamegraph.pl, speedscope and most flame graph viewers read.
+
+SCRIPT_THREAD_PREFIX = "ScriptRunner.scriptThread"
+# Streamlit keeps the script run context of a script thread on the thread object
+SCRIPT_RUN_CTX_ATTR = "streamlit_script_run_ctx"
+
+def frame_label(frame):
+    code = frame.f_code
+    name = os.path.basename(code.co_filename)
+    if code.co_name == "<module>":
+        # Module level code, app.py above all, is told apart by line
+        return f"<module> ({name}:{frame.f_lineno})"
+    return f"{code.co_name} ({name}:{code.co_firstlineno})"
+
+def thread_label(thread, session_names):
+    ctx = getattr(thread, SCRIPT_RUN_CTX_ATTR, None)
+    session_id = getattr(ctx, "session_id", None)
+    if session_id is not None:
+        return f"session {session_names.get(session_id, session_id[:8])}"
+    return thread.name
+
+class Profile:
+    def __init__(self, stacks, samples, seconds, interval):
+        self.stacks = stacks
+        self.samples = samples
+        self.seconds = seconds
+        self.interval = interval
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def by_root(self):
+        # Samples per session or thread, the first frame of every stack
+        roots = Counter()
+        for stack, count in self.stacks.items():
+            roots[stack.split(";", 1)[0]] += count
+        return roots.most_common()
+
+    def top_functions(self, n=30):
+        # (function, self samples, total samples); a recursive function counts once per stack
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(name, own[name], count) for name, count in total.most_common(n)]
+
+class SamplingProfiler:
+    # Samples the stacks of every matching thread each interval with sys._current_frames.
+    # Runs in the calling thread, which is left out of the samples.
+    def __init__(self, interval=0.005, script_threads_only=True, session_names=None):
+        self.interval = interval
+        self.script_threads_only = script_threads_only
+        self.session_names = session_names or {}
+
+    def run(self, seconds):
+        stacks = Counter()
+        samples = 0
+        me = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_sample = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_sample:
+                time.sleep(next_sample - now)
+            next_sample += self.interval
+
+            threads = {t.ident: t for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                thread = threads.get(ident)
+                if ident == me or thread is None:
+                    continue
+                if self.script_threads_only and not thread.name.startswith(SCRIPT_THREAD_PREFIX):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.append(thread_label(thread, self.session_names))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+        return Profile(stacks, samples, time.perf_counter() - start, self.interval)
+
+class MemoryTracker:
+    # tracemalloc snapshots taken on request, each compared with the one before and the first
+    def __init__(self, max_snapshots=20):
+        self.max_snapshots = max_snapshots
+        self.snapshots = []
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, nframes=25):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(nframes)
+            self.snapshots = []
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self.snapshots = []
+
+    def snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        with self._lock:
+            # The first snapshot stays, as the reference for growth since tracing began
+            if len(self.snapshots) >= self.max_snapshots:
+                del self.snapshots[1]
+            self.snapshots.append((time.time(), snapshot))
+        return snapshot
+
+    def diff(self, against="previous", top=25, key_type="lineno"):
+        # Largest changes between the latest snapshot and the previous or the first one
+        with self._lock:
+            if len(self.snapshots) < 2:
+                return []
+            latest = self.snapshots[-1][1]
+            reference = self.snapshots[-2 if against == "previous" else 0][1]
+        return latest.compare_to(reference, key_type)[:top]
+
+    def folded(self):
+        # Live allocations of the latest snapshot by call stack, sized in bytes
+        with self._lock:
+            if not self.snapshots:
+                return ""
+            snapshot = self.snapshots[-1][1]
+        lines = []
+        for stat in snapshot.statistics("traceback"):
+            frames = [f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback]
+            lines.append(f"{';'.join(reversed(frames))} {stat.size}\n")
+        return "".join(lines)
+
+def deep_size(obj, seen=None):
+    # Bytes held by obj and everything it references, each object counted once
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + (deep_size(obj.base, seen) if obj.base is not None else 0)
+    if isinstance(obj, memoryview):
+        return obj.nbytes
+    if hasattr(obj, "getbuffer"):
+        # Uploaded files (st.audio_input) are BytesIO objects
+        try:
+            return sys.getsizeof(obj) + obj.getbuffer().nbytes
+        except (BufferError, ValueError):
+            pass
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+        # Shared by the whole process, not held by the session
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(deep_size(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    return size
+
+def process_rss():
+    # Resident set size in bytes, from /proc where there is one
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+def live_sessions():
+    # (session id, session_state dict, script runs) of every session on this server.
+    # Streamlit has no public API for this, so it is read from the runtime's session manager.
+    from streamlit.runtime import Runtime
+
+    if not Runtime.exists():
+        return []
+    try:
+        infos = Runtime.instance()._session_mgr.list_sessions()
+    except AttributeError:
+        # A Streamlit version without it, or the mocked runtime of AppTest
+        return []
+    sessions = []
+    for info in infos:
+        try:
+            state = dict(info.session.session_state.filtered_state)
+        except Exception as e:
+            state = {"<unreadable>": repr(e)}
+        sessions.append((info.session.id, state, getattr(info, "script_run_count", None)))
+    return sessions
+
+def session_sizes(recording_bytes=None, live_bytes=None):
+    # One row per session with the size of each session_state key. Recordings and live
+    # audio are kept outside session_state, so their sizes are looked up by user_id.
+    recording_bytes = recording_bytes or {}
+    live_bytes = live_bytes or {}
+    rows = []
+    for session_id, state, runs in live_sessions():
+        keys = {key: deep_size(value) for key, value in state.items()}
+        user_id = state.get("user_id")
+        rows.append({
+            "session": session_id,
+            "user_id": user_id,
+            "name": state.get("user_name"),
+            "script_runs": runs,
+            "state_bytes": sum(keys.values()),
+            "recording_bytes": recording_bytes.get(user_id, 0),
+            "live_audio_bytes": live_bytes.get(user_id, 0),
+            "keys": dict(sorted(keys.items(), key=lambda item: -item[1])),
+        })
+    rows.sort(key=lambda row: -(row["state_bytes"] + row["recording_bytes"] + row["live_audio_bytes"]))
+    return rows
@@ -0,0 +1,150 @@
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Holds each participant's phase recording outside st.session_state. Uploads are read
+# only when the widget's file id changes, large ones live in memory-mapped temp files,
+# and in-memory recordings over the global cap are spilled to disk oldest first.
+
+class _Recording:
+    def __init__(self, file_id, data):
+        self.file_id = file_id
+        self.size = len(data)
+        self.data = data
+        self.path = None
+        self.mmap = None
+        self.last_access = time.monotonic()
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    @property
+    def buffer(self):
+        return self.data if self.data is not None else self.mmap
+
+    def spill(self, spill_dir):
+        fd, path = tempfile.mkstemp(prefix="recording-", suffix=".wav", dir=spill_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.data)
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.path = path
+        self.data = None
+
+    def close(self):
+        self.data = None
+        if self.mmap is not None and not isinstance(self.mmap, bytes):
+            try:
+                self.mmap.close()
+            except BufferError:
+                # A segment view is still alive; the map is freed when it is collected
+                pass
+        self.mmap = None
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError as e:
+                print(f"Warning: Could not delete spilled recording {self.path}: {e}")
+            self.path = None
+
+class RecordingStore:
+    def __init__(self, spill_threshold=8 * 1024 * 1024, memory_cap=256 * 1024 * 1024,
+                 spill_dir=None, max_age_sec=3600):
+        self.spill_threshold = spill_threshold
+        self.memory_cap = memory_cap
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="saystroop-recordings-")
+        self.max_age_sec = max_age_sec
+        self._lock = threading.Lock()
+        self._recordings = OrderedDict()
+        self._memory_bytes = 0
+
+    def put(self, session_id, phase, uploaded_file):
+        key = (session_id, phase)
+        file_id = getattr(uploaded_file, "file_id", None)
+        with self._lock:
+            current = self._recordings.get(key)
+            if current is not None and file_id is not None and current.file_id == file_id:
+                self._touch(key, current)
+                return current.size
+
+        # Reading a whole upload at position 0 hands back the widget's bytes without a copy
+        uploaded_file.seek(0)
+        recording = _Recording(file_id, uploaded_file.read())
+        metrics.observe("stroop_upload_bytes", recording.size)
+        if recording.size > self.spill_threshold:
+            recording.spill(self.spill_dir)
+
+        with self._lock:
+            self._drop(key)
+            self._recordings[key] = recording
+            if recording.in_memory:
+                self._memory_bytes += recording.size
+            self._enforce_limits()
+        return recording.size
+
+    def get(self, session_id, phase):
+        key = (session_id, phase)
+        with self._lock:
+            recording = self._recordings.get(key)
+            if recording is None:
+                return None
+            self._touch(key, recording)
+            return recording.buffer
+
+    def release(self, session_id, phase):
+        with self._lock:
+            self._drop((session_id, phase))
+
+    def release_session(self, session_id):
+        with self._lock:
+            for key in [k for k in self._recordings if k[0] == session_id]:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            spilled = [r for r in self._recordings.values() if not r.in_memory]
+            return {
+                "recordings": len(self._recordings),
+                "memory_bytes": self._memory_bytes,
+                "spilled_recordings": len(spilled),
+                "spilled_bytes": sum(r.size for r in spilled)
+            }
+
+    def session_bytes(self):
+        # Recorded bytes per session, in memory or spilled
+        with self._lock:
+            sizes = {}
+            for (session_id, _), recording in self._recordings.items():
+                sizes[session_id] = sizes.get(session_id, 0) + recording.size
+            return sizes
+
+    def _touch(self, key, recording):
+        recording.last_access = time.monotonic()
+        self._recordings.move_to_end(key)
+
+    def _drop(self, key):
+        recording = self._recordings.pop(key, None)
+        if recording is None:
+            return
+        if recording.in_memory:
+            self._memory_bytes -= recording.size
+        recording.close()
+
+    def _enforce_limits(self):
+        # Recordings of abandoned sessions are removed, everything else is only spilled
+        now = time.monotonic()
+        for key in [k for k, r in self._recordings.items() if now - r.last_access > self.max_age_sec]:
+            self._drop(key)
+
+        for recording in self._recordings.values():
+            if self._memory_bytes <= self.memory_cap:
+                break
+            if recording.in_memory:
+                self._memory_bytes -= recording.size
+                recording.spill(self.spill_dir)
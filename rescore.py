@@ -0,0 +1,203 @@
+# Scores archived recordings again with the current segmentation, voice onset detection,
+# color parsing and ASR backend, and writes the results as a new version. Sessions are
+# spread over a pool of worker processes. Finished sessions are appended to a checkpoint
+# file after their rows are written, so an interrupted run picks up where it stopped.
+#
+#   python rescore.py --version vad-2025-03 --backend local --sink jsonl --output rescored.jsonl
+#   python rescore.py --version whisper-large --sink supabase --workers 8
+#
+# With ASR_CACHE_DIR set, segments whose audio and ASR settings did not change are not
+# sent again, so a run that only changes the parser or the VAD costs no API calls.
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import pipeline
+from archive import RecordingArchive
+from persistence import build_trial_records, TRIAL_TYPES
+
+_worker = {}
+
+def init_worker(options):
+    # Runs once in every worker process; clients and models are not shared across processes
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from asr import build_backend
+    from asr_cache import CachingBackend, TranscriptCache
+    from gating import SpeechGate
+    from governor import RateGovernor
+
+    client = None
+    if "whisper" in options["backend"]:
+        from openai import OpenAI
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+    # The request budget, when there is one, is split between the workers
+    governor = None
+    if os.getenv("ASR_RATE_LIMIT_RPS"):
+        governor = RateGovernor(
+            requests_per_sec=float(os.getenv("ASR_RATE_LIMIT_RPS")) / options["workers"],
+            request_burst=max(1, int(os.getenv("ASR_RATE_BURST", "10")) // options["workers"])
+        )
+    backend = build_backend(
+        options["backend"],
+        client=client,
+        template_dir=os.getenv("KWS_TEMPLATE_DIR", "templates"),
+        vocabulary=tuple(pipeline.COLORS),
+        min_confidence=float(os.getenv("KWS_MIN_CONFIDENCE", "0.3")),
+        governor=governor
+    )
+    if os.getenv("ASR_CACHE_DIR"):
+        backend = CachingBackend(backend, TranscriptCache(
+            max_entries=int(os.getenv("ASR_CACHE_ENTRIES", "4096")),
+            disk_dir=os.getenv("ASR_CACHE_DIR"),
+            disk_max_bytes=int(os.getenv("ASR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        ))
+
+    _worker.update(
+        archive=RecordingArchive(options["archive"]),
+        backend=backend,
+        gate=SpeechGate() if options["gate"] else None,
+        mode=options["mode"],
+        asr_concurrency=options["asr_concurrency"],
+        version=options["version"]
+    )
+
+def rescore_session(session_id):
+    # Returns (session_id, records, problems); a session with problems is not checkpointed
+    archive = _worker["archive"]
+    records = []
+    problems = []
+    for phase in archive.phases(session_id):
+        recording = archive.load(session_id, phase)
+        if recording is None:
+            continue
+        if recording.trial_sec != pipeline.TRIAL_TIME_LIMIT:
+            problems.append(
+                f"phase {phase} was recorded with {recording.trial_sec} s trials, "
+                f"TRIAL_TIME_LIMIT is {pipeline.TRIAL_TIME_LIMIT}"
+            )
+            continue
+        audio = recording.audio_bytes() if _worker["mode"] == "whole" else recording.audio()
+        results = pipeline.process_segmented_audio(
+            audio,
+            recording.trials,
+            phase,
+            recording.trial_timestamps,
+            _worker["backend"],
+            mode=_worker["mode"],
+            max_concurrency=_worker["asr_concurrency"],
+            warn=lambda message, phase=phase: problems.append(f"phase {phase}: {message}"),
+            gate=_worker["gate"]
+        )
+        if not results:
+            problems.append(f"phase {phase} could not be processed")
+            continue
+        for record in build_trial_records(results, session_id, TRIAL_TYPES[phase]):
+            record['result_version'] = _worker["version"]
+            records.append(record)
+    return session_id, records, problems
+
+def make_sink(args):
+    from persistence import JsonLinesSink, LocalSink, SupabaseSink
+
+    if args.sink == "jsonl":
+        return JsonLinesSink(args.output or f"rescore-{args.version}.jsonl")
+    if args.sink == "local":
+        return LocalSink(args.output or os.getenv("LOCAL_DB_PATH", "stroop_local.db"))
+    from dotenv import load_dotenv
+    from supabase import create_client
+    load_dotenv()
+    return SupabaseSink(create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")))
+
+def read_checkpoint(path):
+    if not path.exists():
+        return set()
+    return {line.strip() for line in path.read_text().splitlines() if line.strip()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score archived recordings with the current pipeline")
+    parser.add_argument("--archive", default=os.getenv("ARCHIVE_DIR", "archive"))
+    parser.add_argument("--version", required=True, help="stored in result_version of every new row")
+    parser.add_argument("--backend", default=os.getenv("ASR_BACKEND", "whisper"),
+                        choices=["whisper", "local", "local+whisper"])
+    parser.add_argument("--mode", default=os.getenv("TRANSCRIPTION_MODE", "segmented"), choices=["segmented", "whole"])
+    parser.add_argument("--sink", default="jsonl", choices=["jsonl", "local", "supabase"])
+    parser.add_argument("--output", help="JSON lines file or SQLite database for the jsonl and local sinks")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--asr-concurrency", type=int, default=int(os.getenv("ASR_MAX_CONCURRENCY", "5")))
+    parser.add_argument("--no-gate", action="store_true", help="upload every segment whole, as before speech gating")
+    parser.add_argument("--checkpoint", help="defaults to .rescore-<version>.done in the archive")
+    parser.add_argument("--sessions", nargs="*", help="only these session ids")
+    args = parser.parse_args()
+
+    archive = RecordingArchive(args.archive)
+    checkpoint = Path(args.checkpoint or Path(args.archive) / f".rescore-{args.version}.done")
+    done = read_checkpoint(checkpoint)
+    sessions = [s for s in (args.sessions or archive.sessions()) if s not in done]
+    print(f"{len(sessions)} sessions to score, {len(done)} already done according to {checkpoint}")
+    if not sessions:
+        return 0
+
+    sink = make_sink(args)
+    options = {
+        "archive": args.archive,
+        "backend": args.backend,
+        "mode": args.mode,
+        "gate": not args.no_gate,
+        "asr_concurrency": args.asr_concurrency,
+        "version": args.version,
+        "workers": args.workers
+    }
+
+    failed = {}
+    scored = 0
+    rows = 0
+    start = time.perf_counter()
+    pending = iter(sessions)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(args.workers, mp_context=context, initializer=init_worker, initargs=(options,)) as pool, \
+            open(checkpoint, "a") as checkpoint_file:
+        # At most two sessions per worker are queued; results are written as sessions finish
+        in_flight = set()
+        while True:
+            while len(in_flight) < 2 * args.workers:
+                session_id = next(pending, None)
+                if session_id is None:
+                    break
+                in_flight.add(pool.submit(rescore_session, session_id))
+            if not in_flight:
+                break
+
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                session_id, records, problems = future.result()
+                if problems:
+                    failed[session_id] = problems
+                    continue
+                if records:
+                    sink.write_trials(records)
+                # Only written after the rows are stored, so a crash repeats a session at most
+                checkpoint_file.write(session_id + "\n")
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+                scored += 1
+                rows += len(records)
+
+            elapsed = time.perf_counter() - start
+            print(f"{scored + len(failed)}/{len(sessions)} sessions, {rows} rows, "
+                  f"{scored / elapsed:.2f} sessions/s", flush=True)
+
+    for session_id, problems in failed.items():
+        print(f"{session_id}: " + "; ".join(problems))
+    print(f"Scored {scored} sessions ({rows} rows) in {time.perf_counter() - start:.1f}s, {len(failed)} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
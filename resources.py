@@ -0,0 +1,224 @@
+import atexit
+import os
+from pathlib import Path
+
+import streamlit as st
+
+# Shared by every session in the server process. Streamlit re-executes app.py on each
+# interaction, so anything expensive to build lives here behind st.cache_resource.
+
+STATIC_DIR = Path(__file__).parent / "static"
+
+# Settings are read when a resource is first built, after load_environment has run
+def env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+def env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    from dotenv import load_dotenv
+    load_dotenv()
+    return True
+
+@st.cache_resource(show_spinner=False)
+def configure_metrics():
+    import metrics
+
+    truthy = ("1", "true", "yes")
+    metrics.configure(
+        enabled=os.getenv("METRICS_ENABLED", "0").lower() in truthy,
+        json_logs=os.getenv("METRICS_JSON_LOGS", "0").lower() in truthy,
+        port=env_int("METRICS_PORT", 0) or None
+    )
+    return True
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client():
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=env_int("HTTP_MAX_CONNECTIONS", 50),
+            max_keepalive_connections=env_int("HTTP_MAX_KEEPALIVE", 20),
+            keepalive_expiry=env_float("HTTP_KEEPALIVE_EXPIRY_SEC", 60)
+        )
+    )
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+@st.cache_resource(show_spinner=False)
+def get_supabase_client():
+    from supabase import create_client
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+@st.cache_resource(show_spinner=False)
+def get_asr_backend(name, template_dir, vocabulary, min_confidence, timeout, max_retries, backoff):
+    from asr import build_backend
+
+    client = get_openai_client() if "whisper" in name else None
+    backend = build_backend(
+        name,
+        client=client,
+        template_dir=template_dir,
+        vocabulary=vocabulary,
+        min_confidence=min_confidence,
+        timeout=timeout,
+        max_retries=max_retries,
+        backoff=backoff,
+        governor=get_rate_governor(),
+        max_rate_limit_retries=env_int("ASR_MAX_RATE_LIMIT_RETRIES", 6),
+        hedging=hedging_options()
+    )
+    cache = get_transcript_cache()
+    if cache is None:
+        return backend
+    from asr_cache import CachingBackend
+    return CachingBackend(backend, cache)
+
+def hedging_options():
+    # Off unless asked for: every hedge is a second, billed Whisper request
+    if os.getenv("ASR_HEDGE", "0").lower() not in ("1", "true", "yes"):
+        return None
+    return {
+        "quantile": env_float("ASR_HEDGE_QUANTILE", 0.9),
+        "initial_delay": env_float("ASR_HEDGE_INITIAL_DELAY_SEC", 2.0),
+        "max_hedge_ratio": env_float("ASR_HEDGE_MAX_RATIO", 0.1),
+        # Two threads for every segment that can be transcribed at once in this process
+        "max_workers": env_int(
+            "ASR_HEDGE_MAX_WORKERS", 2 * env_int("JOB_WORKERS", 4) * env_int("ASR_MAX_CONCURRENCY", 5)
+        )
+    }
+
+@st.cache_resource(show_spinner=False)
+def get_fallback_backend(template_dir, vocabulary):
+    # Local keyword spotter for segments that miss the phase deadline; None without templates
+    from asr import KeywordSpotterBackend
+    try:
+        return KeywordSpotterBackend.from_directory(template_dir, vocabulary)
+    except ValueError:
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_rate_governor():
+    # Off unless a limit is configured; requests then go out as the ASR pools allow
+    if not (os.getenv("ASR_RATE_LIMIT_RPS") or os.getenv("ASR_BYTES_PER_SEC")):
+        return None
+    from governor import RateGovernor
+    return RateGovernor(
+        requests_per_sec=env_float("ASR_RATE_LIMIT_RPS", 0),
+        request_burst=env_int("ASR_RATE_BURST", 10),
+        bytes_per_sec=env_float("ASR_BYTES_PER_SEC", 0),
+        byte_burst=env_int("ASR_BYTE_BURST", 0),
+        max_in_flight=env_int("ASR_MAX_IN_FLIGHT", 20)
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_transcript_cache():
+    from asr_cache import TranscriptCache
+
+    max_entries = env_int("ASR_CACHE_ENTRIES", 4096)
+    disk_dir = os.getenv("ASR_CACHE_DIR") or None
+    if max_entries <= 0 and not disk_dir:
+        return None
+    return TranscriptCache(
+        max_entries=max_entries,
+        disk_dir=disk_dir,
+        disk_max_bytes=env_int("ASR_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_recording_store():
+    from recording_store import RecordingStore
+    return RecordingStore(
+        spill_threshold=env_int("RECORDING_SPILL_BYTES", 8 * 1024 * 1024),
+        memory_cap=env_int("RECORDING_MEMORY_CAP_BYTES", 256 * 1024 * 1024),
+        spill_dir=os.getenv("RECORDING_SPILL_DIR") or None,
+        max_age_sec=env_float("RECORDING_MAX_AGE_SEC", 3600)
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_write_behind():
+    from persistence import WriteBehindQueue, SpoolJournal, SupabaseSink, LocalSink
+
+    if os.getenv("PERSISTENCE_BACKEND", "supabase") == "local":
+        sink = LocalSink(os.getenv("LOCAL_DB_PATH", "stroop_local.db"))
+    else:
+        sink = SupabaseSink(get_supabase_client())
+
+    queue = WriteBehindQueue(
+        sink,
+        SpoolJournal(os.getenv("SPOOL_PATH", "stroop_spool.db")),
+        batch_size=env_int("WRITE_BATCH_SIZE", 500),
+        flush_interval=env_float("WRITE_FLUSH_INTERVAL_SEC", 1.0),
+        max_attempts=env_int("WRITE_MAX_ATTEMPTS", 20)
+    )
+    atexit.register(queue.stop, 10)
+    return queue
+
+@st.cache_resource(show_spinner=False)
+def get_recording_archive():
+    # Raw participant audio is only kept when ARCHIVE_DIR is set
+    root = os.getenv("ARCHIVE_DIR")
+    if not root:
+        return None
+    from archive import RecordingArchive
+    return RecordingArchive(
+        root,
+        compact=os.getenv("ARCHIVE_FORMAT", "compact") == "compact",
+        rate=env_int("ARCHIVE_RATE", 16000),
+        codec=os.getenv("ARCHIVE_CODEC", "zlib")
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_job_runner():
+    # With JOB_QUEUE=sqlite this is the shared queue that worker.py processes consume
+    if os.getenv("JOB_QUEUE", "thread") == "sqlite":
+        from job_queue import SqliteJobQueue
+        return SqliteJobQueue(
+            os.getenv("JOB_QUEUE_PATH", "stroop_jobs.db"),
+            lease_sec=env_float("JOB_LEASE_SEC", 60),
+            max_attempts=env_int("JOB_MAX_ATTEMPTS", 3),
+            max_age_sec=env_float("JOB_MAX_AGE_SEC", 3600)
+        )
+
+    from jobs import JobRunner
+
+    runner = JobRunner(
+        max_workers=env_int("JOB_WORKERS", 4),
+        max_age_sec=env_float("JOB_MAX_AGE_SEC", 3600)
+    )
+    atexit.register(runner.shutdown, False)
+    return runner
+
+@st.cache_resource(show_spinner=False)
+def get_job_blob_store():
+    # Where replicas leave recordings for the workers; must be shared with them
+    from job_queue import BlobStore
+    return BlobStore(os.getenv("JOB_BLOB_DIR", "job_audio"))
+
+@st.cache_resource(show_spinner=False)
+def get_live_captures():
+    # Microphone streams of CAPTURE_MODE=webrtc sessions; they only live in this process
+    from live_capture import LiveCaptures
+    return LiveCaptures(
+        buffer_sec=env_float("LIVE_BUFFER_SEC", 180),
+        max_age_sec=env_float("RECORDING_MAX_AGE_SEC", 3600)
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_rtc_configuration():
+    # STUN servers let the browser reach the server from behind NAT; comma separated
+    urls = [url.strip() for url in os.getenv("WEBRTC_ICE_SERVERS", "stun:stun.l.google.com:19302").split(",")]
+    return {"iceServers": [{"urls": [url]} for url in urls if url]}
+
+@st.cache_resource(show_spinner=False)
+def get_memory_tracker():
+    # Shared by every admin session, since tracemalloc is process-wide
+    from profiling import MemoryTracker
+    return MemoryTracker()
+
+@st.cache_resource(show_spinner=False)
+def load_css():
+    return f"<style>\n{(STATIC_DIR / 'style.css').read_text()}</style>"
@@ -0,0 +1,150 @@
+import io
+import struct
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def wav_header(n_channels, sampwidth, framerate, data_size):
+    block_align = n_channels * sampwidth
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, WAVE_FORMAT_PCM, n_channels, framerate,
+        framerate * block_align, block_align, sampwidth * 8,
+        b'data', data_size
+    )
+
+def read_wav_view(buffer):
+    # Walks the RIFF chunks and returns the PCM data as a view into buffer, no copy
+    view = memoryview(buffer).cast('B')
+    if len(view) < 12 or view[:4] != b'RIFF' or view[8:12] != b'WAVE':
+        raise ValueError("not a RIFF/WAVE file")
+
+    params = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = view[pos:pos + 4].tobytes()
+        chunk_size = struct.unpack_from('<I', view, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            audio_format, n_channels, framerate, _, _, bits = struct.unpack_from('<HHIIHH', view, body)
+            if audio_format not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE):
+                raise ValueError(f"unsupported WAV format {audio_format:#06x}")
+            params = (n_channels, (bits + 7) // 8, framerate)
+        elif chunk_id == b'data':
+            if params is None:
+                raise ValueError("data chunk before fmt chunk")
+            # Streamed recordings can leave the size as a placeholder, so clip to what exists
+            data = view[body:min(body + chunk_size, len(view))]
+            n_channels, sampwidth, framerate = params
+            block_align = n_channels * sampwidth
+            data = data[:len(data) - len(data) % block_align]
+            return WavSegment(data, n_channels, sampwidth, framerate)
+        pos = body + chunk_size + (chunk_size & 1)
+
+    raise ValueError("no data chunk in WAV file")
+
+class WavSegment:
+    def __init__(self, pcm, n_channels, sampwidth, framerate):
+        self.pcm = pcm
+        self.n_channels = n_channels
+        self.sampwidth = sampwidth
+        self.framerate = framerate
+        self._header = None
+
+    @property
+    def block_align(self):
+        return self.n_channels * self.sampwidth
+
+    @property
+    def nframes(self):
+        return len(self.pcm) // self.block_align
+
+    @property
+    def duration(self):
+        return self.nframes / self.framerate
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = wav_header(self.n_channels, self.sampwidth, self.framerate, len(self.pcm))
+        return self._header
+
+    def __len__(self):
+        return len(self.header) + len(self.pcm)
+
+    def slice_frames(self, start_frame, end_frame):
+        start_frame = max(0, start_frame)
+        return WavSegment(
+            self.pcm[start_frame * self.block_align:end_frame * self.block_align],
+            self.n_channels, self.sampwidth, self.framerate
+        )
+
+    def slice_seconds(self, start_sec, duration_sec):
+        start_frame = int(start_sec * self.framerate)
+        return self.slice_frames(start_frame, start_frame + int(duration_sec * self.framerate))
+
+    def open(self, name="segment.wav"):
+        return WavStream(self, name)
+
+    def to_bytes(self):
+        return self.header + self.pcm.tobytes()
+
+class WavStream(io.RawIOBase):
+    # Read-only file object over header + PCM view so uploads stream without a joined copy
+    def __init__(self, segment, name):
+        super().__init__()
+        self.name = name
+        self._header = memoryview(segment.header)
+        self._pcm = segment.pcm
+        self._size = len(self._header) + len(self._pcm)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence {whence}")
+        if pos < 0:
+            raise ValueError("negative seek position")
+        self._pos = pos
+        return pos
+
+    def readinto(self, b):
+        out = memoryview(b).cast('B')
+        written = 0
+        header_len = len(self._header)
+        while written < len(out) and self._pos < self._size:
+            if self._pos < header_len:
+                source = self._header[self._pos:]
+            else:
+                source = self._pcm[self._pos - header_len:]
+            n = min(len(source), len(out) - written)
+            out[written:written + n] = source[:n]
+            written += n
+            self._pos += n
+        return written
+
+def split_wav(audio_bytes, test_start_offset_sec, segment_duration_sec, num_segments):
+    recording = read_wav_view(audio_bytes)
+    start_frame = int(test_start_offset_sec * recording.framerate)
+    frames_per_segment = int(recording.framerate * segment_duration_sec)
+
+    segments = []
+    for i in range(num_segments):
+        segment_start = start_frame + i * frames_per_segment
+        segments.append(recording.slice_frames(segment_start, segment_start + frames_per_segment))
+    return segments
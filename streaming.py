@@ -0,0 +1,87 @@
+import mmap
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+from onset import (
+    FRAME_MS, NOISE_PERCENTILE, SNR_DB, MIN_ENERGY, MIN_SPEECH_FRAMES,
+    OnsetIndex, decode_pcm, frame_energy, speech_threshold
+)
+from segmentation import read_wav_view
+
+# Walks a recording in fixed-size chunks and hands out each trial window as soon as the
+# audio after it has been analysed. Only one chunk is decoded at a time and only the
+# frame energies of the trailing noise history are kept, so memory does not grow with
+# the length of the session. Windows are views into the source buffer; a file on disk
+# is memory-mapped, so its pages belong to the page cache rather than the process heap.
+
+CHUNK_SEC = 1.0
+# The noise floor is estimated from this much audio before the end of each window
+NOISE_HISTORY_SEC = 60.0
+
+@contextmanager
+def open_recording(source):
+    # Accepts WAV bytes, a memoryview or mmap, or the path of a WAV file
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield read_wav_view(mapped)
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                # A window is still referenced; the map is freed when it is collected
+                pass
+    else:
+        yield read_wav_view(source)
+
+def stream_trial_windows(recording, window_starts, window_sec, chunk_sec=CHUNK_SEC,
+                         history_sec=NOISE_HISTORY_SEC, frame_ms=FRAME_MS,
+                         noise_percentile=NOISE_PERCENTILE, snr_db=SNR_DB, min_energy=MIN_ENERGY,
+                         min_speech_frames=MIN_SPEECH_FRAMES):
+    # Yields (index, segment, onset, span) per window in start order. onset and span are
+    # relative to the window start as in OnsetIndex.spans; both are None without speech.
+    framerate = recording.framerate
+    frame_size = max(1, int(framerate * frame_ms / 1000))
+    frame_sec = frame_size / framerate
+    chunk_frames = max(1, int(round(chunk_sec / frame_sec))) * frame_size
+    history_frames = max(1, int(history_sec / frame_sec))
+    frames_per_window = max(1, int(round(window_sec / frame_sec)))
+    lookahead = max(1, min_speech_frames) - 1
+    total = recording.nframes // frame_size
+    window_length = int(window_sec * framerate)
+
+    energy = np.empty(0, dtype=np.float32)
+    energy_start = 0
+    position = 0
+
+    for i, start in sorted(enumerate(window_starts), key=lambda item: item[1]):
+        first = max(0, int(np.floor(start / frame_sec)))
+        # A speech run that starts in the last frames of a window can end in the next one
+        needed = min(first + frames_per_window + lookahead, total)
+
+        while energy_start + len(energy) < needed:
+            chunk = recording.slice_frames(position, position + chunk_frames)
+            position += chunk_frames
+            if chunk.nframes == 0:
+                break
+            samples = decode_pcm(chunk.pcm, chunk.sampwidth, chunk.n_channels)
+            energy = np.concatenate((energy, frame_energy(samples, frame_size)))
+
+        history = energy[max(0, needed - history_frames - energy_start):max(0, needed - energy_start)]
+        threshold = speech_threshold(history, noise_percentile, snr_db, min_energy)
+        local = energy[max(0, first - energy_start):max(0, needed - energy_start)]
+        index = OnsetIndex.from_energy(local, framerate, frame_size, threshold, min_speech_frames)
+        span = index.spans([start - first * frame_sec], window_sec)[0]
+
+        start_frame = int(start * framerate)
+        segment = recording.slice_frames(start_frame, start_frame + window_length)
+        yield i, segment, (span[0] if span else None), span
+
+        # Keep what the next window and the noise history still need
+        drop = min(first, needed - history_frames) - energy_start
+        if drop > 0:
+            energy = energy[drop:]
+            energy_start += drop
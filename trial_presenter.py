@@ -0,0 +1,46 @@
+import time
+from pathlib import Path
+
+import streamlit.components.v1 as components
+
+_component = components.declare_component(
+    "trial_presenter",
+    path=str(Path(__file__).parent / "components" / "trial_presenter")
+)
+
+def trial_presenter(trials, color_map, countdown_sec, trial_sec, header, key, report_start=False):
+    # Returns None while the phase is running, then the display times of every trial.
+    # With report_start the component also reports the first word, and returns
+    # {"finished": False, "test_start_time"} until the phase is over.
+    value = _component(
+        trials=trials,
+        color_map=color_map,
+        countdown_sec=countdown_sec,
+        trial_sec=trial_sec,
+        header=header,
+        report_start=report_start,
+        key=key,
+        default=None
+    )
+    if not value:
+        return None
+
+    if not value.get("finished", True):
+        # The browser's clock may differ from this server's, so the start is taken as the
+        # arrival of the message less the time it spent in the browser. Only the first run
+        # after the message sees the right time; later runs return a later one.
+        return {
+            "finished": False,
+            "test_start_time": time.time() - (value["sent_epoch"] - value["test_start_epoch"])
+        }
+
+    # A hidden tab can skip frames, so a trial that never painted keeps its scheduled time
+    timestamps = [
+        t if t is not None else i * trial_sec
+        for i, t in enumerate(value["trial_timestamps"])
+    ]
+    return {
+        "finished": True,
+        "trial_timestamps": timestamps,
+        "test_start_time": value["test_start_epoch"]
+    }
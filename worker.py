@@ -0,0 +1,134 @@
+# Processing tier for JOB_QUEUE=sqlite deployments. Each worker process claims phase jobs
+# from the shared queue, runs segmentation, speech detection and transcription on the
+# recording the app replica left in the blob store, saves the trial rows through the
+# write-behind spool and reports every trial back to the queue as it is scored. Start
+# as many as the ASR budget allows, on any machine that sees JOB_QUEUE_PATH and
+# JOB_BLOB_DIR; app replicas and workers scale independently.
+#
+#   JOB_QUEUE=sqlite python worker.py --concurrency 4
+
+import argparse
+import fcntl
+import itertools
+import mmap
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+os.environ.setdefault("JOB_QUEUE", "sqlite")
+
+from processing import TRANSCRIPTION_MODE, process_phase
+from persistence import build_trial_records, TRIAL_TYPES
+from resources import configure_metrics, get_job_blob_store, get_job_runner, get_write_behind
+from job_queue import Heartbeat, SqliteJobQueue
+
+SWEEP_INTERVAL_SEC = 60
+
+def claim_spool(base):
+    # Every worker on a machine needs its own write-behind spool, or two flushers would
+    # send the same rows. Workers take the first free numbered spool under a file lock,
+    # so a restarted worker picks up the rows its predecessor left behind.
+    for slot in itertools.count():
+        lock = open(f"{base}.worker{slot}.lock", "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        return f"{base}.worker{slot}", lock
+
+def load_recording(path):
+    # Whole-recording mode uploads the file as it is; the segmented stream reads a map of it
+    if TRANSCRIPTION_MODE == "whole":
+        return path.read_bytes(), None
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped, mapped
+
+def run_job(queue, blobs, job):
+    payload = job.payload
+    session_id = payload["session_id"]
+    phase = payload["phase"]
+    mapped = None
+    try:
+        audio, mapped = load_recording(blobs.path(payload["audio"]))
+        results = process_phase(job, session_id, phase, audio, payload["trials"], payload["trial_timestamps"])
+        if results:
+            # Both phases send the user row: they may run on workers with different spools,
+            # and the upsert is idempotent (copies in one batch are merged by unique_users)
+            get_write_behind().enqueue_session(
+                {'id': session_id, 'name': payload.get("user_name")},
+                build_trial_records(results, session_id, TRIAL_TYPES[phase])
+            )
+        queue.complete(job.id, results)
+    except FileNotFoundError:
+        queue.fail(job.id, "recording is no longer in the blob store")
+    except Exception as e:
+        print(f"Job {job.id} failed: {e}")
+        queue.fail(job.id, f"{type(e).__name__}: {e}")
+    finally:
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # A segment view is still alive; the map is freed when it is collected
+                pass
+    blobs.delete(payload["audio"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase processing worker")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKERS", "4")),
+                        help="phases processed at the same time by this process")
+    parser.add_argument("--poll", type=float, default=0.5, help="seconds between queue checks when idle")
+    parser.add_argument("--exit-when-idle", action="store_true", help="stop once the queue is empty")
+    args = parser.parse_args()
+
+    spool_path, spool_lock = claim_spool(os.getenv("SPOOL_PATH", "stroop_spool.db"))
+    os.environ["SPOOL_PATH"] = spool_path
+
+    configure_metrics()
+    queue = get_job_runner()
+    if not isinstance(queue, SqliteJobQueue):
+        sys.exit("worker.py needs JOB_QUEUE=sqlite")
+    blobs = get_job_blob_store()
+    heartbeat = Heartbeat(queue, queue.lease_sec / 3)
+
+    # SIGTERM stops claiming; phases already running are finished and saved
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    in_flight = set()
+    last_sweep = 0.0
+    print(f"Worker {os.getpid()} processing up to {args.concurrency} phases from {queue.path}, spool {spool_path}")
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="phase-worker") as executor:
+        while not stopping.is_set():
+            if time.monotonic() - last_sweep > SWEEP_INTERVAL_SEC:
+                blobs.sweep(queue.max_age_sec)
+                last_sweep = time.monotonic()
+
+            job = queue.claim() if len(in_flight) < args.concurrency else None
+            if job is not None:
+                heartbeat.add(job.id)
+                future = executor.submit(run_job, queue, blobs, job)
+                future.add_done_callback(lambda _, job_id=job.id: heartbeat.remove(job_id))
+                in_flight.add(future)
+                continue
+
+            if not in_flight and args.exit_when_idle:
+                break
+            if in_flight:
+                _, in_flight = wait(in_flight, timeout=args.poll, return_when=FIRST_COMPLETED)
+            else:
+                stopping.wait(args.poll)
+
+        wait(in_flight)
+    heartbeat.stop()
+    get_write_behind().flush()
+    spool_lock.close()
+
+if __name__ == "__main__":
+    main()